@@ -0,0 +1,57 @@
+"""
+Measure audio rendering speed against real time
+
+Renders an hour of sustained notes per waveform, optionally streaming
+to a WAV file, and reports how many times faster than real time it ran.
+"""
+
+import argparse
+import os
+import tempfile
+from time import perf_counter
+
+from pchip16.audio import (Audio, WavWriter, FRAME_RATE, NOISE, PULSE,
+    SAWTOOTH, TRIANGLE)
+
+class _Frame(object):
+    """Just enough of a VM for a frame listener"""
+    def __init__(self, audio):
+        self.audio = audio
+
+def run(wave, frames, writer=None):
+    """Return seconds taken to render frames of one waveform"""
+    audio = Audio()
+    audio.configure(4, 6, 10, 8, 12, wave)
+    frame = _Frame(audio)
+    start = perf_counter()
+    for count in range(frames):
+        if not count % FRAME_RATE:
+            audio.play(440 + count % 1000, 800)
+        audio.render()
+        if writer is not None:
+            writer(frame)
+    return perf_counter() - start
+
+def main():
+    """Render each waveform and print the speed-up over real time"""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-s', '--seconds', type=int, default=3600)
+    parser.add_argument('--wav', action='store_true',
+        help="also stream to a temporary WAV file")
+    args = parser.parse_args()
+    frames = args.seconds * FRAME_RATE
+    names = ('triangle', 'sawtooth', 'pulse', 'noise')
+    for name, wave in zip(names, (TRIANGLE, SAWTOOTH, PULSE, NOISE)):
+        if args.wav:
+            handle, path = tempfile.mkstemp(suffix='.wav')
+            os.close(handle)
+            with WavWriter(path) as writer:
+                elapsed = run(wave, frames, writer)
+            os.remove(path)
+        else:
+            elapsed = run(wave, frames)
+        print("%-8s %6.2fs for %is of audio, %7.1fx real time" % (name,
+            elapsed, args.seconds, args.seconds / elapsed))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Measure the cost of coverage recording in VM.run
+
+Runs Bounce.c16 frames and a tight ADD loop ending in a JMP, with and
+without a Coverage attached, and prints instructions per second.
+"""
+
+import argparse
+import os
+from time import perf_counter
+
+from pchip16.coverage import Coverage
+from pchip16.rom import ROM
+from pchip16.vm import CYCLES_PER_FRAME, VM
+
+BOUNCE = os.path.join(os.path.dirname(__file__), '..', 'data', 'Bounce.c16')
+# ADD R0, R1 fifteen times, then JMP 0
+LOOP = bytes([0x41, 0x10, 0x00, 0x00] * 15 + [0x10, 0x00, 0x00, 0x00])
+
+def run(vmac, frames, cycles):
+    """Return instructions per second over frames run() calls"""
+    count = 0
+    start = perf_counter()
+    for _ in range(frames):
+        count += vmac.run(cycles)
+    return count / (perf_counter() - start)
+
+def make_vms(rom):
+    """Return {name: (VM, cycles per call)} for each workload"""
+    bounce = VM()
+    bounce.load_rom(rom)
+    loop = VM()
+    loop.mem.fromstring(LOOP)
+    return {'bounce': (bounce, CYCLES_PER_FRAME), 'loop': (loop, 20000)}
+
+def main():
+    """Time each workload with and without coverage"""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('rom', nargs='?', default=BOUNCE)
+    parser.add_argument('-n', '--frames', type=int, default=300)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+    with open(args.rom, 'rb') as file_handle:
+        rom = ROM(file_handle)
+    for name in ('bounce', 'loop'):
+        best = {}
+        for _ in range(args.repeat):
+            for covered in (False, True):
+                vmac, cycles = make_vms(rom)[name]
+                if covered:
+                    vmac.coverage = Coverage()
+                rate = run(vmac, args.frames, cycles)
+                best[covered] = max(best.get(covered, 0), rate)
+        print("%-7s plain %9.0f/s  covered %9.0f/s  overhead %5.1f%%" % (
+            name, best[False], best[True],
+            (best[False] / best[True] - 1) * 100))
+
+if __name__ == '__main__':
+    main()
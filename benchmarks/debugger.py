@@ -0,0 +1,67 @@
+"""
+Measure the cost of the debugger on a tight ALU loop
+
+'plain' is a VM with no debugger, 'cleared' had a breakpoint and a
+watchpoint set and removed again, which must run at plain speed. The
+last two keep a breakpoint or watchpoint that never triggers. Each call
+runs enough instructions to take tens of milliseconds, the modes are
+timed in turn within every repeat and the best of all repeats is kept,
+so machine noise hits them alike.
+"""
+
+import argparse
+from timeit import timeit
+
+from pchip16.debugger import Debugger
+from pchip16.vm import VM
+
+# ADD R0, R1 fifteen times, then JMP 0
+LOOP = bytes([0x41, 0x10, 0x00, 0x00] * 15 + [0x10, 0x00, 0x00, 0x00])
+MODES = ('plain', 'cleared', 'breakpoint', 'watchpoint')
+
+def make_vm(mode):
+    """Return a VM running LOOP, set up for mode"""
+    vmac = VM()
+    vmac.mem.fromstring(LOOP)
+    debugger = Debugger(vmac)
+    if mode == 'cleared':
+        debugger.add_breakpoint(0xFFFC)
+        debugger.watch(0xF000, read=True)
+        debugger.clear()
+    elif mode == 'breakpoint':
+        debugger.add_breakpoint(0xFFFC)
+    elif mode == 'watchpoint':
+        debugger.watch(0xF000, read=True)
+    return vmac
+
+def interleaved(statements, number, repeat):
+    """Return the best seconds per loop of each (statement, namespace)
+
+    Every repeat times each statement once, starting one further along
+    each time so no statement always runs first.
+    """
+    best = [float('inf')] * len(statements)
+    for turn in range(repeat):
+        for offset in range(len(statements)):
+            index = (turn + offset) % len(statements)
+            statement, namespace = statements[index]
+            best[index] = min(best[index],
+                timeit(statement, globals=namespace, number=number))
+    return [seconds / number for seconds in best]
+
+def main():
+    """Time each mode and print instructions per second"""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-c', '--cycles', type=int, default=50000)
+    parser.add_argument('-n', '--number', type=int, default=3)
+    parser.add_argument('-r', '--repeat', type=int, default=16)
+    args = parser.parse_args()
+    best = interleaved([('vmac.run(cycles)', {'vmac': make_vm(mode),
+        'cycles': args.cycles}) for mode in MODES], args.number,
+        args.repeat)
+    for mode, seconds in zip(MODES, best):
+        print("%-10s %9.0f/s  %+6.1f%%" % (mode, args.cycles / seconds,
+            (seconds / best[0] - 1) * 100))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Measure whole-image disassembly
+
+Decodes a 64 KiB image word by word with the scalar disassembler and in
+bulk with decode() and texts(), and prints milliseconds for each.
+"""
+
+import argparse
+import os
+from time import perf_counter
+
+import numpy as np
+
+from pchip16.disasm import decode, disassemble, fetch, texts
+from pchip16.rom import ROM
+
+BOUNCE = os.path.join(os.path.dirname(__file__), '..', 'data', 'Bounce.c16')
+
+def image(rom):
+    """Return a 64 KiB image: the ROM repeated over random bytes"""
+    data = bytearray(np.random.RandomState(0).randint(0, 256, 2**16,
+        dtype=np.uint8).tobytes())
+    for offset in range(0, 2**16 - len(rom.data), 4 * len(rom.data)):
+        data[offset:offset + len(rom.data)] = rom.data
+    return bytes(data)
+
+def scalar(data):
+    """Disassemble every word with fetch() and disassemble()"""
+    return [disassemble(fetch(data, addr))
+        for addr in range(0, len(data) - 3, 4)]
+
+def vectorised(data):
+    """Decode every word at once, then format distinct op codes"""
+    return texts(decode(data))
+
+def main():
+    """Time both paths over the image"""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('rom', nargs='?', default=BOUNCE)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+    with open(args.rom, 'rb') as file_handle:
+        data = image(ROM(file_handle))
+    for name, func in (('scalar', scalar), ('decode', decode),
+            ('decode+texts', vectorised)):
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = perf_counter()
+            func(data)
+            best = min(best, perf_counter() - start)
+        print("%-14s %8.2f ms" % (name, best * 1000))
+
+if __name__ == '__main__':
+    main()
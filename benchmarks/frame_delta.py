@@ -0,0 +1,55 @@
+"""
+Compare full-frame and dirty-rectangle output on data/Bounce.c16
+
+Each frame is converted to RGB24 either whole or only in the regions
+frame_delta() reports, counting the bytes a viewer would receive.
+"""
+
+import argparse
+import os
+from time import perf_counter
+
+from pchip16.rom import ROM
+from pchip16.vm import VM
+
+BOUNCE = os.path.join(os.path.dirname(__file__), '..', 'data', 'Bounce.c16')
+
+def run(rom, frames, delta):
+    """Return (emulation seconds, output seconds, output bytes)"""
+    vmac = VM()
+    vmac.load_rom(rom)
+    gpu = vmac.gpu
+    emulation = output = 0.0
+    sent = 0
+    for _ in range(frames):
+        start = perf_counter()
+        vmac.run_frame()
+        middle = perf_counter()
+        if delta:
+            background, regions = gpu.frame_delta()
+            for _, _, pixels in regions:
+                sent += gpu.palette.to_rgb(pixels, background,
+                    out=None).nbytes + 4
+        else:
+            sent += gpu.rgb().nbytes
+        end = perf_counter()
+        emulation += middle - start
+        output += end - middle
+    return emulation, output, sent
+
+def main():
+    """Run both modes and print a comparison"""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('rom', nargs='?', default=BOUNCE)
+    parser.add_argument('-n', '--frames', type=int, default=300)
+    args = parser.parse_args()
+    with open(args.rom, 'rb') as file_handle:
+        rom = ROM(file_handle)
+    for name, delta in (('full', False), ('delta', True)):
+        emulation, output, sent = run(rom, args.frames, delta)
+        print("%-6s emulate %7.3fs  output %7.3fs (%6.1f us/frame)  "
+            "%10i bytes (%8.1f/frame)" % (name, emulation, output,
+            output / args.frames * 1e6, sent, sent / float(args.frames)))
+
+if __name__ == '__main__':
+    main()
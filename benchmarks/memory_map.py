@@ -0,0 +1,89 @@
+"""
+Measure the cost of the I/O map on RAM accesses
+
+Compares word reads and writes to RAM on plain Memory, on a VM's memory
+(the controller ports are latched into RAM, so nothing is mapped), on
+MappedMemory with the controller ports mapped, and on a naive subclass
+testing the address on every access. The variants are timed in turn
+within each repeat and the best of all repeats is kept, so machine
+noise hits them alike. Then runs data/Bounce.c16 with the VM as shipped
+and with its ports mapped.
+"""
+
+import argparse
+import os
+from timeit import timeit
+
+from pchip16.memory import Memory
+from pchip16.rom import ROM
+from pchip16.vm import VM, CONTROLLER_1, CONTROLLER_2
+
+BOUNCE = os.path.join(os.path.dirname(__file__), '..', 'data', 'Bounce.c16')
+
+class NaiveMemory(Memory):
+    """Controller ports checked inline on every access"""
+    def __getitem__(self, index):
+        if index >= 0xFFF0:
+            return 0
+        return Memory.__getitem__(self, index)
+
+    def __setitem__(self, index, value):
+        if index >= 0xFFF0:
+            return
+        Memory.__setitem__(self, index, value)
+
+def _port(index, value=None):
+    """I/O handler standing in for a device"""
+    return 0
+
+def memories():
+    """Return (name, memory) for each variant"""
+    mapped = Memory()
+    mapped.map_io(CONTROLLER_1, CONTROLLER_2 + 2, _port)
+    return [('plain', Memory()), ('VM', VM().mem), ('mapped', mapped),
+        ('naive if', NaiveMemory())]
+
+def interleaved(statements, number, repeat):
+    """Return the best ns per loop of each (statement, namespace)
+
+    Every repeat times each statement once, in order.
+    """
+    best = [float('inf')] * len(statements)
+    for _ in range(repeat):
+        for index, (statement, namespace) in enumerate(statements):
+            best[index] = min(best[index],
+                timeit(statement, globals=namespace, number=number))
+    return [seconds / number * 1e9 for seconds in best]
+
+def bounce_vm(rom, mapped):
+    """Return a VM loaded with rom, with its ports mapped if mapped"""
+    vmac = VM()
+    if mapped:
+        vmac.mem.map_io(CONTROLLER_1, CONTROLLER_2 + 2, _port)
+    vmac.load_rom(rom)
+    return vmac
+
+def main():
+    """Print per-access and per-frame timings"""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-n', '--number', type=int, default=100000)
+    parser.add_argument('-r', '--repeat', type=int, default=15)
+    parser.add_argument('-f', '--frames', type=int, default=120)
+    args = parser.parse_args()
+    variants = memories()
+    reads = interleaved([('mem[0x1234]', {'mem': mem})
+        for _, mem in variants], args.number, args.repeat)
+    writes = interleaved([('mem[0x1234] = 0xBEEF', {'mem': mem})
+        for _, mem in variants], args.number, args.repeat)
+    for (name, mem), read, write in zip(variants, reads, writes):
+        print("%-9s %-12s RAM read %6.1f ns  RAM write %6.1f ns" % (name,
+            type(mem).__name__, read, write))
+    with open(BOUNCE, 'rb') as file_handle:
+        rom = ROM(file_handle)
+    frames = interleaved([('vmac.run_frame()', {'vmac': bounce_vm(rom,
+        mapped)}) for mapped in (False, True)], args.frames, args.repeat)
+    for name, frame in zip(('VM', 'mapped'), frames):
+        print("Bounce %-9s %7.1f us per frame" % (name, frame / 1000))
+
+if __name__ == '__main__':
+    main()
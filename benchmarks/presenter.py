@@ -0,0 +1,82 @@
+"""
+Measure emulation throughput on Bounce.c16 with a slow frame consumer
+
+The consumer encodes each frame as PNG and then waits, standing in for
+a display or network write. Encoding competes with emulation for the
+CPU, so on a single core compare with --no-encode too. It runs either
+inline as a frame listener or behind a Presenter thread; with the
+presenter, run_frame throughput should match running with no consumer
+at all.
+"""
+
+import argparse
+import os
+from time import perf_counter, sleep
+
+from pchip16.presenter import Presenter
+from pchip16.recorder import encode_png, resolve
+from pchip16.rom import ROM
+from pchip16.vm import VM
+
+BOUNCE = os.path.join(os.path.dirname(__file__), '..', 'data', 'Bounce.c16')
+
+def slow_consumer(delay, encode):
+    """Return a consumer optionally encoding a PNG, then sleeping delay"""
+    def consume(frame):
+        if encode:
+            encode_png(resolve(frame.framebuffer, frame.background),
+                frame.colors)
+        sleep(delay)
+    return consume
+
+def run(rom, frames, mode, delay, buffers, encode):
+    """Return (frames per second, frames presented)"""
+    vmac = VM()
+    vmac.load_rom(rom)
+    presenter = None
+    presented = [0]
+    consume = slow_consumer(delay, encode)
+    if mode == 'inline':
+        def listener(vmac):
+            consume(_InlineFrame(vmac))
+            presented[0] += 1
+        vmac.add_frame_listener(listener)
+    elif mode == 'presenter':
+        presenter = Presenter(consume, buffers)
+        vmac.add_frame_listener(presenter)
+    start = perf_counter()
+    for _ in range(frames):
+        vmac.run_frame()
+    elapsed = perf_counter() - start
+    if presenter is not None:
+        presenter.close()
+        presented[0] = presenter.presented
+    return frames / elapsed, presented[0]
+
+class _InlineFrame(object):
+    """The fields of a Frame read straight from a VM"""
+    def __init__(self, vmac):
+        self.framebuffer = vmac.gpu.framebuffer
+        self.background = vmac.gpu.background
+        self.colors = vmac.gpu.palette.colors
+
+def main():
+    """Run each mode and print a comparison"""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('rom', nargs='?', default=BOUNCE)
+    parser.add_argument('-n', '--frames', type=int, default=600)
+    parser.add_argument('-d', '--delay', type=float, default=0.005,
+        help="seconds the consumer waits per frame")
+    parser.add_argument('-b', '--buffers', type=int, default=2)
+    parser.add_argument('--no-encode', dest='encode', action='store_false',
+        help="only wait, leaving every core to emulation")
+    args = parser.parse_args()
+    with open(args.rom, 'rb') as file_handle:
+        rom = ROM(file_handle)
+    for mode in ('none', 'inline', 'presenter'):
+        fps, presented = run(rom, args.frames, mode, args.delay,
+            args.buffers, args.encode)
+        print("%-9s %8.0f frames/s  %5i presented" % (mode, fps, presented))
+
+if __name__ == '__main__':
+    main()
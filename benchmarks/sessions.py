@@ -0,0 +1,55 @@
+"""
+Run many real time Bounce sessions on one event loop
+
+Reports how far the sessions kept up with 60 Hz: late and skipped frames
+and the frame interval percentiles over all sessions.
+"""
+
+import argparse
+import asyncio
+import os
+
+from pchip16.rom import ROM
+from pchip16.session import Histogram, SessionManager
+
+BOUNCE = os.path.join(os.path.dirname(__file__), '..', 'data', 'Bounce.c16')
+
+async def run(rom, sessions, seconds):
+    """Run sessions for seconds, returning them and the time taken"""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    manager = SessionManager()
+    for seed in range(sessions):
+        manager.add(rom, seed)
+    await asyncio.sleep(seconds)
+    stopped = list(manager.sessions.values())
+    await manager.close()
+    return stopped, loop.time() - start
+
+def main():
+    """Print a summary per session count"""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('rom', nargs='?', default=BOUNCE)
+    parser.add_argument('-n', '--sessions', type=int, nargs='+',
+        default=[10, 100, 300, 1000])
+    parser.add_argument('-t', '--seconds', type=float, default=3)
+    args = parser.parse_args()
+    with open(args.rom, 'rb') as file_handle:
+        rom = ROM(file_handle)
+    for sessions in args.sessions:
+        total = Histogram()
+        frames = late = skipped = 0
+        stopped, elapsed = asyncio.run(run(rom, sessions, args.seconds))
+        for session in stopped:
+            frames += session.frames
+            late += session.late
+            skipped += session.skipped
+            total.merge(session.frame_times)
+        print("%5i sessions: %7i frames (%5.1f fps each), %6i late, %6i "
+            "skipped, interval mean %.2f p50 %s p99 %s max %.1f ms" % (
+            sessions, frames, frames / float(sessions) / elapsed, late,
+            skipped, total.mean, total.percentile(50), total.percentile(99),
+            total.max))
+
+if __name__ == '__main__':
+    main()
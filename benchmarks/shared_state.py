@@ -0,0 +1,89 @@
+"""
+Compare piping pickled frames with shared memory observers on Bounce.c16
+
+A child process receives each frame's memory, registers and framebuffer.
+With a pipe the VM pickles them every frame; with shared memory the VM
+runs on the shared block and the child reads it in place under the
+seqlock. Both report the time the VM process spends per frame.
+"""
+
+import argparse
+import os
+import pickle
+from multiprocessing import get_context
+from time import perf_counter
+from zlib import crc32
+
+from pchip16.rom import ROM
+from pchip16.shared import SharedState
+from pchip16.vm import VM
+
+BOUNCE = os.path.join(os.path.dirname(__file__), '..', 'data', 'Bounce.c16')
+
+def _pipe_observer(conn):
+    """Unpickle frames until None, acknowledging each"""
+    while True:
+        data = conn.recv_bytes()
+        state = pickle.loads(data)
+        if state is None:
+            break
+        crc32(state[2])
+        conn.send_bytes(b'')
+
+def _shared_observer(name, frames, conn):
+    """Checksum every frame of the shared VM as it completes"""
+    with SharedState(name) as state:
+        for frame in range(1, frames + 1):
+            state.wait(frame)
+            while True:
+                sequence = state.begin()
+                crc32(state.framebuffer)
+                if not state.retry(sequence):
+                    break
+            conn.send_bytes(b'')
+
+def run(rom, frames, shared):
+    """Return (run_frame, publishing) seconds per frame in the VM process"""
+    vmac = VM()
+    vmac.load_rom(rom)
+    context = get_context('spawn')
+    parent, child = context.Pipe()
+    if shared:
+        state = vmac.share()
+        process = context.Process(target=_shared_observer,
+            args=(state.name, frames, child))
+    else:
+        process = context.Process(target=_pipe_observer, args=(child,))
+    process.start()
+    emulation = publish = 0.0
+    for _ in range(frames):
+        start = perf_counter()
+        vmac.run_frame()
+        emulation += perf_counter() - start
+        start = perf_counter()
+        if not shared:
+            parent.send_bytes(pickle.dumps((vmac.mem._mem.tobytes(),
+                vmac.register.tobytes(), vmac.gpu.framebuffer), 5))
+        publish += perf_counter() - start
+        parent.recv_bytes()
+    if not shared:
+        parent.send_bytes(pickle.dumps(None))
+    process.join()
+    vmac.unshare()
+    return emulation / frames, publish / frames
+
+def main():
+    """Run both transports and print a comparison"""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('rom', nargs='?', default=BOUNCE)
+    parser.add_argument('-n', '--frames', type=int, default=300)
+    args = parser.parse_args()
+    with open(args.rom, 'rb') as file_handle:
+        rom = ROM(file_handle)
+    for name, shared in (('pipe', False), ('shared', True)):
+        emulation, publish = run(rom, args.frames, shared)
+        print("%-6s run_frame %8.1f us  publishing %8.1f us per frame" % (
+            name, emulation * 1e6, publish * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Measure what the sprite cache costs RAM writes and saves on DRW
+
+Draws a 16x16 sprite through VM.execute with and without the cache,
+times a RAM write on the VM's memory once a sprite has been drawn, and
+runs data/Bounce.c16.
+"""
+
+import argparse
+import os
+from timeit import timeit
+
+from pchip16.rom import ROM
+from pchip16.vm import VM
+
+BOUNCE = os.path.join(os.path.dirname(__file__), '..', 'data', 'Bounce.c16')
+
+# SPR 16x16 ; DRW R0, R1, 0x400
+SPR = 0x04000810
+DRW = 0x05100004
+
+def interleaved(statements, number, repeat):
+    """Return the best ns per loop of each (statement, namespace)
+
+    Every repeat times each statement once, in order.
+    """
+    best = [float('inf')] * len(statements)
+    for _ in range(repeat):
+        for index, (statement, namespace) in enumerate(statements):
+            best[index] = min(best[index],
+                timeit(statement, globals=namespace, number=number))
+    return [seconds / number * 1e9 for seconds in best]
+
+def drawn_vm(cached):
+    """Return a VM that has drawn the sprite once"""
+    vmac = VM(0)
+    for addr in range(0x400, 0x480, 2):
+        vmac.mem[addr] = 0x1234
+    vmac.execute(SPR)
+    if not cached:
+        vmac.sprite_cache = None
+    vmac.execute(DRW)
+    return vmac
+
+def main():
+    """Print per-access and per-frame timings"""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-n', '--number', type=int, default=5000)
+    parser.add_argument('-r', '--repeat', type=int, default=15)
+    parser.add_argument('-f', '--frames', type=int, default=120)
+    args = parser.parse_args()
+    vms = [drawn_vm(cached) for cached in (False, True)]
+    draws = interleaved([('vmac.execute(DRW)', {'vmac': vmac, 'DRW': DRW})
+        for vmac in vms], args.number, args.repeat)
+    writes = interleaved([('vmac.mem[0x1234] = 0xBEEF', {'vmac': vmac})
+        for vmac in vms], 20 * args.number, args.repeat)
+    for vmac, draw, write in zip(vms, draws, writes):
+        print("%-8s %-18s DRW %7.1f ns  RAM write %6.1f ns" % (
+            'uncached' if vmac.sprite_cache is None else 'cached',
+            type(vmac.mem).__name__, draw, write))
+    with open(BOUNCE, 'rb') as file_handle:
+        rom = ROM(file_handle)
+    vmac = VM(0)
+    vmac.load_rom(rom)
+    frame, = interleaved([('vmac.run_frame()', {'vmac': vmac})],
+        args.frames, args.repeat)
+    print("Bounce %7.1f us per frame (%s)" % (frame / 1000,
+        type(vmac.mem).__name__))
+
+if __name__ == '__main__':
+    main()
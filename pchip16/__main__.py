@@ -0,0 +1,228 @@
+"""
+pchip16 command line
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from os import cpu_count
+
+from . import cfg, coverage, disasm, golden, server
+from .rom import ROM
+from .vm import VM
+
+def _golden(args):
+    """Run golden record or verify, printing one line per ROM"""
+    if args.action == 'record':
+        results = golden.record(args.roms, args.frames, args.seed, args.jobs,
+            args.directory)
+    else:
+        results = golden.verify(args.roms, args.jobs, args.directory)
+    failed = 0
+    for rom, message, ok in results:
+        failed += not ok
+        args.output.write("%s: %s\n" % (rom, message))
+        args.output.flush()
+    return 1 if failed else 0
+
+def _load_rom(path):
+    """Return the ROM at path"""
+    with open(path, 'rb') as file_handle:
+        return ROM(file_handle)
+
+def _serve(args):
+    """Serve a ROM until interrupted"""
+    play = server.PlayServer(_load_rom(args.rom), args.host, args.port,
+        args.seed)
+    async def serve():
+        await play.start()
+        args.output.write("serving %s on http://%s:%i/\n" % (args.rom,
+            play.host, play.port))
+        args.output.flush()
+        await play.serve_forever()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def _loadtest(args):
+    """Connect many clients and report frame rate and input latency
+
+    Without --port, a server for ROM runs in this process.
+    """
+    async def run():
+        play = None
+        port = args.port
+        if port is None:
+            if args.rom is None:
+                raise SystemExit("loadtest needs a ROM or a --port")
+            play = await server.PlayServer(_load_rom(args.rom),
+                args.host).start()
+            port = play.port
+        try:
+            clients = await server.load_test(args.host, port, args.sessions,
+                args.seconds)
+        finally:
+            if play is not None:
+                await play.close()
+        return clients
+    clients = asyncio.run(run())
+    args.output.write(server.summarise(clients, args.seconds) + "\n")
+    return 0
+
+def _coverage(args):
+    """Run a ROM once per seed and write its annotated disassembly"""
+    merged = coverage.gather(args.rom, args.frames, args.seeds, args.jobs)
+    if args.map is not None:
+        if os.path.exists(args.map):
+            merged.merge(coverage.Coverage.load(args.map))
+        merged.save(args.map)
+    args.output.write(merged.report(_load_rom(args.rom).data))
+    return 0
+
+def _cfg(args):
+    """Write a ROM's control-flow graph as a summary, JSON or dot"""
+    graph = cfg.analyse(_load_rom(args.rom))
+    if args.format == 'json':
+        json.dump(graph.to_dict(), args.output, indent=1)
+        args.output.write("\n")
+        return 0
+    if args.format == 'dot':
+        args.output.write(graph.to_dot())
+        return 0
+    args.output.write("; %i blocks, %i functions, %i loops\n" % (
+        len(graph.blocks), len(graph.functions), len(graph.loops)))
+    for entry, function in sorted(graph.functions.items()):
+        args.output.write("function %04X: %i blocks, calls %s%s\n" % (entry,
+            len(function.blocks), ' '.join('%04X' % callee
+            for callee in sorted(function.callees)) or '-',
+            ', indirect' if function.indirect_calls
+            or function.indirect_jumps else ''))
+    for loop in sorted(graph.loops, key=lambda loop: loop.header):
+        args.output.write("%sloop %04X: %i blocks\n" % ('  ' * loop.depth,
+            loop.header, len(loop.body)))
+    for start, stop in graph.unreached():
+        args.output.write("unreached %04X-%04X\n" % (start, stop))
+    return 0
+
+def _disasm(args):
+    """Write a listing of a ROM, or with --raw, of any file of op codes"""
+    if args.raw:
+        with open(args.rom, 'rb') as file_handle:
+            for decoded in disasm.stream(file_handle):
+                args.output.writelines(line + "\n"
+                    for line in disasm.format_listing(decoded))
+        return 0
+    decoded = disasm.decode(_load_rom(args.rom).data)
+    args.output.writelines(line + "\n"
+        for line in disasm.format_listing(decoded))
+    return 0
+
+def _heatmap(args):
+    """Run a ROM counting memory accesses and print the busiest pages"""
+    vmac = VM(args.seed)
+    vmac.load_rom(_load_rom(args.rom))
+    heatmap = vmac.mem.enable_heatmap()
+    for _ in range(args.frames):
+        vmac.run_frame(present=False)
+    args.output.write("page   reads      writes\n")
+    for page, reads, writes in heatmap.summary(args.top):
+        args.output.write("%02X00  %10i  %10i\n" % (page, reads, writes))
+    args.output.write("\naddr   reads      writes\n")
+    for addr, reads, writes in heatmap.hottest(args.top):
+        args.output.write("%04X  %10i  %10i\n" % (addr, reads, writes))
+    if args.save is not None:
+        heatmap.save(args.save)
+    return 0
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(prog='pchip16')
+    commands = parser.add_subparsers(dest='command', required=True)
+    parser_golden = commands.add_parser('golden',
+        help="record or verify per-frame framebuffer hashes")
+    parser_golden.add_argument('action', choices=('record', 'verify'))
+    parser_golden.add_argument('roms', nargs='+', metavar='ROM')
+    parser_golden.add_argument('-n', '--frames', type=int, default=300,
+        help="frames to record")
+    parser_golden.add_argument('-s', '--seed', type=int, default=0,
+        help="random seed to record with")
+    parser_golden.add_argument('-d', '--directory',
+        help="golden file directory, default beside each ROM")
+    parser_golden.add_argument('-j', '--jobs', type=int, default=cpu_count(),
+        help="worker processes")
+    parser_golden.add_argument('-o', '--output', type=argparse.FileType('w'),
+        default=sys.stdout)
+    parser_golden.set_defaults(func=_golden)
+    parser_coverage = commands.add_parser('coverage',
+        help="report which instructions and branches a ROM executes")
+    parser_coverage.add_argument('rom', metavar='ROM')
+    parser_coverage.add_argument('-n', '--frames', type=int, default=600)
+    parser_coverage.add_argument('-s', '--seeds', type=int, nargs='+',
+        default=[0], help="one run per seed, merged")
+    parser_coverage.add_argument('-j', '--jobs', type=int,
+        default=cpu_count(), help="worker processes")
+    parser_coverage.add_argument('-m', '--map',
+        help="coverage file to merge earlier runs from and save to")
+    parser_coverage.add_argument('-o', '--output',
+        type=argparse.FileType('w'), default=sys.stdout)
+    parser_coverage.set_defaults(func=_coverage)
+    parser_cfg = commands.add_parser('cfg',
+        help="build a ROM's control-flow graph, call graph and loops")
+    parser_cfg.add_argument('rom', metavar='ROM')
+    parser_cfg.add_argument('-f', '--format', default='summary',
+        choices=('summary', 'json', 'dot'))
+    parser_cfg.add_argument('-o', '--output',
+        type=argparse.FileType('w'), default=sys.stdout)
+    parser_cfg.set_defaults(func=_cfg)
+    parser_disasm = commands.add_parser('disasm',
+        help="list a ROM's instructions")
+    parser_disasm.add_argument('rom', metavar='ROM')
+    parser_disasm.add_argument('--raw', action='store_true',
+        help="ROM is headerless op codes, such as a trace dump; "
+        "decoded in chunks")
+    parser_disasm.add_argument('-o', '--output',
+        type=argparse.FileType('w'), default=sys.stdout)
+    parser_disasm.set_defaults(func=_disasm)
+    parser_heatmap = commands.add_parser('heatmap',
+        help="count memory reads and writes per page and address")
+    parser_heatmap.add_argument('rom', metavar='ROM')
+    parser_heatmap.add_argument('-n', '--frames', type=int, default=600)
+    parser_heatmap.add_argument('-s', '--seed', type=int, default=0)
+    parser_heatmap.add_argument('-t', '--top', type=int, default=10,
+        help="pages and addresses to list")
+    parser_heatmap.add_argument('--save', metavar='NPZ',
+        help="write the counters to a NumPy .npz file")
+    parser_heatmap.add_argument('-o', '--output',
+        type=argparse.FileType('w'), default=sys.stdout)
+    parser_heatmap.set_defaults(func=_heatmap)
+    parser_serve = commands.add_parser('serve',
+        help="play a ROM in the browser or over TCP, one VM per client")
+    parser_serve.add_argument('rom', metavar='ROM')
+    parser_serve.add_argument('--host', default='127.0.0.1')
+    parser_serve.add_argument('-p', '--port', type=int, default=8016)
+    parser_serve.add_argument('-s', '--seed', type=int, default=0,
+        help="random seed for every session")
+    parser_serve.add_argument('-o', '--output', type=argparse.FileType('w'),
+        default=sys.stdout)
+    parser_serve.set_defaults(func=_serve)
+    parser_load = commands.add_parser('loadtest',
+        help="measure frame rate and input latency of many play clients")
+    parser_load.add_argument('rom', metavar='ROM', nargs='?',
+        help="ROM to serve in process when no --port is given")
+    parser_load.add_argument('--host', default='127.0.0.1')
+    parser_load.add_argument('-p', '--port', type=int,
+        help="port of a running server")
+    parser_load.add_argument('-n', '--sessions', type=int, default=50)
+    parser_load.add_argument('-t', '--seconds', type=float, default=5.0)
+    parser_load.add_argument('-o', '--output', type=argparse.FileType('w'),
+        default=sys.stdout)
+    parser_load.set_defaults(func=_loadtest)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,261 @@
+"""
+pchip16 audio - tone generator with ADSR envelope, one frame at a time
+"""
+
+import wave as wavefile
+
+import numpy as np
+
+SAMPLE_RATE = 44100
+FRAME_RATE = 60
+# SND1, SND2 and SND3 frequencies in Hz
+TONES = (500, 1000, 1500)
+ATTACK_MS = (2, 8, 16, 24, 38, 56, 68, 80, 100, 250, 500, 800, 1000, 3000,
+    5000, 8000)
+DECAY_MS = (6, 24, 48, 72, 114, 168, 204, 240, 300, 750, 1500, 2400, 3000,
+    9000, 15000, 24000)
+RELEASE_MS = DECAY_MS
+TRIANGLE, SAWTOOTH, PULSE, NOISE = range(4)
+TABLE_BITS = 11
+TABLE_SIZE = 1 << TABLE_BITS
+PHASE_BITS = 32
+
+_TABLES = {}
+
+def wave_table(wave):
+    """Return the cached one period float32 table for waveform wave"""
+    table = _TABLES.get(wave)
+    if table is None:
+        phase = (np.arange(TABLE_SIZE) + 0.5) / TABLE_SIZE
+        if wave == TRIANGLE:
+            table = 1 - 4 * np.abs(phase - 0.5)
+        elif wave == SAWTOOTH:
+            table = 2 * phase - 1
+        elif wave == PULSE:
+            table = np.where(phase < 0.5, 1.0, -1.0)
+        else:
+            table = np.random.default_rng(0xC16).uniform(-1, 1, TABLE_SIZE)
+        table = table.astype(np.float32)
+        table.flags.writeable = False
+        _TABLES[wave] = table
+    return table
+
+class Audio(object):
+    """Single voice sound generator for the SND, SNP and SNG instructions
+
+    Each render() call fills samples, rate // 60 mono int16 samples, with
+    the next frame of sound. Waveforms are looked up from cached one period
+    tables with a fixed point phase accumulator and the envelope is a
+    piecewise linear curve built once per note.
+    """
+    def __init__(self, rate=SAMPLE_RATE):
+        self.rate = rate
+        self.attack = 0
+        self.decay = 0
+        self.sustain = 0
+        self.release = 0
+        self.volume = 15
+        self.wave = TRIANGLE
+        self.playing = False
+        self._note = None
+        self._phase = 0
+        self._position = 0
+        self._buffers()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for name in ('samples', '_ramp', '_time', '_index', '_out',
+                '_silent'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._buffers()
+
+    def _buffers(self):
+        """Allocate the per-frame buffers every render reuses"""
+        size = self.rate // FRAME_RATE
+        self.samples = np.zeros(size, dtype=np.int16)
+        self._ramp = np.arange(size, dtype=np.uint64)
+        self._time = np.empty(size, dtype=np.float64)
+        self._index = np.empty(size, dtype=np.uint64)
+        self._out = np.empty(size, dtype=np.float32)
+        self._silent = True
+
+    def reset(self):
+        """Silence the generator and restore the power-on SNG settings"""
+        self.configure(0, 0, 0, 0, 15, TRIANGLE)
+        self.stop()
+        self._note = None
+        self._phase = 0
+        self._position = 0
+        self.samples[:] = 0
+        self._silent = True
+
+    def _samples(self, millis):
+        """Return millis converted to a sample count"""
+        return millis * self.rate // 1000
+
+    def configure(self, attack, decay, sustain, release, volume, wave):
+        """SNG: set the envelope, volume and waveform used by SNP"""
+        self.attack = attack
+        self.decay = decay
+        self.sustain = sustain
+        self.release = release
+        self.volume = volume
+        self.wave = wave
+
+    def stop(self):
+        """SND0: silence the current note"""
+        self.playing = False
+
+    def tone(self, frequency, millis):
+        """SND1-3: play a full volume pulse wave with no envelope"""
+        length = self._samples(millis)
+        self._start(frequency, length, PULSE, 1.0,
+            ([0, max(length - 1, 0), length], [1, 1, 0]))
+
+    def play(self, frequency, millis):
+        """SNP: play frequency through the SNG waveform and envelope
+
+        The note attacks, decays to the sustain level and holds until
+        millis, then releases from whatever level it reached.
+        """
+        length = self._samples(millis)
+        attack = self._samples(ATTACK_MS[self.attack])
+        decay = attack + self._samples(DECAY_MS[self.decay])
+        sustain = self.sustain / 15.0
+        points = [0, attack, decay]
+        levels = [0, 1, sustain]
+        # np.interp(length, points, levels) in its operation order, without
+        # the array round trip it makes for a scalar
+        if length >= decay:
+            level = sustain
+        elif length >= attack:
+            level = ((sustain - 1.0) / (decay - attack) * (length - attack)
+                + 1.0)
+        else:
+            # length < attack here, and length >= 0, so attack > 0
+            level = 1.0 / attack * length
+        keep = [index for index in range(3) if points[index] < length]
+        points = [points[index] for index in keep] + [length,
+            length + self._samples(RELEASE_MS[self.release])]
+        levels = [levels[index] for index in keep] + [level, 0]
+        self._start(frequency, length, self.wave, self.volume / 15.0,
+            (points, levels))
+
+    def _start(self, frequency, length, wave, volume, envelope):
+        """Begin a note, replacing any playing one"""
+        if not frequency or not length:
+            self.stop()
+            return
+        points, levels = envelope
+        self._note = (
+            (frequency << PHASE_BITS) // self.rate,
+            wave,
+            volume * 32767,
+            tuple(points),
+            tuple(float(level) for level in levels),
+        )
+        self._phase = 0
+        self._position = 0
+        self.playing = True
+
+    def render(self):
+        """Fill samples with the next frame of sound and return it"""
+        samples = self.samples
+        if not self.playing:
+            if not self._silent:
+                samples[:] = 0
+                self._silent = True
+            return samples
+        step, wave, volume, points, levels = self._note
+        index = self._index
+        out = self._out
+        np.multiply(self._ramp, step, out=index)
+        index += self._phase
+        index &= (1 << PHASE_BITS) - 1
+        index >>= PHASE_BITS - TABLE_BITS
+        np.take(wave_table(wave), index, out=out)
+        np.add(self._ramp, self._position, out=self._time)
+        out *= np.interp(self._time, points, levels)
+        out *= volume
+        samples[:] = out
+        self._silent = False
+        self._phase = (self._phase + step * len(samples)) \
+            & ((1 << PHASE_BITS) - 1)
+        self._position += len(samples)
+        if self._position >= points[-1]:
+            self.playing = False
+        return samples
+
+class RingBuffer(object):
+    """Fixed size int16 sample FIFO between the VM and an audio device
+
+    Use as a frame listener. When full, the oldest samples are overwritten
+    and counted in overruns.
+    """
+    def __init__(self, capacity=SAMPLE_RATE):
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        self.overruns = 0
+        self._start = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __call__(self, vmac):
+        self.write(vmac.audio.samples)
+
+    def write(self, samples):
+        """Append samples, dropping the oldest if there is no room"""
+        capacity = len(self.buffer)
+        if len(samples) > capacity:
+            self.overruns += len(samples) - capacity
+            samples = samples[-capacity:]
+        overflow = self._size + len(samples) - capacity
+        if overflow > 0:
+            self.overruns += overflow
+            self._start = (self._start + overflow) % capacity
+            self._size -= overflow
+        stop = (self._start + self._size) % capacity
+        first = min(len(samples), capacity - stop)
+        self.buffer[stop:stop + first] = samples[:first]
+        self.buffer[:len(samples) - first] = samples[first:]
+        self._size += len(samples)
+
+    def read(self, count=None, out=None):
+        """Remove and return up to count of the oldest samples"""
+        capacity = len(self.buffer)
+        count = self._size if count is None else min(count, self._size)
+        if out is None:
+            out = np.empty(count, dtype=np.int16)
+        first = min(count, capacity - self._start)
+        out[:first] = self.buffer[self._start:self._start + first]
+        out[first:count] = self.buffer[:count - first]
+        self._start = (self._start + count) % capacity
+        self._size -= count
+        return out[:count]
+
+class WavWriter(object):
+    """Frame listener streaming each frame's samples to a mono WAV file"""
+    def __init__(self, path, rate=SAMPLE_RATE):
+        self._file = wavefile.open(path, 'wb')
+        self._file.setnchannels(1)
+        self._file.setsampwidth(2)
+        self._file.setframerate(rate)
+
+    def __call__(self, vmac):
+        self._file.writeframesraw(vmac.audio.samples.astype('<i2',
+            copy=False).tobytes())
+
+    def close(self):
+        """Finish the header and close the file"""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,173 @@
+"""
+pchip16 audio tests
+"""
+#pylint: disable=I0011,R0904
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import wave
+import numpy as np
+from pchip16.audio import (Audio, RingBuffer, WavWriter, wave_table, PULSE,
+    SAWTOOTH, TRIANGLE, NOISE, ATTACK_MS, DECAY_MS)
+from pchip16.vm import VM
+
+class TestWaveTables(unittest.TestCase):
+    """Test the cached waveform periods"""
+    def test_cached(self):
+        self.assertIs(wave_table(TRIANGLE), wave_table(TRIANGLE))
+    def test_range(self):
+        for kind in (TRIANGLE, SAWTOOTH, PULSE, NOISE):
+            table = wave_table(kind)
+            self.assertEqual(table.dtype, np.float32)
+            self.assertLessEqual(np.abs(table).max(), 1.0)
+        self.assertEqual(wave_table(PULSE)[0], 1.0)
+        self.assertEqual(wave_table(PULSE)[-1], -1.0)
+
+class TestAudio(unittest.TestCase):
+    """Test tone generation and envelopes"""
+    def setUp(self):
+        self.audio = Audio()
+    def test_silent(self):
+        samples = self.audio.render()
+        self.assertEqual(samples.shape, (735,))
+        self.assertFalse(samples.any())
+    def test_tone(self):
+        self.audio.tone(500, 10)
+        samples = self.audio.render()
+        self.assertEqual(samples[:44].tolist(), [32767] * 44)
+        self.assertEqual(samples[45:88].tolist(), [-32767] * 43)
+        self.assertTrue(samples[:440].all())
+        self.assertFalse(samples[441:].any())
+        self.assertFalse(self.audio.playing)
+    def test_long_tone_is_continuous(self):
+        self.audio.tone(1000, 1000)
+        first = self.audio.render().copy()
+        second = self.audio.render()
+        # 735 samples hold 16.67 periods of 44.1, so the phase carries over
+        self.assertNotEqual(first[:10].tolist(), second[:10].tolist())
+        self.assertTrue(self.audio.playing)
+    def test_stop(self):
+        self.audio.tone(500, 1000)
+        self.audio.render()
+        self.audio.stop()
+        self.assertFalse(self.audio.render().any())
+    def test_envelope(self):
+        self.audio.configure(0, 0, 7, 0, 15, PULSE)
+        self.audio.play(500, 1000)
+        samples = np.abs(self.audio.render().astype(np.int32))
+        attack = 88
+        self.assertAlmostEqual(samples[44], 32767 * 44 / attack, delta=2)
+        self.assertAlmostEqual(samples[attack], 32767, delta=2)
+        self.assertAlmostEqual(samples[attack + 264], 32767 * 7 / 15,
+            delta=2)
+        self.assertAlmostEqual(samples[-1], 32767 * 7 / 15, delta=2)
+    def test_release(self):
+        self.audio.configure(0, 0, 15, 0, 15, PULSE)
+        self.audio.play(500, 10)
+        samples = np.abs(self.audio.render().astype(np.int32))
+        self.assertAlmostEqual(samples[441], 32767, delta=2)
+        self.assertAlmostEqual(samples[441 + 132], 32767 / 2, delta=200)
+        self.assertFalse(samples[441 + 264:].any())
+        self.assertFalse(self.audio.playing)
+    def test_release_level(self):
+        # The level a note releases from is np.interp over attack and decay
+        audio = self.audio
+        for attack, decay, millis in ((0, 0, 1), (2, 3, 5), (2, 3, 30),
+                (5, 0, 60), (15, 15, 10)):
+            audio.configure(attack, decay, 9, 2, 15, PULSE)
+            audio.play(500, millis)
+            rise = audio._samples(ATTACK_MS[attack])
+            fall = rise + audio._samples(DECAY_MS[decay])
+            self.assertEqual(audio._note[4][-2], np.interp(
+                audio._samples(millis), [0, rise, fall], [0, 1, 9 / 15.0]))
+    def test_volume(self):
+        self.audio.configure(0, 0, 15, 0, 5, SAWTOOTH)
+        self.audio.play(500, 1000)
+        self.audio.render()
+        self.assertLessEqual(np.abs(self.audio.render()).max(), 32767 // 3)
+    def test_pickle(self):
+        self.audio.tone(500, 1000)
+        buffers = []
+        audio = pickle.loads(pickle.dumps(self.audio, protocol=5,
+            buffer_callback=buffers.append), buffers=buffers)
+        self.assertEqual(buffers, [])
+        self.assertEqual(audio.render().tolist(),
+            self.audio.render().tolist())
+
+class TestSoundCodes(unittest.TestCase):
+    """Test the sound instructions drive the VM's generator"""
+    def setUp(self):
+        self.vmac = VM()
+    def test_SND(self):
+        # SND2 0x0100
+        self.vmac.execute(0x0B000001)
+        self.assertTrue(self.vmac.audio.playing)
+        self.vmac.execute(0x09000000)
+        self.assertFalse(self.vmac.audio.playing)
+    def test_SNG(self):
+        self.vmac.execute(0x0E12345D)
+        audio = self.vmac.audio
+        self.assertEqual((audio.attack, audio.decay, audio.sustain,
+            audio.release, audio.volume, audio.wave), (1, 2, 5, 0xD, 3, 0))
+    def test_spec_codes(self):
+        # Bounce.c16: SNG #00, #0043 then SNP R1, 30 ms
+        self.vmac.execute(0x0E000043)
+        audio = self.vmac.audio
+        self.assertEqual((audio.sustain, audio.release, audio.volume),
+            (4, 3, 0))
+        self.assertFalse(audio.playing)
+        self.vmac.mem[0x300] = 440
+        self.vmac.register[0x1] = 0x300
+        self.vmac.execute(0x0D011E00)
+        self.assertTrue(audio.playing)
+    def test_reserved_bits(self):
+        self.assertRaises(ValueError, self.vmac.execute, 0x0B010001)
+        self.assertRaises(ValueError, self.vmac.execute, 0x0D140001)
+    def test_SNP(self):
+        self.vmac.mem[0x300] = 1000
+        self.vmac.register[0x4] = 0x300
+        self.vmac.execute(0x0E00F2F0)
+        # SNP R4, 0x0100
+        self.vmac.execute(0x0D040001)
+        samples = self.vmac.audio.render()
+        # 1000 Hz pulse, periods of 44.1 samples during the 88 sample attack
+        self.assertGreater(samples[10], 0)
+        self.assertGreater(samples[54], samples[10])
+
+class TestSinks(unittest.TestCase):
+    """Test the ring buffer and WAV outputs"""
+    def test_ring_buffer(self):
+        ring = RingBuffer(8)
+        ring.write(np.arange(5, dtype=np.int16))
+        self.assertEqual(ring.read(3).tolist(), [0, 1, 2])
+        ring.write(np.arange(5, 10, dtype=np.int16))
+        self.assertEqual(len(ring), 7)
+        ring.write(np.arange(10, 13, dtype=np.int16))
+        self.assertEqual(ring.overruns, 2)
+        self.assertEqual(ring.read().tolist(), list(range(5, 13)))
+        self.assertEqual(len(ring), 0)
+    def test_wav(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'out.wav')
+            vmac = VM()
+            # SND1 0x0100 ; VBLNK ; JMP 0x0004
+            vmac.mem[0x0] = 0x000A
+            vmac.mem[0x2] = 0x0001
+            vmac.mem[0x4] = 0x0002
+            vmac.mem[0x8] = 0x0010
+            vmac.mem[0xA] = 0x0004
+            with WavWriter(path) as writer:
+                vmac.add_frame_listener(writer)
+                vmac.run_frame()
+                vmac.run_frame()
+            with wave.open(path, 'rb') as wav:
+                self.assertEqual(wav.getnframes(), 2 * 735)
+                self.assertEqual(wav.getframerate(), 44100)
+                data = np.frombuffer(wav.readframes(10), dtype='<i2')
+            self.assertEqual(data.tolist(), [32767] * 10)
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,692 @@
+"""
+pchip16 BatchVM - many virtual machines stepped in lockstep with NumPy
+"""
+
+import numpy as np
+
+from .gpu import SCREEN_HEIGHT, SCREEN_WIDTH, unpack_sprite, orient, blit
+from .memory import Register
+from .palette import Palette
+from .utils import to_dec
+from .vm import (VM, CARRY, ZERO, OVERFLOW, NEGATIVE, CYCLES_PER_FRAME,
+    CONTROLLER_1, CONTROLLER_2, seed_state)
+
+MEMORY_SIZE = 2**16
+
+def _imm(op_code):
+    """Return the HHLL immediate of op_code"""
+    return ((op_code & 0xFF) << 8) | ((op_code >> 8) & 0xFF)
+
+def _clear(flag):
+    """Return a uint16 mask clearing flag"""
+    return np.uint16(0xFFFF ^ flag)
+
+class BatchVM(object):
+    """N virtual machines sharing one set of NumPy state arrays
+
+    Lanes are grouped by the op code they fetch and each group executes
+    as a handful of array operations. A lane that would raise in VM is
+    marked faulted, its exception kept in errors, and takes no further part.
+    SNP faults like VM's on an unreadable address, but no audio is made.
+
+    Each lane has VM's xorshift32 RND generator. With a seed, lane i
+    starts as VM(seed + i) would, otherwise every lane starts as VM().
+    """
+    def __init__(self, lanes, seed=None):
+        self.lanes = lanes
+        self.register = np.zeros((lanes, 16), dtype=np.uint16)
+        self.flags = np.zeros(lanes, dtype=np.uint16)
+        self.program_counter = np.zeros(lanes, dtype=np.int64)
+        self.stack_pointer = np.full(lanes, 0xFDF0, dtype=np.int64)
+        self.mem = np.zeros((lanes, MEMORY_SIZE), dtype=np.uint8)
+        self.frame_count = np.zeros(lanes, dtype=np.int64)
+        self.framebuffer = np.zeros((lanes, SCREEN_HEIGHT, SCREEN_WIDTH),
+            dtype=np.uint8)
+        self.background = np.zeros(lanes, dtype=np.uint8)
+        self.sprite_width = np.zeros(lanes, dtype=np.int64)
+        self.sprite_height = np.zeros(lanes, dtype=np.int64)
+        self.flip_h = np.zeros(lanes, dtype=bool)
+        self.flip_v = np.zeros(lanes, dtype=bool)
+        self.colors = np.repeat(Palette().colors[np.newaxis], lanes, axis=0)
+        self.vblank_wait = np.zeros(lanes, dtype=bool)
+        self.faulted = np.zeros(lanes, dtype=bool)
+        self.errors = {}
+        self._range_error = None
+        if seed is None:
+            seeds = [0] * lanes
+        else:
+            seeds = range(seed, seed + lanes)
+        self.rng_state = np.array([seed_state(value) for value in seeds],
+            dtype=np.uint32)
+        self._families = [
+            self.misc,
+            self.jump,
+            self.load,
+            self.store,
+            self.add,
+            self.sub,
+            self.bit_and,
+            self.bit_or,
+            self.bit_xor,
+            self.mul,
+            self.div,
+            self.shift,
+            self.stack,
+            self.palette,
+        ]
+
+    @classmethod
+    def from_vms(cls, vms):
+        """Build a batch whose lanes copy the state of each VM in vms"""
+        vms = list(vms)
+        batch = cls(len(vms))
+        for lane, vmac in enumerate(vms):
+            batch.rng_state[lane] = vmac.rng_state
+            batch.register[lane] = vmac.register
+            batch.flags[lane] = vmac.flags
+            batch.program_counter[lane] = vmac.program_counter
+            batch.stack_pointer[lane] = vmac.stack_pointer
+            batch.frame_count[lane] = vmac.frame_count
+            batch.mem[lane] = np.frombuffer(vmac.mem._mem, dtype=np.uint8)
+            gpu = vmac.gpu
+            batch.framebuffer[lane] = gpu.framebuffer
+            batch.background[lane] = gpu.background
+            batch.sprite_width[lane] = gpu.sprite_width
+            batch.sprite_height[lane] = gpu.sprite_height
+            batch.flip_h[lane] = gpu.flip_h
+            batch.flip_v[lane] = gpu.flip_v
+            batch.colors[lane] = gpu.palette.colors
+        return batch
+
+    def load_rom(self, rom):
+        """Copy rom into every lane and jump to its start address"""
+        self.mem[:] = 0
+        self.mem[:, :len(rom.data)] = np.frombuffer(rom.data, dtype=np.uint8)
+        self.program_counter[:] = rom.start_address
+
+    def vm(self, lane):
+        """Return a standalone VM holding a copy of lane's state"""
+        vmac = VM()
+        vmac.mem.fromstring(self.mem[lane].tobytes())
+        vmac.register = Register(self.register[lane].tobytes())
+        vmac.flags = int(self.flags[lane])
+        vmac.program_counter = int(self.program_counter[lane])
+        vmac.stack_pointer = int(self.stack_pointer[lane])
+        vmac.frame_count = int(self.frame_count[lane])
+        vmac.rng_state = int(self.rng_state[lane])
+        gpu = vmac.gpu
+        gpu.framebuffer[:] = self.framebuffer[lane]
+        gpu.background = int(self.background[lane])
+        gpu.set_sprite(int(self.sprite_width[lane]),
+            int(self.sprite_height[lane]))
+        gpu.set_flip(self.flip_h[lane], self.flip_v[lane])
+        gpu.palette.load(self.colors[lane].tobytes(), 0)
+        return vmac
+
+    def _fault(self, lanes, error):
+        """Retire lanes, recording error for each"""
+        self.faulted[lanes] = True
+        for lane in lanes.tolist():
+            self.errors[lane] = error
+
+    def _check(self, lanes, valid, error):
+        """Fault the lanes failing valid and return the rest"""
+        if not valid.all():
+            self._fault(lanes[~valid], error)
+            return lanes[valid]
+        return lanes
+
+    def _read(self, lanes, addr):
+        """Read a word at addr per lane, returning (lanes, values)
+
+        Lanes whose addr falls outside Memory's indexable range fault with
+        the error VM.execute turns the resulting IndexError into.
+        """
+        valid = (addr >= -MEMORY_SIZE) & (addr < MEMORY_SIZE - 1)
+        if not valid.all():
+            self._fault(lanes[~valid], self._range_error)
+            lanes = lanes[valid]
+            addr = addr[valid]
+        low = addr & 0xFFFF
+        high = (addr + 1) & 0xFFFF
+        values = (self.mem[lanes, high].astype(np.int64) << 8) \
+            | self.mem[lanes, low]
+        return lanes, values
+
+    def _write(self, lanes, addr, values):
+        """Write a word per lane at addr, returning the lanes written"""
+        values = np.asarray(values, dtype=np.int64)
+        valid = (addr >= -MEMORY_SIZE) & (addr < MEMORY_SIZE - 1) \
+            & (values >> 8 < 0x100)
+        if not valid.all():
+            self._fault(lanes[~valid], self._range_error)
+            lanes = lanes[valid]
+            addr = addr[valid]
+            values = values[valid]
+        self.mem[lanes, addr & 0xFFFF] = values & 0xFF
+        self.mem[lanes, (addr + 1) & 0xFFFF] = values >> 8
+        return lanes
+
+    def _mask_code(self, lanes, op_code, mask):
+        """Fault every lane for op_codes in mask, returning the survivors"""
+        if op_code & mask:
+            self._fault(lanes, ValueError("Invalid op code %s" %hex(op_code)))
+            return lanes[:0]
+        return lanes
+
+    def _invalid(self, lanes, message="Invalid op code"):
+        """Fault every lane in lanes with ValueError"""
+        self._fault(lanes, ValueError(message))
+
+    def fetch(self, lanes):
+        """Return (lanes, op codes) at each lane's program counter"""
+        addr = self.program_counter[lanes]
+        valid = addr <= MEMORY_SIZE - 4
+        lanes = self._check(lanes, valid,
+            IndexError("array index out of range"))
+        addr = self.program_counter[lanes]
+        mem = self.mem
+        op_codes = (mem[lanes, addr].astype(np.uint32) << 24) \
+            | (mem[lanes, addr + 1].astype(np.uint32) << 16) \
+            | (mem[lanes, addr + 2].astype(np.uint32) << 8) \
+            | mem[lanes, addr + 3]
+        return lanes, op_codes
+
+    def step(self, lanes=None):
+        """Fetch and execute one instruction on lanes (default all live)"""
+        if lanes is None:
+            lanes = np.flatnonzero(~self.faulted)
+        lanes, op_codes = self.fetch(lanes)
+        if not len(lanes):
+            return
+        self.program_counter[lanes] += 4
+        order = np.argsort(op_codes, kind='stable')
+        op_codes = op_codes[order]
+        lanes = lanes[order]
+        bounds = np.flatnonzero(op_codes[1:] != op_codes[:-1]) + 1
+        starts = [0] + bounds.tolist()
+        ends = bounds.tolist() + [len(op_codes)]
+        for start, end in zip(starts, ends):
+            self.execute(int(op_codes[start]), lanes[start:end])
+
+    def execute(self, op_code, lanes):
+        """Carry out op_code on every lane in lanes"""
+        family = op_code >> 28
+        self._range_error = ValueError("Invalid opcode %i" %family)
+        if family >= len(self._families):
+            self._fault(lanes, self._range_error)
+        else:
+            self._families[family](op_code, lanes)
+
+    def run(self, cycles):
+        """Step every live lane up to cycles times, stopping each at VBLNK
+
+        Returns the number of instructions each lane executed.
+        """
+        self.vblank_wait[:] = False
+        counts = np.zeros(self.lanes, dtype=np.int64)
+        for _ in range(cycles):
+            lanes = np.flatnonzero(~(self.faulted | self.vblank_wait))
+            if not len(lanes):
+                break
+            counts[lanes] += 1
+            self.step(lanes)
+        return counts
+
+    def run_frame(self, controllers=None):
+        """Latch (N, 2) controller words and run one frame on every lane"""
+        lanes = np.flatnonzero(~self.faulted)
+        if controllers is None:
+            controllers = np.zeros((self.lanes, 2), dtype=np.int64)
+        controllers = np.asarray(controllers, dtype=np.int64)
+        for pad, addr in enumerate((CONTROLLER_1, CONTROLLER_2)):
+            self._write(lanes, np.full(len(lanes), addr),
+                controllers[lanes, pad])
+        counts = self.run(CYCLES_PER_FRAME)
+        self.frame_count[~self.faulted] += 1
+        return counts
+
+    def misc(self, op_code, lanes):
+        """Misc"""
+        if op_code == 0x01000000:
+            #"""CLS"""
+            self.framebuffer[lanes] = 0
+            self.background[lanes] = 0
+        elif op_code == 0x02000000:
+            #"""VBLNK"""
+            self.vblank_wait[lanes] = True
+        elif op_code >> 24 == 0x03:
+            #"""BGC N"""
+            lanes = self._mask_code(lanes, op_code, 0xFFF0FF)
+            self.background[lanes] = (op_code >> 8) & 0xF
+        elif op_code >> 16 == 0x0400:
+            #"""SPR HHLL"""
+            self.sprite_width[lanes] = (op_code >> 8) & 0xFF
+            self.sprite_height[lanes] = op_code & 0xFF
+        elif op_code >> 24 == 0x05:
+            #"""DRW RX, RY, HHLL"""
+            self._draw(op_code, lanes, np.full(len(lanes), _imm(op_code)))
+        elif op_code >> 24 == 0x06:
+            #"""DRW RX, RY, RZ"""
+            lanes = self._mask_code(lanes, op_code, 0xF0FF)
+            z_reg = (op_code >> 8) & 0xF
+            self._draw(op_code, lanes, self.register[lanes, z_reg])
+        elif op_code >> 8 == 0x080000:
+            #"""FLIP H, V"""
+            lanes = self._mask_code(lanes, op_code, 0xFC)
+            self.flip_h[lanes] = bool(op_code & 0x2)
+            self.flip_v[lanes] = bool(op_code & 0x1)
+        elif op_code >> 20 == 0x070:
+            #"""RND RX, HHLL"""
+            x_reg = (op_code >> 16) & 0xF
+            hh_addr = op_code & 0xFF
+            ll_addr = (op_code >> 8) & 0xFF
+            addr = np.full(len(lanes), (hh_addr << 8) & ll_addr)
+            lanes, rand_max = self._read(lanes, addr)
+            self.register[lanes, x_reg] = self._random(lanes, rand_max + 1)
+        elif 0x0A <= op_code >> 24 <= 0x0C:
+            #"""SND1-3 HHLL"""
+            self._mask_code(lanes, op_code, 0xFF0000)
+        elif op_code >> 24 == 0x0D:
+            #"""SNP RX, HHLL"""
+            lanes = self._mask_code(lanes, op_code, 0xF00000)
+            x_reg = (op_code >> 16) & 0xF
+            self._read(lanes, self.register[lanes, x_reg].astype(np.int64))
+
+    def _random(self, lanes, bounds):
+        """Advance each lane's xorshift32 and return values below bounds"""
+        state = self.rng_state[lanes]
+        state ^= state << 13
+        state ^= state >> 17
+        state ^= state << 5
+        self.rng_state[lanes] = state
+        return (state.astype(np.uint64) * bounds.astype(np.uint64)) >> 32
+
+    def _draw(self, op_code, lanes, addrs):
+        """Blit each lane's current sprite, CARRY flags a collision"""
+        y_reg = (op_code >> 20) & 0xF
+        x_reg = (op_code >> 16) & 0xF
+        x_pos = self.register[lanes, x_reg].tolist()
+        y_pos = self.register[lanes, y_reg].tolist()
+        addrs = addrs.tolist()
+        collisions = np.zeros(len(lanes), dtype=bool)
+        for index, lane in enumerate(lanes.tolist()):
+            width = int(self.sprite_width[lane])
+            height = int(self.sprite_height[lane])
+            if not width or not height:
+                continue
+            pixels = orient(unpack_sprite(self.mem[lane], addrs[index],
+                width, height), self.flip_h[lane], self.flip_v[lane])
+            collisions[index] = blit(self.framebuffer[lane], pixels,
+                to_dec(x_pos[index]), to_dec(y_pos[index]))
+        self._set(lanes, CARRY, collisions)
+
+    def cond_jump(self, branch_type, lanes):
+        """Conditional jumps, returning a mask over lanes"""
+        flags = self.flags[lanes]
+        zero = (flags & ZERO) != 0
+        carry = (flags & CARRY) != 0
+        overflow = (flags & OVERFLOW) != 0
+        negative = (flags & NEGATIVE) != 0
+        return [
+            lambda: zero,
+            lambda: ~zero,
+            lambda: negative,
+            lambda: ~negative,
+            lambda: ~negative & ~zero,
+            lambda: overflow,
+            lambda: ~overflow,
+            lambda: ~carry & ~zero,
+            lambda: ~carry,
+            lambda: carry,
+            lambda: carry & zero,
+            lambda: (overflow == negative) & ~zero,
+            lambda: (overflow == negative) & zero,
+            lambda: overflow != negative,
+            lambda: (overflow != negative) & zero,
+        ][branch_type]()
+
+    def _call(self, lanes, targets):
+        """Push the return address and jump lanes to targets"""
+        keep = self._write(lanes, self.stack_pointer[lanes],
+            self.program_counter[lanes])
+        targets = targets[np.isin(lanes, keep)]
+        self.stack_pointer[keep] += 2
+        self.program_counter[keep] = targets
+
+    def jump(self, op_code, lanes):
+        """Jumps"""
+        addr = _imm(op_code)
+        if op_code >> 16 == 0x1000:
+            #"""JMP HHLL"""
+            self.program_counter[lanes] = addr
+        elif op_code >> 20 == 0x120:
+            #"""Jx HHLL"""
+            branch_type = op_code >> 16 & 0xF
+            if branch_type == 0xF:
+                self._fault(lanes, NotImplementedError())
+                return
+            taken = lanes[self.cond_jump(branch_type, lanes)]
+            self.program_counter[taken] = addr
+        elif op_code >> 24 == 0x13:
+            #"""JME RX, RY, HHLL"""
+            y_reg = (op_code >> 20) & 0xF
+            x_reg = (op_code >> 16) & 0xF
+            taken = lanes[self.register[lanes, x_reg]
+                == self.register[lanes, y_reg]]
+            self.program_counter[taken] = addr
+        elif op_code >> 16 == 0x1400:
+            #"""CALL HHLL"""
+            lanes = self._write(lanes, self.stack_pointer[lanes],
+                self.program_counter[lanes])
+            self.stack_pointer[lanes] += 2
+            lanes, targets = self._read(lanes, np.full(len(lanes), addr))
+            self.program_counter[lanes] = targets
+        elif op_code == 0x15000000:
+            #"""RET"""
+            self.stack_pointer[lanes] -= 2
+            lanes, targets = self._read(lanes, self.stack_pointer[lanes])
+            self.program_counter[lanes] = targets
+        elif op_code >> 20 == 0x160:
+            #"""JMP RX"""
+            lanes = self._mask_code(lanes, op_code, 0xFFFF)
+            x_reg = (op_code >> 16) & 0xF
+            self.program_counter[lanes] = self.register[lanes, x_reg]
+        elif op_code >> 20 == 0x170:
+            #"""Cx HHLL"""
+            branch_type = op_code >> 16 & 0xF
+            if branch_type == 0xF:
+                self._fault(lanes, NotImplementedError())
+                return
+            taken = lanes[self.cond_jump(branch_type, lanes)]
+            self._call(taken, np.full(len(taken), addr))
+        elif op_code >> 20 == 0x180:
+            #"""CALL RX"""
+            lanes = self._mask_code(lanes, op_code, 0xFFFF)
+            x_reg = (op_code >> 16) & 0xF
+            self._call(lanes, self.register[lanes, x_reg].astype(np.int64))
+        else:
+            self._invalid(lanes)
+
+    def load(self, op_code, lanes):
+        """Loads"""
+        addr = np.full(len(lanes), _imm(op_code))
+        x_reg = (op_code >> 16) & 0xF
+        y_reg = (op_code >> 20) & 0xF
+        if op_code >> 20 == 0x200:
+            #"""LDI RX, HHLL"""
+            lanes, values = self._read(lanes, addr)
+            self.register[lanes, x_reg] = values
+        elif op_code >> 16 == 0x2100:
+            #"""LDI SP, HHLL"""
+            lanes, values = self._read(lanes, addr)
+            self.stack_pointer[lanes] = values
+        elif op_code >> 20 == 0x220:
+            #"""LDM RX, HHLL"""
+            lanes, pointers = self._read(lanes, addr)
+            lanes, values = self._read(lanes, pointers)
+            self.register[lanes, x_reg] = values
+        elif op_code >> 24 == 0x23:
+            #"""LDM RX, RY"""
+            if op_code & 0xFFFF:
+                self._invalid(lanes)
+                return
+            lanes, values = self._read(lanes,
+                self.register[lanes, y_reg].astype(np.int64))
+            self.register[lanes, x_reg] = values
+        elif op_code >> 24 == 0x24:
+            #"""MOV RX, RY"""
+            if op_code & 0xFFFF:
+                self._invalid(lanes)
+                return
+            self.register[lanes, x_reg] = self.register[lanes, y_reg]
+        else:
+            self._invalid(lanes)
+
+    def store(self, op_code, lanes):
+        """Stores"""
+        x_reg = (op_code >> 16) & 0xF
+        y_reg = (op_code >> 20) & 0xF
+        if op_code >> 20 == 0x300:
+            #"""STM RX, HHLL"""
+            self._write(lanes, np.full(len(lanes), _imm(op_code)),
+                self.register[lanes, x_reg])
+        elif op_code >> 24 == 0x31:
+            #"""STM RX, RY"""
+            if op_code & 0xFFFF:
+                self._invalid(lanes)
+                return
+            self._write(lanes, self.register[lanes, y_reg].astype(np.int64),
+                self.register[lanes, x_reg])
+        else:
+            self._invalid(lanes)
+
+    def _set(self, lanes, flag, mask):
+        """Set flag on lanes where mask holds and clear it elsewhere"""
+        flags = self.flags[lanes] & _clear(flag)
+        self.flags[lanes] = flags | np.where(mask, flag, 0).astype(np.uint16)
+
+    def flag_set(self, lanes, value):
+        """Set ZERO and NEGATIVE flags for value"""
+        self._set(lanes, ZERO, value == 0)
+        self._set(lanes, NEGATIVE, (value & 0x8000) != 0)
+        return value
+
+    def _add(self, lanes, left, right):
+        """16 bit signed addition operation"""
+        value = left + right
+        carry = value >= 0x10000
+        value = np.where(carry, value - 0x10000, value)
+        self._set(lanes, CARRY, carry)
+        left_neg = (left & 0x8000) != 0
+        right_neg = (right & 0x8000) != 0
+        value_neg = (value & 0x8000) != 0
+        self._set(lanes, OVERFLOW, (left_neg & right_neg & ~value_neg)
+            | (~left_neg & ~right_neg & value_neg))
+        return self.flag_set(lanes, value)
+
+    def _sub(self, lanes, left, right):
+        """16 bit signed subtraction operation"""
+        right = 0x10000 - right
+        value = self._add(lanes, left, right)
+        self.flags[lanes] ^= np.where(right == 0x8000, OVERFLOW | CARRY,
+            CARRY).astype(np.uint16)
+        return value
+
+    def _and(self, lanes, left, right):
+        """Bitwise and operation"""
+        return self.flag_set(lanes, left & right)
+
+    def _or(self, lanes, left, right):
+        """Bitwise or operation"""
+        return self.flag_set(lanes, left | right)
+
+    def _xor(self, lanes, left, right):
+        """Bitwise xor operation"""
+        return self.flag_set(lanes, left ^ right)
+
+    def _mul(self, lanes, left, right):
+        """16 bit signed multiplication"""
+        negate = (right & 0x8000) != 0
+        left = np.where(negate, 0x10000 - left, left)
+        right = np.where(negate, 0x10000 - right, right)
+        value = left * right
+        carry = value >= 0x10000
+        value = np.where(carry, value & 0xFFFF, value)
+        self._set(lanes, CARRY, carry)
+        return self.flag_set(lanes, value)
+
+    def _div(self, lanes, left, right):
+        """Division, returning (lanes, value) as zero divisors fault"""
+        valid = right != 0
+        if not valid.all():
+            self._fault(lanes[~valid],
+                ZeroDivisionError("integer division or modulo by zero"))
+            lanes = lanes[valid]
+            left = left[valid]
+            right = right[valid]
+        left = np.where(left > 0x7FFF, left - 0x10000, left)
+        right = np.where(right > 0x7FFF, right - 0x10000, right)
+        value = left // right
+        value = np.where(value < 0, value & 0xFFFF, value)
+        self._set(lanes, CARRY, left % right != 0)
+        return lanes, self.flag_set(lanes, value)
+
+    def _alu(self, op_code, lanes, operation, store=True):
+        """Decode the HHLL, RX RY and RX RY RZ forms of an ALU family"""
+        family = op_code >> 28
+        x_reg = (op_code >> 16) & 0xF
+        y_reg = (op_code >> 20) & 0xF
+        z_reg = (op_code >> 8) & 0xF
+        form = op_code >> 24 & 0xF
+        if form in (0x0, 0x3):
+            if op_code >> 20 != (family << 8) | (form << 4):
+                return False
+            lanes, right = self._read(lanes,
+                np.full(len(lanes), _imm(op_code)))
+            dest = x_reg
+        elif form in (0x1, 0x4):
+            lanes = self._mask_code(lanes, op_code, 0xFFFF)
+            right = self.register[lanes, y_reg].astype(np.int64)
+            dest = x_reg
+        elif form == 0x2:
+            lanes = self._mask_code(lanes, op_code, 0xF0FF)
+            right = self.register[lanes, y_reg].astype(np.int64)
+            dest = z_reg
+        else:
+            return False
+        left = self.register[lanes, x_reg].astype(np.int64)
+        if operation == self._div:
+            lanes, value = self._div(lanes, left, right)
+        else:
+            value = operation(lanes, left, right)
+        if store and form in (0x0, 0x1, 0x2):
+            self.register[lanes, dest] = value
+        return True
+
+    def _alu_family(self, op_code, lanes, operation, forms):
+        """Run op_code if its form is one of forms, else fault lanes"""
+        form = op_code >> 24 & 0xF
+        if form not in forms or not self._alu(op_code, lanes, operation):
+            self._invalid(lanes)
+
+    def add(self, op_code, lanes):
+        """Addition"""
+        self._alu_family(op_code, lanes, self._add, (0x0, 0x1, 0x2))
+
+    def sub(self, op_code, lanes):
+        """Subtraction"""
+        self._alu_family(op_code, lanes, self._sub, (0x0, 0x1, 0x2, 0x3, 0x4))
+
+    def bit_and(self, op_code, lanes):
+        """Bitwise and"""
+        self._alu_family(op_code, lanes, self._and, (0x0, 0x1, 0x2, 0x3, 0x4))
+
+    def bit_or(self, op_code, lanes):
+        """Bitwise or"""
+        self._alu_family(op_code, lanes, self._or, (0x0, 0x1, 0x2))
+
+    def bit_xor(self, op_code, lanes):
+        """Bitwise xor"""
+        self._alu_family(op_code, lanes, self._xor, (0x0, 0x1, 0x2))
+
+    def mul(self, op_code, lanes):
+        """Multiplication"""
+        self._alu_family(op_code, lanes, self._mul, (0x0, 0x1, 0x2))
+
+    def div(self, op_code, lanes):
+        """Division"""
+        self._alu_family(op_code, lanes, self._div, (0x0, 0x1, 0x2))
+
+    def shift(self, op_code, lanes):
+        """Bitwise/Arithmetic shifts"""
+        x_reg = (op_code & 0xF0000) >> 16
+        y_reg = (op_code & 0xF00000) >> 20
+        kind = op_code >> 20
+        if kind in (0xB00, 0xB10, 0xB20):
+            lanes = self._mask_code(lanes, op_code, 0xF0FF)
+            n_bits = np.full(len(lanes), (op_code & 0xF00) >> 8)
+            kind = (kind >> 4) & 0xF
+        elif op_code >> 24 in (0xB3, 0xB4, 0xB5):
+            lanes = self._mask_code(lanes, op_code, 0xFFFF)
+            n_bits = self.register[lanes, y_reg].astype(np.int64)
+            kind = (op_code >> 24 & 0xF) - 3
+        else:
+            self._invalid(lanes, "Invalid opcode")
+            return
+        value = self.register[lanes, x_reg].astype(np.int64)
+        wide = n_bits >= 16
+        n_bits = np.where(wide, 0, n_bits)
+        if kind == 0:
+            #"""SHL"""
+            value = np.where(wide, 0, value << n_bits)
+        elif kind == 1:
+            #"""SHR"""
+            value = np.where(wide, 0, value >> n_bits)
+        else:
+            #"""SAR"""
+            lead_bit = value & 0x8000
+            value = np.where(wide, 0, value >> n_bits) | lead_bit
+        self.register[lanes, x_reg] = self.flag_set(lanes, value & 0xFFFF)
+
+    def stack(self, op_code, lanes):
+        """Stack push/pop instructions"""
+        x_reg = (op_code & 0xF0000) >> 16
+        if op_code >> 20 == 0xC00:
+            #"""PUSH RX"""
+            lanes = self._mask_code(lanes, op_code, 0xFFFF)
+            lanes = self._write(lanes, self.stack_pointer[lanes],
+                self.register[lanes, x_reg])
+            self.stack_pointer[lanes] += 2
+        elif op_code >> 20 == 0xC10:
+            #"""POP RX"""
+            lanes = self._mask_code(lanes, op_code, 0xFFFF)
+            lanes, values = self._read(lanes, self.stack_pointer[lanes])
+            self.register[lanes, x_reg] = values
+            self.stack_pointer[lanes] -= 2
+        elif op_code >> 24 == 0xC2:
+            #"""PUSHALL"""
+            lanes = self._mask_code(lanes, op_code, 0xFFFFFF)
+            for i in range(16):
+                lanes = self._write(lanes, self.stack_pointer[lanes] + 2 * i,
+                    self.register[lanes, i])
+            self.stack_pointer[lanes] += 32
+        elif op_code >> 24 == 0xC3:
+            #"""POPALL"""
+            lanes = self._mask_code(lanes, op_code, 0xFFFFFF)
+            self.stack_pointer[lanes] -= 32
+            for i in range(16):
+                lanes, values = self._read(lanes,
+                    self.stack_pointer[lanes] + 2 * i)
+                self.register[lanes, i] = values
+        elif op_code >> 20 == 0xC40:
+            #"""PUSHF"""
+            lanes = self._mask_code(lanes, op_code, 0xFFFFFF)
+            lanes = self._write(lanes, self.stack_pointer[lanes],
+                self.flags[lanes])
+            self.stack_pointer[lanes] += 2
+        elif op_code >> 20 == 0xC50:
+            #"""POPF"""
+            lanes = self._mask_code(lanes, op_code, 0xFFFFFF)
+            self.stack_pointer[lanes] -= 2
+            lanes, values = self._read(lanes, self.stack_pointer[lanes])
+            self.flags[lanes] = values
+        else:
+            self._invalid(lanes, "Invalid opcode")
+
+    def palette(self, op_code, lanes):
+        """Palette loads"""
+        if op_code >> 16 == 0xD000:
+            #"""PAL HHLL"""
+            addrs = np.full(len(lanes), _imm(op_code))
+        elif op_code >> 20 == 0xD10:
+            #"""PAL RX"""
+            lanes = self._mask_code(lanes, op_code, 0xFFFF)
+            addrs = self.register[lanes, (op_code >> 16) & 0xF]
+        else:
+            self._invalid(lanes, "Invalid opcode")
+            return
+        offsets = (addrs[:, np.newaxis].astype(np.int64)
+            + np.arange(48)) & 0xFFFF
+        self.colors[lanes] = self.mem[lanes[:, np.newaxis],
+            offsets].reshape(-1, 16, 3)
@@ -0,0 +1,171 @@
+"""
+pchip16 BatchVM tests
+"""
+#pylint: disable=I0011,R0904
+
+import random
+import unittest
+from array import array
+from pchip16 import VM, ROM
+from pchip16.batch import BatchVM
+from pchip16.vm import ERRORS
+from pchip16.rom_tests import FILE_PATH
+
+# One template per instruction form, random bits fill the zero nibbles
+TEMPLATES = [
+    (0x00000000, 0x0), (0x01000000, 0x0), (0x02000000, 0x0),
+    (0x03000000, 0xF00), (0x04000000, 0x0F1F), (0x05000000, 0xFFFFFF),
+    (0x05000000, 0xFF03FF), (0x06000000, 0xFF0F00), (0x07000000, 0xFFFFF),
+    (0x08000000, 0x3),
+    (0x10000000, 0xFFFF), (0x12000000, 0xEFFFF), (0x13000000, 0xFFFFFF),
+    (0x14000000, 0xFFFF), (0x15000000, 0x0), (0x16000000, 0xF0000),
+    (0x17000000, 0xEFFFF), (0x18000000, 0xF0000),
+    (0x20000000, 0xFFFFF), (0x21000000, 0xFFFF), (0x22000000, 0xFFFFF),
+    (0x23000000, 0xFF0000), (0x24000000, 0xFF0000),
+    (0x30000000, 0xFFFFF), (0x31000000, 0xFF0000),
+    (0xB0000000, 0xF0F00), (0xB1000000, 0xF0F00), (0xB2000000, 0xF0F00),
+    (0xB3000000, 0xFF0000), (0xB4000000, 0xFF0000), (0xB5000000, 0xFF0000),
+    (0xC0000000, 0xF0000), (0xC1000000, 0xF0000), (0xC2000000, 0x0),
+    (0xC3000000, 0x0), (0xC4000000, 0x0), (0xC5000000, 0x0),
+    (0xD0000000, 0xFFFF), (0xD1000000, 0xF0000),
+]
+for family in range(0x4, 0xB):
+    TEMPLATES += [(family << 28, 0xFFFFF), (family << 28 | 0x1 << 24, 0xFF0000),
+        (family << 28 | 0x2 << 24, 0xFF0F00)]
+TEMPLATES += [(0x53000000, 0xFFFFF), (0x54000000, 0xFF0000),
+    (0x63000000, 0xFFFFF), (0x64000000, 0xFF0000)]
+
+def random_program(rand, length):
+    """Return op codes of mostly valid instructions, some corrupted"""
+    program = []
+    for _ in range(length):
+        base, bits = rand.choice(TEMPLATES)
+        op_code = base | (rand.getrandbits(32) & bits)
+        if rand.random() < 0.02:
+            op_code ^= 1 << rand.randrange(32)
+        program.append(op_code)
+    return program
+
+def make_vm(rand, program):
+    """Return a VM with program at 0 and random registers and data"""
+    vmac = VM(rand.getrandbits(32))
+    for addr, op_code in enumerate(program):
+        vmac.mem[4 * addr] = (op_code >> 16 & 0xFF) << 8 | op_code >> 24
+        vmac.mem[4 * addr + 2] = (op_code & 0xFF) << 8 | (op_code >> 8 & 0xFF)
+    for addr in range(4 * len(program), 0x400, 2):
+        if rand.random() < 0.1:
+            vmac.mem[addr] = rand.getrandbits(16) & 0x3FC
+    for addr in range(0x400, 0x10000, 0x80):
+        vmac.mem[addr] = rand.getrandbits(16)
+    for reg in range(16):
+        vmac.register[reg] = rand.choice((0, 1, 0x7FFF, 0x8000, 0xFFFF,
+            rand.getrandbits(16), rand.getrandbits(4)))
+    vmac.flags = rand.getrandbits(8)
+    return vmac
+
+class TestLockstep(unittest.TestCase):
+    """Compare BatchVM lanes against independent VMs"""
+    def assertLaneEqual(self, batch, lane, vmac):
+        self.assertEqual(list(batch.register[lane]), list(vmac.register))
+        self.assertEqual(batch.flags[lane], vmac.flags)
+        self.assertEqual(batch.program_counter[lane], vmac.program_counter)
+        self.assertEqual(batch.stack_pointer[lane], vmac.stack_pointer)
+        self.assertEqual(batch.rng_state[lane], vmac.rng_state)
+        self.assertEqual(batch.mem[lane].tobytes(), vmac.mem._mem.tobytes())
+        self.assertTrue((batch.framebuffer[lane]
+            == vmac.gpu.framebuffer).all())
+        self.assertEqual(batch.background[lane], vmac.gpu.background)
+        self.assertEqual(batch.colors[lane].tolist(),
+            vmac.gpu.palette.colors.tolist())
+    def run_random(self, seed, lanes=32, steps=64):
+        rand = random.Random(seed)
+        program = random_program(rand, 0x100)
+        vms = [make_vm(rand, program) for _ in range(lanes)]
+        batch = BatchVM.from_vms(vms)
+        errors = [None] * lanes
+        for _ in range(steps):
+            batch.step()
+            for lane, vmac in enumerate(vms):
+                if errors[lane] is None:
+                    try:
+                        vmac.cycle()
+                    except ERRORS as err:
+                        errors[lane] = err
+        for lane, vmac in enumerate(vms):
+            if errors[lane] is None:
+                self.assertFalse(batch.faulted[lane])
+                self.assertLaneEqual(batch, lane, vmac)
+            else:
+                self.assertTrue(batch.faulted[lane])
+                self.assertIs(type(batch.errors[lane]), type(errors[lane]))
+    def test_random_programs(self):
+        for seed in range(20):
+            self.run_random(seed)
+    def test_sprites(self):
+        # SPR 8x8 ; DRW R0, R1, 0x400 ; FLIP 1, 1 ; DRW R2, R3, R4 ;
+        # DRW R0, R1, 0x400 ; BGC 5
+        program = [0x04000408, 0x05100004, 0x08000003, 0x06320400,
+            0x05100004, 0x03000500]
+        rand = random.Random(3)
+        vms = []
+        for _ in range(16):
+            vmac = make_vm(rand, program)
+            for reg in range(4):
+                vmac.register[reg] = rand.randrange(-12, 330) & 0xFFFF
+            vmac.register[4] = 0x400 + rand.randrange(0x100)
+            for addr in range(0x400, 0x600, 2):
+                vmac.mem[addr] = rand.getrandbits(16)
+            vms.append(vmac)
+        batch = BatchVM.from_vms(vms)
+        for _ in program:
+            batch.step()
+            for vmac in vms:
+                vmac.cycle()
+        self.assertTrue(batch.framebuffer.any())
+        for lane, vmac in enumerate(vms):
+            self.assertLaneEqual(batch, lane, vmac)
+    def test_vm_round_trip(self):
+        rand = random.Random(1)
+        vmac = make_vm(rand, random_program(rand, 16))
+        batch = BatchVM.from_vms([vmac])
+        copy = batch.vm(0)
+        self.assertEqual(copy.state_hash(), vmac.state_hash())
+
+class TestFrames(unittest.TestCase):
+    """Run a ROM frame by frame in lockstep"""
+    def test_bounce(self):
+        with open(FILE_PATH, 'rb') as file_handle:
+            rom = ROM(file_handle)
+        vms = [VM(7 + lane) for lane in range(4)]
+        batch = BatchVM(4, seed=7)
+        batch.load_rom(rom)
+        for vmac in vms:
+            vmac.load_rom(rom)
+        for _ in range(3):
+            counts = batch.run_frame()
+            self.assertEqual(counts.tolist(),
+                [vmac.run_frame() for vmac in vms])
+        for lane, vmac in enumerate(vms):
+            self.assertEqual(batch.vm(lane).state_hash(), vmac.state_hash())
+        self.assertTrue((batch.framebuffer == vms[0].gpu.framebuffer).all())
+    def test_controllers(self):
+        # LDM R0, RA ; LDM R1, RB ; LDM R2, RC ; VBLNK ; JMP 0
+        rom = ROM()
+        rom.data = array('B', b''.join(word.to_bytes(4, 'big')
+            for word in (0x23A00000, 0x23B10000, 0x23C20000, 0x02000000,
+            0x10000000)))
+        pads = [(0x81, 0x4), (0x2, 0x80)]
+        vms = [VM(lane) for lane in range(2)]
+        batch = BatchVM(2, seed=0)
+        batch.load_rom(rom)
+        batch.register[:, 0xA:0xD] = (0xFFF0, 0xFFF2, 0xFFF1)
+        for lane, vmac in enumerate(vms):
+            vmac.load_rom(rom)
+            vmac.register[0xA:0xD] = array('H', (0xFFF0, 0xFFF2, 0xFFF1))
+            vmac.run_frame(pads[lane])
+        batch.run_frame(pads)
+        self.assertEqual(vms[0].register[:3].tolist(), [0x81, 0x4, 0x0400])
+        for lane, vmac in enumerate(vms):
+            self.assertEqual(batch.register[lane, :3].tolist(),
+                vmac.register[:3].tolist())
+            self.assertEqual(batch.vm(lane).state_hash(), vmac.state_hash())
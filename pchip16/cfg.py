@@ -0,0 +1,439 @@
+"""
+pchip16 cfg - control-flow and call graphs of ROMs
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from .disasm import decode, fetch, immediate
+from .vm import VM
+
+# Cached CFGs kept by analyse()
+CACHE_SIZE = 16
+_CACHE = OrderedDict()
+
+# Block terminators, after the op codes VM.jump handles
+#   jump: JMP HHLL            branch: Jx HHLL, JME RX, RY, HHLL
+#   call: CALL HHLL, Cx HHLL  return: RET
+#   indirect: JMP RX          indirect call: CALL RX
+#   invalid: op codes VM.execute rejects  fault: Jx or Cx with RES
+#   end: runs off the ROM
+# fall blocks end where another block starts.
+KINDS = ('fall', 'jump', 'branch', 'call', 'return', 'indirect',
+    'indirect call', 'invalid', 'fault', 'end')
+
+class Block(object):
+    """Instructions start..stop ending in a terminator of kind
+
+    successors are the blocks control can pass to, the return site for
+    calls; calls the direct call targets. function is the entry of the
+    first function found to own the block, depth its loop nesting depth.
+    """
+    def __init__(self, start, stop, kind, successors, calls):
+        self.start = start
+        self.stop = stop
+        self.kind = kind
+        self.successors = successors
+        self.calls = calls
+        self.function = None
+        self.depth = 0
+
+    def __repr__(self):
+        return '<Block %04X-%04X %s>' % (self.start, self.stop, self.kind)
+
+class Function(object):
+    """The blocks reachable from entry without following calls"""
+    def __init__(self, entry):
+        self.entry = entry
+        self.blocks = []
+        self.callees = set()
+        self.indirect_calls = []
+        self.indirect_jumps = []
+
+class Loop(object):
+    """A natural loop: header, the blocks of its body and back edges
+
+    parent is the header of the innermost enclosing loop, or None.
+    """
+    def __init__(self, header, body, back_edges):
+        self.header = header
+        self.body = body
+        self.back_edges = back_edges
+        self.parent = None
+        self.depth = 1
+
+def _successor_order(blocks, start):
+    """Return the blocks reachable from start in reverse postorder"""
+    order = []
+    seen = {start}
+    stack = [(start, iter(blocks[start].successors))]
+    while stack:
+        node, successors = stack[-1]
+        for successor in successors:
+            if successor in blocks and successor not in seen:
+                seen.add(successor)
+                stack.append((successor,
+                    iter(blocks[successor].successors)))
+                break
+        else:
+            stack.pop()
+            order.append(node)
+    order.reverse()
+    return order
+
+def dominators(blocks, start):
+    """Return {block: immediate dominator} over blocks reachable from start
+
+    The iterative algorithm of Cooper, Harvey and Kennedy.
+    """
+    order = _successor_order(blocks, start)
+    index = {node: position for position, node in enumerate(order)}
+    predecessors = {node: [] for node in order}
+    for node in order:
+        for successor in blocks[node].successors:
+            if successor in predecessors:
+                predecessors[successor].append(node)
+    idom = {start: start}
+    changed = True
+    while changed:
+        changed = False
+        for node in order[1:]:
+            new = None
+            for pred in predecessors[node]:
+                if pred not in idom:
+                    continue
+                if new is None:
+                    new = pred
+                    continue
+                while pred != new:
+                    while index[pred] > index[new]:
+                        pred = idom[pred]
+                    while index[new] > index[pred]:
+                        new = idom[new]
+            if idom.get(node) != new:
+                idom[node] = new
+                changed = True
+    return idom
+
+def _dominates(idom, header, node):
+    """Return True if header dominates node"""
+    while True:
+        if node == header:
+            return True
+        parent = idom[node]
+        if parent == node:
+            return False
+        node = parent
+
+class _Probe(object):
+    """Classify op codes by executing each once on a scratch VM
+
+    VM.execute raises ValueError for every encoding it rejects, whatever
+    the machine state, and NotImplementedError only for the RES condition.
+    Other errors, such as dividing by zero, depend on the state.
+    """
+    def __init__(self):
+        self.vm = VM()
+        self.kinds = {}
+
+    def __call__(self, op_code):
+        """Return 'invalid' or 'fault' if op_code always raises, else None"""
+        if op_code in self.kinds:
+            return self.kinds[op_code]
+        vmac = self.vm
+        vmac.program_counter = VM.program_counter
+        vmac.stack_pointer = VM.stack_pointer
+        vmac.flags = VM.flags
+        kind = None
+        try:
+            vmac.execute(op_code)
+        except ValueError:
+            kind = 'invalid'
+        except NotImplementedError:
+            kind = 'fault'
+        except (IndexError, ZeroDivisionError):
+            pass
+        self.kinds[op_code] = kind
+        return kind
+
+class CFG(object):
+    """Basic blocks, functions and loops of one program image
+
+    Built by recursive descent from entry, so only code reachable through
+    resolved edges is split into blocks. Blocks end at the jump, call and
+    return op codes of VM.jump, at op codes VM.execute rejects or faults
+    on, and where another block starts. CALL HHLL calls the word at HHLL,
+    as VM.jump does, read from the image; Cx HHLL calls HHLL. JMP RX and
+    CALL RX cannot be resolved and are flagged on their block and
+    function. Read only once built: analyse() shares it.
+    """
+    def __init__(self, data, entry=0, checksum=0):
+        self.data = data
+        self.entry = entry
+        self.checksum = checksum
+        self.blocks = {}
+        self.functions = {}
+        self.loops = []
+        self.irreducible = []
+        self._probe = _Probe()
+        self._build()
+        del self._probe
+        self._find_functions()
+        self._find_loops()
+
+    def _word(self, addr):
+        """Return the little-endian memory word at addr, 0 past the image"""
+        data = self.data
+        if addr + 1 < len(data):
+            return data[addr] | (data[addr + 1] << 8)
+        return data[addr] if addr < len(data) else 0
+
+    def _flow(self, op_code):
+        """Return (kind, targets, calls, falls through) for op_code
+
+        kind is None for op codes that do not end a block.
+        """
+        kind = self._probe(op_code)
+        if kind is not None:
+            return kind, [], [], False
+        code = op_code >> 24
+        if code in (0x10, 0x12, 0x13):
+            target = immediate(op_code)
+            if code == 0x10:
+                return 'jump', [target], [], False
+            return 'branch', [target], [], True
+        if code == 0x14:
+            return 'call', [], [self._word(immediate(op_code))], True
+        if code == 0x17:
+            return 'call', [], [immediate(op_code)], True
+        if code == 0x15:
+            return 'return', [], [], False
+        if code == 0x16:
+            return 'indirect', [], [], False
+        if code == 0x18:
+            return 'indirect call', [], [], True
+        return None, [], [], True
+
+    def _build(self):
+        """Find reachable instructions, then split them at leaders"""
+        data = self.data
+        size = len(data) - 3
+        aligned = decode(data)['op_code'].tolist()
+        op_codes = {}
+        def op_code_at(addr):
+            """Return the op code at addr"""
+            if addr & 3:
+                if addr not in op_codes:
+                    op_codes[addr] = fetch(data, addr)
+                return op_codes[addr]
+            return aligned[addr >> 2]
+        leaders = {self.entry}
+        seen = set()
+        work = [self.entry]
+        while work:
+            addr = work.pop()
+            while addr not in seen and addr < size:
+                seen.add(addr)
+                kind, targets, calls, falls = self._flow(
+                    op_code_at(addr))
+                if kind is not None:
+                    following = targets + calls
+                    if falls:
+                        following.append(addr + 4)
+                    leaders.update(following)
+                    work.extend(following)
+                    break
+                addr += 4
+        for leader in sorted(leaders):
+            addr = leader
+            while addr < size:
+                kind, targets, calls, falls = self._flow(
+                    op_code_at(addr))
+                addr += 4
+                if kind is not None:
+                    if falls:
+                        targets.append(addr)
+                    self.blocks[leader] = Block(leader, addr, kind, targets,
+                        calls)
+                    break
+                if addr in leaders:
+                    self.blocks[leader] = Block(leader, addr, 'fall', [addr],
+                        [])
+                    break
+            else:
+                if addr > leader:
+                    self.blocks[leader] = Block(leader, addr, 'end', [], [])
+
+    def _find_functions(self):
+        """Group blocks under the entry and each call target"""
+        entries = [self.entry] + sorted({target
+            for block in self.blocks.values() for target in block.calls})
+        for entry in entries:
+            if entry not in self.blocks or entry in self.functions:
+                continue
+            function = Function(entry)
+            self.functions[entry] = function
+            for start in _successor_order(self.blocks, entry):
+                block = self.blocks[start]
+                function.blocks.append(start)
+                function.callees.update(block.calls)
+                if block.kind == 'indirect call':
+                    function.indirect_calls.append(block.stop - 4)
+                elif block.kind == 'indirect':
+                    function.indirect_jumps.append(block.stop - 4)
+                if block.function is None:
+                    block.function = entry
+            function.blocks.sort()
+
+    def _find_loops(self):
+        """Find natural loops per function and nest them"""
+        loops = {}
+        for function in self.functions.values():
+            idom = dominators(self.blocks, function.entry)
+            back_edges = {}
+            for source in function.blocks:
+                for header in self.blocks[source].successors:
+                    if header in idom and _dominates(idom, header, source):
+                        back_edges.setdefault(header, []).append(source)
+            predecessors = self._predecessors(function)
+            for header, sources in back_edges.items():
+                if header in loops:
+                    continue
+                body = {header}
+                work = list(sources)
+                while work:
+                    node = work.pop()
+                    if node not in body:
+                        body.add(node)
+                        work.extend(predecessors.get(node, ()))
+                loops[header] = Loop(header, body, sources)
+            self._find_irreducible(function, idom)
+        self.loops = sorted(loops.values(),
+            key=lambda loop: (len(loop.body), loop.header))
+        for position, loop in enumerate(self.loops):
+            for outer in self.loops[position + 1:]:
+                if loop.header in outer.body:
+                    loop.parent = outer.header
+                    break
+        for loop in reversed(self.loops):
+            if loop.parent is not None:
+                loop.depth = loops[loop.parent].depth + 1
+        for loop in self.loops:
+            for start in loop.body:
+                block = self.blocks[start]
+                block.depth = max(block.depth, loop.depth)
+
+    def _predecessors(self, function):
+        """Return {block: predecessors} within function"""
+        members = set(function.blocks)
+        predecessors = {}
+        for start in function.blocks:
+            for successor in self.blocks[start].successors:
+                if successor in members:
+                    predecessors.setdefault(successor, []).append(start)
+        return predecessors
+
+    def _find_irreducible(self, function, idom):
+        """Note retreating edges whose target does not dominate the source"""
+        order = _successor_order(self.blocks, function.entry)
+        index = {node: position for position, node in enumerate(order)}
+        for source in order:
+            for target in self.blocks[source].successors:
+                if target in index and index[target] <= index[source] \
+                        and not _dominates(idom, target, source) \
+                        and (source, target) not in self.irreducible:
+                    self.irreducible.append((source, target))
+
+    def block_at(self, addr):
+        """Return the block holding the instruction at addr, or None"""
+        for block in self.blocks.values():
+            if block.start <= addr < block.stop:
+                return block
+        return None
+
+    def call_graph(self):
+        """Return {function entry: sorted direct callees}"""
+        return {entry: sorted(function.callees)
+            for entry, function in sorted(self.functions.items())}
+
+    def unreached(self):
+        """Return (start, stop) ranges of the image in no block"""
+        covered = np.zeros(len(self.data) + 2, dtype=np.int8)
+        for block in self.blocks.values():
+            covered[block.start + 1:block.stop + 1] = 1
+        covered[0] = covered[-1] = 1
+        edges = np.flatnonzero(np.diff(covered)).tolist()
+        return list(zip(edges[::2], edges[1::2]))
+
+    def to_dict(self):
+        """Return the graph as JSON-serialisable dicts and lists"""
+        return {
+            'checksum': self.checksum,
+            'entry': self.entry,
+            'blocks': [{
+                'start': block.start,
+                'stop': block.stop,
+                'kind': block.kind,
+                'successors': block.successors,
+                'calls': block.calls,
+                'function': block.function,
+                'depth': block.depth,
+            } for _, block in sorted(self.blocks.items())],
+            'functions': [{
+                'entry': function.entry,
+                'blocks': function.blocks,
+                'callees': sorted(function.callees),
+                'indirect_calls': function.indirect_calls,
+                'indirect_jumps': function.indirect_jumps,
+            } for _, function in sorted(self.functions.items())],
+            'loops': [{
+                'header': loop.header,
+                'body': sorted(loop.body),
+                'back_edges': loop.back_edges,
+                'parent': loop.parent,
+                'depth': loop.depth,
+            } for loop in self.loops],
+            'irreducible': [list(edge) for edge in self.irreducible],
+        }
+
+    def to_dot(self):
+        """Return the CFG in Graphviz dot, one cluster per function"""
+        lines = ['digraph cfg {', '  node [shape=box fontname=monospace];']
+        for entry, function in sorted(self.functions.items()):
+            lines.append('  subgraph cluster_%04X {' % entry)
+            lines.append('    label="%04X";' % entry)
+            for start in function.blocks:
+                block = self.blocks[start]
+                if block.function == entry:
+                    lines.append('    b%04X [label="%04X-%04X %s%s"];' % (
+                        start, start, block.stop, block.kind,
+                        ' loop %i' % block.depth if block.depth else ''))
+            lines.append('  }')
+        for start, block in sorted(self.blocks.items()):
+            for successor in block.successors:
+                if successor in self.blocks:
+                    lines.append('  b%04X -> b%04X;' % (start, successor))
+            for target in block.calls:
+                if target in self.blocks:
+                    lines.append('  b%04X -> b%04X [style=dashed];' % (
+                        start, target))
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+def analyse(rom):
+    """Return the CFG of rom, cached by ROM checksum and start address"""
+    key = (rom.calc_checksum(), rom.start_address)
+    cfg = _CACHE.get(key)
+    if cfg is not None:
+        _CACHE.move_to_end(key)
+        return cfg
+    cfg = CFG(rom.data, rom.start_address, key[0])
+    _CACHE[key] = cfg
+    if len(_CACHE) > CACHE_SIZE:
+        _CACHE.popitem(last=False)
+    return cfg
+
+def clear_cache():
+    """Drop every CFG analyse() cached"""
+    _CACHE.clear()
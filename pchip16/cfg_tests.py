@@ -0,0 +1,125 @@
+"""
+pchip16 cfg tests
+"""
+#pylint: disable=I0011,R0904
+
+import json
+import unittest
+from array import array
+from pchip16 import ROM
+from pchip16.cfg import CFG, analyse, clear_cache, dominators
+from pchip16.rom_tests import FILE_PATH
+
+def make_image(words):
+    """Return bytes holding big-endian op code words from address 0"""
+    data = bytearray()
+    for word in words:
+        data += word.to_bytes(4, 'big')
+    return bytes(data)
+
+# 00: LDI R0, #0      04: ADDI R0, 1      08: SUBI R1, 1
+# 0C: JNZ #0008       10: CZ #0030        14: CALL [#0040] -> 0038
+# 18: JME R0, R1, #24 1C: JMP #0004       20: NOP (dead)
+# 24: CALL R2         28: JMP R3          2C: NOP (dead)
+# 30: RET             34: NOP (dead)      38: NOP
+# 3C: RET             40: DW #0038
+PROGRAM = make_image([0x20000000, 0x40000100, 0x50010100, 0x12010800,
+    0x17003000, 0x14004000, 0x13102400, 0x10000400, 0, 0x18020000,
+    0x16030000, 0, 0x15000000, 0, 0, 0x15000000, 0x38000000])
+
+class TestCFG(unittest.TestCase):
+    """Test blocks, functions and loops of a small program"""
+    def setUp(self):
+        self.cfg = CFG(PROGRAM)
+    def test_blocks(self):
+        blocks = self.cfg.blocks
+        self.assertEqual(sorted(blocks), [0x00, 0x04, 0x08, 0x10, 0x14,
+            0x18, 0x1C, 0x24, 0x28, 0x30, 0x38])
+        self.assertEqual([(blocks[0x08].stop, blocks[0x08].kind,
+            blocks[0x08].successors)], [(0x10, 'branch', [0x08, 0x10])])
+        self.assertEqual(blocks[0x00].kind, 'fall')
+        self.assertEqual(blocks[0x10].calls, [0x30])
+        self.assertEqual(blocks[0x14].calls, [0x38])
+        self.assertEqual(blocks[0x14].successors, [0x18])
+        self.assertEqual(blocks[0x1C].successors, [0x04])
+        self.assertEqual(blocks[0x24].kind, 'indirect call')
+        self.assertEqual(blocks[0x28].kind, 'indirect')
+        self.assertEqual(blocks[0x38].stop, 0x40)
+        self.assertEqual(self.cfg.block_at(0x0C), blocks[0x08])
+        self.assertEqual(self.cfg.block_at(0x20), None)
+    def test_functions(self):
+        self.assertEqual(self.cfg.call_graph(),
+            {0x00: [0x30, 0x38], 0x30: [], 0x38: []})
+        main = self.cfg.functions[0]
+        self.assertEqual(main.indirect_calls, [0x24])
+        self.assertEqual(main.indirect_jumps, [0x28])
+        self.assertEqual(self.cfg.blocks[0x38].function, 0x38)
+        self.assertEqual(self.cfg.unreached(), [(0x20, 0x24), (0x2C, 0x30),
+            (0x34, 0x38), (0x40, 0x44)])
+    def test_loops(self):
+        inner, outer = self.cfg.loops
+        self.assertEqual((inner.header, sorted(inner.body), inner.back_edges,
+            inner.parent, inner.depth), (0x08, [0x08], [0x08], 0x04, 2))
+        self.assertEqual((outer.header, sorted(outer.body), outer.back_edges,
+            outer.parent, outer.depth),
+            (0x04, [0x04, 0x08, 0x10, 0x14, 0x18, 0x1C], [0x1C], None, 1))
+        depths = {start: block.depth
+            for start, block in self.cfg.blocks.items()}
+        self.assertEqual((depths[0x00], depths[0x04], depths[0x08],
+            depths[0x24]), (0, 1, 2, 0))
+        self.assertEqual(self.cfg.irreducible, [])
+    def test_dominators(self):
+        idom = dominators(self.cfg.blocks, 0)
+        self.assertEqual(idom[0x24], 0x18)
+        self.assertEqual(idom[0x08], 0x04)
+        self.assertEqual(idom[0x04], 0x00)
+    def test_irreducible(self):
+        # 00: JZ #000C  04: NOP  08: JZ #0010  0C: JMP #0004  10: RET
+        cfg = CFG(make_image([0x12000C00, 0, 0x12001000, 0x10000400,
+            0x15000000]))
+        self.assertEqual(cfg.loops, [])
+        self.assertEqual(len(cfg.irreducible), 1)
+    def test_rejected(self):
+        # 00: DB #0F000000 (a no-op to VM.misc)  04: JZ #0010
+        # 08: JMP with a non-zero reserved byte  0C: NOP
+        # 10: JRES #0000                         14: NOP
+        cfg = CFG(make_image([0x0F000000, 0x12001000, 0x10050000, 0,
+            0x120F0000, 0]))
+        blocks = cfg.blocks
+        self.assertEqual(sorted(blocks), [0x00, 0x08, 0x10])
+        self.assertEqual((blocks[0x00].stop, blocks[0x00].kind),
+            (0x08, 'branch'))
+        self.assertEqual((blocks[0x08].kind, blocks[0x08].successors),
+            ('invalid', []))
+        self.assertEqual((blocks[0x10].kind, blocks[0x10].successors),
+            ('fault', []))
+        self.assertEqual(cfg.unreached(), [(0x0C, 0x10), (0x14, 0x18)])
+    def test_export(self):
+        exported = json.loads(json.dumps(self.cfg.to_dict()))
+        self.assertEqual(len(exported['blocks']), 11)
+        self.assertEqual(exported['loops'][0]['parent'], 0x04)
+        dot = self.cfg.to_dot()
+        self.assertIn('b0010 -> b0030 [style=dashed];', dot)
+        self.assertIn('b001C -> b0004;', dot)
+
+class TestAnalyse(unittest.TestCase):
+    """Test ROM analysis and its cache"""
+    def setUp(self):
+        clear_cache()
+    def test_cached(self):
+        with open(FILE_PATH, 'rb') as file_handle:
+            rom = ROM(file_handle)
+        first = analyse(rom)
+        self.assertIs(analyse(rom), first)
+        self.assertEqual(first.checksum, rom.calc_checksum())
+        self.assertEqual(len(first.functions), 1)
+        self.assertGreater(len(first.loops), 0)
+        clear_cache()
+        self.assertIsNot(analyse(rom), first)
+    def test_key(self):
+        rom = ROM()
+        rom.data = array('B', PROGRAM)
+        whole = analyse(rom)
+        rom.start_address = 0x30
+        self.assertIsNot(analyse(rom), whole)
+        self.assertEqual(list(analyse(rom).functions), [0x30])
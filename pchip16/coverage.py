@@ -0,0 +1,156 @@
+"""
+pchip16 coverage - executed address and branch edge bitmaps
+"""
+
+import struct
+
+import numpy as np
+
+from .disasm import branch_target, listing
+from .farm import Job, load_rom, run_farm
+from .vm import VM, ERRORS
+
+EDGE_MAP_SIZE = 2**16
+COVERAGE_MAGIC = b'P16C'
+# Magic, ROM data CRC-32, runs merged
+COVERAGE_HEADER = struct.Struct('<4sII')
+
+def edge_index(source, target):
+    """Return the edge map bit for a transfer from source to target"""
+    return ((source >> 1) ^ target) & (EDGE_MAP_SIZE - 1)
+
+def _bits(data):
+    """Return a uint8 view of a bytearray bitmap"""
+    return np.frombuffer(data, dtype=np.uint8)
+
+class Coverage(object):
+    """Bitmaps of executed addresses and taken branch edges
+
+    Set a VM's coverage attribute to one and VM.run marks bit pc of
+    executed for every instruction, and for every transfer of control
+    that is not a fall-through, bit edge_index(source, target) of edges.
+    Edges are hashed AFL-style, so distinct edges may share a bit. Maps
+    from separate runs of the same ROM merge with a bitwise OR.
+    """
+    def __init__(self, checksum=0):
+        self.checksum = checksum
+        self.runs = 1
+        self.executed = bytearray(2**16 // 8)
+        self.edges = bytearray(EDGE_MAP_SIZE // 8)
+
+    def is_executed(self, addr):
+        """Return True if an instruction at addr ran"""
+        return bool(self.executed[addr >> 3] & (1 << (addr & 7)))
+
+    def is_taken(self, source, target):
+        """Return True if the edge bit for source -> target is set"""
+        index = edge_index(source, target)
+        return bool(self.edges[index >> 3] & (1 << (index & 7)))
+
+    def addresses(self):
+        """Return the executed addresses in ascending order"""
+        return np.flatnonzero(np.unpackbits(_bits(self.executed),
+            bitorder='little'))
+
+    def counts(self):
+        """Return (executed addresses, edge bits set)"""
+        return (int(np.unpackbits(_bits(self.executed)).sum()),
+            int(np.unpackbits(_bits(self.edges)).sum()))
+
+    def merge(self, *others):
+        """OR others into this map in place and return it"""
+        for other in others:
+            if other.checksum != self.checksum:
+                raise ValueError("coverage of different ROMs")
+            np.bitwise_or(_bits(self.executed), _bits(other.executed),
+                out=_bits(self.executed))
+            np.bitwise_or(_bits(self.edges), _bits(other.edges),
+                out=_bits(self.edges))
+            self.runs += other.runs
+        return self
+
+    def new_bits(self, base):
+        """Return (addresses, edge bits) set here but not in base"""
+        executed = _bits(self.executed) & ~_bits(base.executed)
+        edges = _bits(self.edges) & ~_bits(base.edges)
+        return (int(np.unpackbits(executed).sum()),
+            int(np.unpackbits(edges).sum()))
+
+    def save(self, path):
+        """Write the maps to path"""
+        with open(path, 'wb') as file_handle:
+            file_handle.write(COVERAGE_HEADER.pack(COVERAGE_MAGIC,
+                self.checksum, self.runs))
+            file_handle.write(self.executed)
+            file_handle.write(self.edges)
+
+    @classmethod
+    def load(cls, path):
+        """Read maps written by save()"""
+        with open(path, 'rb') as file_handle:
+            data = file_handle.read()
+        magic, checksum, runs = COVERAGE_HEADER.unpack_from(data)
+        if magic != COVERAGE_MAGIC:
+            raise ValueError("%s is not a coverage file" % path)
+        coverage = cls(checksum)
+        coverage.runs = runs
+        offset = COVERAGE_HEADER.size
+        size = len(coverage.executed)
+        coverage.executed[:] = data[offset:offset + size]
+        coverage.edges[:] = data[offset + size:]
+        if len(coverage.edges) != EDGE_MAP_SIZE // 8:
+            raise ValueError("%s is truncated" % path)
+        return coverage
+
+    def report(self, data, start=0, stop=None):
+        """Return a disassembly of data annotated with coverage
+
+        Executed instructions are marked with '*'. Executed direct jumps
+        and calls note whether their target edge was ever taken.
+        """
+        lines = []
+        executed = 0
+        total = 0
+        for addr, op_code, text in listing(data, start, stop):
+            total += 1
+            hit = self.is_executed(addr)
+            executed += hit
+            note = ''
+            target = branch_target(op_code)
+            if hit and target is not None:
+                note = '  ; taken' if self.is_taken(addr, target) \
+                    else '  ; never taken'
+            lines.append('%s %04X  %08X  %s%s' % ('*' if hit else ' ', addr,
+                op_code, text, note))
+        addresses, edges = self.counts()
+        lines.insert(0, '; %i/%i words executed, %i addresses, %i edges, '
+            '%i runs' % (executed, total, addresses, edges, self.runs))
+        return '\n'.join(lines) + '\n'
+
+def collect(job):
+    """Run job with coverage and return a dict holding the Coverage"""
+    rom = load_rom(job.rom)
+    vmac = VM(job.seed)
+    vmac.load_rom(rom)
+    vmac.coverage = Coverage(rom.calc_checksum())
+    inputs = job.inputs or ()
+    error = None
+    try:
+        for frame in range(job.frames):
+            vmac.run_frame(inputs[frame] if frame < len(inputs) else (0, 0),
+                present=False)
+    except ERRORS as err:
+        error = "%s: %s" % (type(err).__name__, err)
+    return {
+        'rom': job.rom,
+        'seed': job.seed,
+        'coverage': vmac.coverage,
+        'error': error,
+    }
+
+def gather(rom, frames, seeds, workers=None, inputs=()):
+    """Run rom once per seed across workers and return merged Coverage"""
+    jobs = [Job(rom, frames, inputs, seed) for seed in seeds]
+    results = [result for _, result in run_farm(jobs, workers, collect)]
+    merged = results[0]['coverage']
+    return merged.merge(*[result['coverage'] for result in results[1:]])
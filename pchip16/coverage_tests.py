@@ -0,0 +1,84 @@
+"""
+pchip16 coverage tests
+"""
+#pylint: disable=I0011,R0904
+
+import os
+import pickle
+import tempfile
+import unittest
+from pchip16 import VM, ROM
+from pchip16.coverage import Coverage, collect, gather
+from pchip16.farm import Job
+from pchip16.rom_tests import FILE_PATH
+from pchip16.vm_tests import make_vm
+
+def covered_vm(words):
+    """Return make_vm(words) recording coverage"""
+    vmac = make_vm(words)
+    vmac.coverage = Coverage()
+    return vmac
+
+class TestCoverage(unittest.TestCase):
+    """Test recording and merging coverage"""
+    def test_run(self):
+        # 0: JZ 12, 4: JMP 16, 8: NOP (dead), 12: NOP, 16: VBLNK
+        vmac = covered_vm([0x12000C00, 0x10001000, 0, 0, 0x02000000])
+        self.assertEqual(vmac.run(10), 3)
+        coverage = vmac.coverage
+        self.assertEqual(coverage.addresses().tolist(), [0, 4, 16])
+        self.assertTrue(coverage.is_taken(4, 16))
+        self.assertFalse(coverage.is_taken(0, 12))
+        self.assertEqual(coverage.counts(), (3, 1))
+    def test_matches_plain(self):
+        with open(FILE_PATH, 'rb') as file_handle:
+            rom = ROM(file_handle)
+        plain = VM()
+        plain.load_rom(rom)
+        covered = VM()
+        covered.load_rom(rom)
+        covered.coverage = Coverage()
+        for _ in range(30):
+            self.assertEqual(covered.run_frame(), plain.run_frame())
+        self.assertEqual(covered.state_hash(), plain.state_hash())
+        self.assertGreater(covered.coverage.counts()[0], 10)
+    def test_merge(self):
+        first = covered_vm([0x12000C00, 0x10001000, 0, 0, 0x02000000])
+        second = covered_vm([0x12000C00, 0x10001000, 0, 0, 0x02000000])
+        first.run(10)
+        second.flags = 0x4
+        second.run(10)
+        coverage = Coverage().merge(first.coverage, second.coverage)
+        self.assertEqual(coverage.addresses().tolist(), [0, 4, 12, 16])
+        self.assertEqual(coverage.runs, 3)
+        self.assertEqual(second.coverage.new_bits(first.coverage), (1, 1))
+        self.assertEqual(first.coverage.new_bits(coverage), (0, 0))
+        self.assertRaises(ValueError, coverage.merge, Coverage(1))
+    def test_save_load(self):
+        vmac = covered_vm([0x10000800, 0, 0x02000000])
+        vmac.run(10)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rom.cov')
+            vmac.coverage.save(path)
+            loaded = Coverage.load(path)
+        self.assertEqual(loaded.executed, vmac.coverage.executed)
+        self.assertEqual(loaded.edges, vmac.coverage.edges)
+        copy = pickle.loads(pickle.dumps(loaded))
+        self.assertEqual(copy.addresses().tolist(), [0, 8])
+    def test_report(self):
+        vmac = covered_vm([0x12000C00, 0x10001000, 0, 0, 0x02000000])
+        vmac.run(10)
+        report = vmac.coverage.report(vmac.mem._mem, 0, 20).splitlines()
+        self.assertEqual(report[0], '; 3/5 words executed, 3 addresses, '
+            '1 edges, 1 runs')
+        self.assertEqual(report[1], '* 0000  12000C00  JZ #000C  ; never taken')
+        self.assertEqual(report[2], '* 0004  10001000  JMP #0010  ; taken')
+        self.assertEqual(report[3], '  0008  00000000  NOP')
+
+class TestGather(unittest.TestCase):
+    """Test coverage across worker processes"""
+    def test_gather(self):
+        merged = gather(FILE_PATH, 5, [0, 1], workers=2)
+        single = collect(Job(FILE_PATH, 5, (), 0))['coverage']
+        self.assertEqual(merged.runs, 2)
+        self.assertEqual(single.new_bits(merged), (0, 0))
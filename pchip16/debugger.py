@@ -0,0 +1,187 @@
+"""
+pchip16 debugger - breakpoints and memory watchpoints
+"""
+
+from .disasm import disassemble
+from .vm import CYCLES_PER_FRAME
+
+class Break(Exception):
+    """Raised out of VM.run when a breakpoint or watchpoint stops the VM
+
+    kind is 'break', 'read' or 'write'; addr is the breakpoint or the
+    watched address touched, and pc the next instruction to run.
+    Execution stops on an instruction boundary, so the VM can resume.
+    """
+    def __init__(self, kind, addr, pc):
+        Exception.__init__(self, "%s at %04X, pc %04X" % (kind, addr, pc))
+        self.kind = kind
+        self.addr = addr
+        self.pc = pc
+
+class Watchpoint(object):
+    """A watched address range start..stop"""
+    def __init__(self, start, stop, read, write, condition):
+        self.start = start
+        self.stop = stop
+        self.read = read
+        self.write = write
+        self.condition = condition
+
+class Debugger(object):
+    """Breakpoints and watchpoints on one VM
+
+    While any are set the debugger is the VM's debugger and VM.run takes
+    the instrumented loop here; with none set the VM runs its normal loop.
+    Breakpoints stop before the instruction at their address runs.
+    Watchpoints use page read and write hooks on memory and stop after
+    the instruction touching the range completes. A condition is called
+    with the VM, or the VM and the address touched, and the stop happens
+    only if it returns true.
+
+    A stop raises Break out of run_frame, leaving that frame's counters
+    and listeners unfinished; step() and cont() resume from there.
+    """
+    def __init__(self, vmac):
+        self.vm = vmac
+        self.breakpoints = {}
+        self.watchpoints = []
+        self._hit = None
+        self._resume = None
+
+    def add_breakpoint(self, addr, condition=None):
+        """Stop before executing addr, if condition(vm) is true"""
+        self.breakpoints[addr] = condition
+        self._attach()
+
+    def remove_breakpoint(self, addr):
+        """Remove the breakpoint at addr"""
+        del self.breakpoints[addr]
+        self._attach()
+
+    def watch(self, start, stop=None, read=False, write=True,
+            condition=None):
+        """Stop after reads and/or writes touching start..stop
+
+        stop defaults to the word at start. Returns the Watchpoint.
+        """
+        if stop is None:
+            stop = start + 2
+        watchpoint = Watchpoint(start, stop, read, write, condition)
+        self.watchpoints.append(watchpoint)
+        mem = self.vm.mem
+        if read:
+            mem.add_read_hook(start, stop, self._read)
+        if write:
+            mem.add_write_hook(start, stop, self._written)
+        self._attach()
+        return watchpoint
+
+    def unwatch(self, watchpoint):
+        """Remove a Watchpoint returned by watch()"""
+        self.watchpoints.remove(watchpoint)
+        mem = self.vm.mem
+        mem.remove_read_hook(0, 2**16, self._read)
+        mem.remove_write_hook(0, 2**16, self._written)
+        for other in self.watchpoints:
+            if other.read:
+                mem.add_read_hook(other.start, other.stop, self._read)
+            if other.write:
+                mem.add_write_hook(other.start, other.stop, self._written)
+        self._attach()
+
+    def clear(self):
+        """Remove every breakpoint and watchpoint"""
+        self.breakpoints.clear()
+        for watchpoint in list(self.watchpoints):
+            self.unwatch(watchpoint)
+        self._attach()
+
+    def _attach(self):
+        """Point the VM at this debugger only while something is set"""
+        if self.breakpoints or self.watchpoints:
+            self.vm.debugger = self
+        elif self.vm.debugger is self:
+            del self.vm.debugger
+
+    def _touched(self, kind, start, stop):
+        """Hook body: note the first watchpoint start..stop triggers"""
+        if self._hit is not None:
+            return
+        for watchpoint in self.watchpoints:
+            if not getattr(watchpoint, kind):
+                continue
+            if start < watchpoint.stop and watchpoint.start < stop:
+                addr = max(start, watchpoint.start)
+                if watchpoint.condition is None \
+                        or watchpoint.condition(self.vm, addr):
+                    self._hit = (kind, addr)
+                    return
+
+    def _read(self, start, stop):
+        """Read hook"""
+        self._touched('read', start, stop)
+
+    def _written(self, start, stop):
+        """Write hook"""
+        self._touched('write', start, stop)
+
+    def run(self, cycles):
+        """VM.run with breakpoint and watchpoint checks"""
+        vmac = self.vm
+        fetch = vmac.fetch
+        execute = vmac.execute
+        breakpoints = self.breakpoints
+        resume = self._resume
+        self._resume = None
+        self._hit = None
+        vmac.vblank_wait = False
+        for count in range(cycles):
+            addr = vmac.program_counter
+            if addr in breakpoints and addr != resume:
+                condition = breakpoints[addr]
+                if condition is None or condition(vmac):
+                    self._resume = addr
+                    raise Break('break', addr, addr)
+            resume = None
+            op_code = fetch()
+            vmac.program_counter = addr + 4
+            execute(op_code)
+            if self._hit is not None:
+                kind, touched = self._hit
+                self._hit = None
+                raise Break(kind, touched, vmac.program_counter)
+            if vmac.vblank_wait:
+                return count + 1
+        return cycles
+
+    def step(self):
+        """Execute one instruction, returning the Break it caused or None
+
+        A breakpoint at the current pc does not stop the step.
+        """
+        self._resume = self.vm.program_counter
+        return self.cont(1)
+
+    def cont(self, cycles=None):
+        """Run until a stop or VBLNK, returning the Break or None"""
+        vmac = self.vm
+        if cycles is None:
+            cycles = CYCLES_PER_FRAME
+        try:
+            vmac.run(cycles)
+        except Break as stop:
+            return stop
+        return None
+
+    def where(self):
+        """Return 'PC: instruction' for the next instruction"""
+        vmac = self.vm
+        return '%04X: %s' % (vmac.program_counter,
+            disassemble(vmac.fetch()))
+
+    def registers(self):
+        """Return a one line dump of pc, sp, flags and registers"""
+        vmac = self.vm
+        return 'PC=%04X SP=%04X F=%02X ' % (vmac.program_counter,
+            vmac.stack_pointer, vmac.flags) + ' '.join('R%X=%04X' % (reg,
+            value) for reg, value in enumerate(vmac.register))
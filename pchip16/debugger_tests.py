@@ -0,0 +1,114 @@
+"""
+pchip16 debugger tests
+"""
+#pylint: disable=I0011,R0904
+
+import pickle
+import unittest
+from pchip16 import VM, ROM
+from pchip16.debugger import Break, Debugger
+from pchip16.memory import Memory, WatchedMemory
+from pchip16.rom_tests import FILE_PATH
+from pchip16.vm_tests import make_vm
+
+# 0: ADDI R0, #0100 (adds mem[0x100]), 4: STM R0, #0200, 8: LDM R1, #0200,
+# 12: JMP 0
+PROGRAM = [0x40000001, 0x30000002, 0x22010002, 0x10000000]
+
+class TestBreakpoints(unittest.TestCase):
+    """Test pc breakpoints"""
+    def setUp(self):
+        self.vm = make_vm(PROGRAM)
+        self.vm.mem[0x100] = 1
+        self.debugger = Debugger(self.vm)
+    def test_attach(self):
+        self.assertIsNone(self.vm.debugger)
+        self.debugger.add_breakpoint(8)
+        self.assertIs(self.vm.debugger, self.debugger)
+        self.debugger.remove_breakpoint(8)
+        self.assertIsNone(self.vm.debugger)
+        self.assertNotIn('debugger', self.vm.__dict__)
+    def test_break_and_resume(self):
+        self.debugger.add_breakpoint(8)
+        with self.assertRaises(Break) as context:
+            self.vm.run(100)
+        self.assertEqual((context.exception.kind, context.exception.pc),
+            ('break', 8))
+        self.assertEqual(self.vm.program_counter, 8)
+        self.assertEqual(self.vm.register[0], 1)
+        stop = self.debugger.cont(100)
+        self.assertEqual((stop.pc, self.vm.register[0]), (8, 2))
+        self.assertIsNone(self.debugger.step())
+        self.assertEqual(self.vm.program_counter, 12)
+    def test_condition(self):
+        self.debugger.add_breakpoint(4, lambda vmac: vmac.register[0] == 3)
+        stop = self.debugger.cont(100)
+        self.assertEqual(stop.kind, 'break')
+        self.assertEqual(self.vm.register[0], 3)
+    def test_run_frame(self):
+        self.debugger.add_breakpoint(12)
+        self.assertRaises(Break, self.vm.run_frame)
+        self.assertEqual(self.vm.frame_count, 0)
+    def test_where(self):
+        self.assertEqual(self.debugger.where(), '0000: ADDI R0, #0100')
+        self.assertTrue(self.debugger.registers().startswith(
+            'PC=0000 SP=FDF0 F=00 R0=0000'))
+    def test_pickle(self):
+        self.debugger.add_breakpoint(8, lambda vmac: True)
+        copy = pickle.loads(pickle.dumps(self.vm))
+        self.assertIsNone(copy.debugger)
+
+class TestWatchpoints(unittest.TestCase):
+    """Test memory watchpoints"""
+    def setUp(self):
+        self.vm = make_vm(PROGRAM)
+        self.vm.mem[0x100] = 1
+        self.debugger = Debugger(self.vm)
+    def test_write(self):
+        self.debugger.watch(0x200)
+        stop = self.debugger.cont(100)
+        self.assertEqual((stop.kind, stop.addr, stop.pc), ('write', 0x200, 8))
+        self.assertEqual(self.vm.mem[0x200], 1)
+    def test_read(self):
+        self.debugger.watch(0x100, 0x101, read=True, write=False)
+        stop = self.debugger.cont(100)
+        self.assertEqual((stop.kind, stop.addr, stop.pc), ('read', 0x100, 4))
+        stop = self.debugger.cont(100)
+        self.assertEqual(stop.pc, 4)
+        self.assertEqual(self.vm.register[0], 2)
+    def test_condition(self):
+        self.debugger.watch(0x200, condition=lambda vmac, addr:
+            vmac.mem[addr] >= 3)
+        stop = self.debugger.cont(100)
+        self.assertEqual(self.vm.mem[0x200], 3)
+        self.assertEqual(stop.pc, 8)
+    def test_outside_range(self):
+        self.debugger.watch(0x202, 0x210, read=True)
+        self.assertIsNone(self.debugger.cont(40))
+    def test_unwatch(self):
+        first = self.debugger.watch(0x200)
+        self.debugger.watch(0x100, read=True, write=False)
+        self.debugger.unwatch(first)
+        self.assertIsInstance(self.vm.mem, WatchedMemory)
+        self.assertEqual(self.debugger.cont(100).kind, 'read')
+        self.debugger.clear()
+        self.assertIs(type(self.vm.mem), Memory)
+        self.assertIsNone(self.vm.debugger)
+        self.assertIsNone(self.debugger.cont(100))
+
+class TestBounce(unittest.TestCase):
+    """Test a debugged ROM runs like an undebugged one"""
+    def test_same_state(self):
+        with open(FILE_PATH, 'rb') as file_handle:
+            rom = ROM(file_handle)
+        plain = VM()
+        plain.load_rom(rom)
+        debugged = VM()
+        debugged.load_rom(rom)
+        debugger = Debugger(debugged)
+        debugger.add_breakpoint(0xFFFC)
+        debugger.watch(0xF000, read=True)
+        for _ in range(20):
+            plain.run_frame()
+            debugged.run_frame()
+        self.assertEqual(debugged.state_hash(), plain.state_hash())
@@ -0,0 +1,221 @@
+"""
+pchip16 disasm - Chip16 instruction listings
+"""
+
+import numpy as np
+
+CONDITIONS = ('Z', 'NZ', 'N', 'NN', 'P', 'O', 'NO', 'A', 'AE', 'B', 'BE',
+    'G', 'GE', 'L', 'LE', 'RES')
+
+# First op code byte -> (mnemonic, operand layout)
+#   X, Y, Z: registers in bits 16-19, 20-23 and 8-11
+#   N: the nibble in bits 8-11; HHLL: the little-endian immediate
+FORMATS = {
+    0x00: ('NOP', ''),
+    0x01: ('CLS', ''),
+    0x02: ('VBLNK', ''),
+    0x03: ('BGC', 'N'),
+    0x04: ('SPR', 'HHLL'),
+    0x05: ('DRW', 'X Y HHLL'),
+    0x06: ('DRW', 'X Y Z'),
+    0x07: ('RND', 'X HHLL'),
+    0x08: ('FLIP', 'FLIP'),
+    0x09: ('SND0', ''),
+    0x0A: ('SND1', 'HHLL'),
+    0x0B: ('SND2', 'HHLL'),
+    0x0C: ('SND3', 'HHLL'),
+    0x0D: ('SNP', 'X HHLL'),
+    0x0E: ('SNG', 'SNG'),
+    0x10: ('JMP', 'HHLL'),
+    0x12: ('J', 'C HHLL'),
+    0x13: ('JME', 'X Y HHLL'),
+    0x14: ('CALL', 'HHLL'),
+    0x15: ('RET', ''),
+    0x16: ('JMP', 'X'),
+    0x17: ('C', 'C HHLL'),
+    0x18: ('CALL', 'X'),
+    0x20: ('LDI', 'X HHLL'),
+    0x21: ('LDI', 'SP HHLL'),
+    0x22: ('LDM', 'X HHLL'),
+    0x23: ('LDM', 'X Y'),
+    0x24: ('MOV', 'X Y'),
+    0x30: ('STM', 'X HHLL'),
+    0x31: ('STM', 'X Y'),
+    0x40: ('ADDI', 'X HHLL'),
+    0x41: ('ADD', 'X Y'),
+    0x42: ('ADD', 'X Y Z'),
+    0x50: ('SUBI', 'X HHLL'),
+    0x51: ('SUB', 'X Y'),
+    0x52: ('SUB', 'X Y Z'),
+    0x53: ('CMPI', 'X HHLL'),
+    0x54: ('CMP', 'X Y'),
+    0x60: ('ANDI', 'X HHLL'),
+    0x61: ('AND', 'X Y'),
+    0x62: ('AND', 'X Y Z'),
+    0x63: ('TSTI', 'X HHLL'),
+    0x64: ('TST', 'X Y'),
+    0x70: ('ORI', 'X HHLL'),
+    0x71: ('OR', 'X Y'),
+    0x72: ('OR', 'X Y Z'),
+    0x80: ('XORI', 'X HHLL'),
+    0x81: ('XOR', 'X Y'),
+    0x82: ('XOR', 'X Y Z'),
+    0x90: ('MULI', 'X HHLL'),
+    0x91: ('MUL', 'X Y'),
+    0x92: ('MUL', 'X Y Z'),
+    0xA0: ('DIVI', 'X HHLL'),
+    0xA1: ('DIV', 'X Y'),
+    0xA2: ('DIV', 'X Y Z'),
+    0xB0: ('SHL', 'X N'),
+    0xB1: ('SHR', 'X N'),
+    0xB2: ('SAR', 'X N'),
+    0xB3: ('SHL', 'X Y'),
+    0xB4: ('SHR', 'X Y'),
+    0xB5: ('SAR', 'X Y'),
+    0xC0: ('PUSH', 'X'),
+    0xC1: ('POP', 'X'),
+    0xC2: ('PUSHALL', ''),
+    0xC3: ('POPALL', ''),
+    0xC4: ('PUSHF', ''),
+    0xC5: ('POPF', ''),
+    0xD0: ('PAL', 'HHLL'),
+    0xD1: ('PAL', 'X'),
+}
+
+# Op code bytes whose HHLL is a branch target
+BRANCHES = frozenset((0x10, 0x12, 0x13, 0x17))
+
+def immediate(op_code):
+    """Return the HHLL operand of op_code"""
+    return ((op_code & 0xFF) << 8) | ((op_code >> 8) & 0xFF)
+
+def fetch(data, addr):
+    """Return the big-endian op code at addr in a bytes-like data"""
+    return (data[addr] << 24) | (data[addr + 1] << 16) \
+        | (data[addr + 2] << 8) | data[addr + 3]
+
+def branch_target(op_code):
+    """Return the target of a direct jump or call, or None"""
+    if op_code >> 24 in BRANCHES:
+        return immediate(op_code)
+    return None
+
+def disassemble(op_code):
+    """Return assembly text for op_code, DB for unknown op codes"""
+    entry = FORMATS.get(op_code >> 24)
+    if entry is None:
+        return 'DB #%08X' % op_code
+    mnemonic, layout = entry
+    operands = []
+    for field in layout.split():
+        if field == 'X':
+            operands.append('R%X' % ((op_code >> 16) & 0xF))
+        elif field == 'Y':
+            operands.append('R%X' % ((op_code >> 20) & 0xF))
+        elif field == 'Z':
+            operands.append('R%X' % ((op_code >> 8) & 0xF))
+        elif field == 'N':
+            operands.append('%i' % ((op_code >> 8) & 0xF))
+        elif field == 'HHLL':
+            operands.append('#%04X' % immediate(op_code))
+        elif field == 'SP':
+            operands.append('SP')
+        elif field == 'C':
+            mnemonic += CONDITIONS[(op_code >> 16) & 0xF]
+        elif field == 'FLIP':
+            operands.append('%i, %i' % ((op_code >> 1) & 1, op_code & 1))
+        elif field == 'SNG':
+            operands.append('#%02X, #%04X' % ((op_code >> 16) & 0xFF,
+                op_code & 0xFFFF))
+    if not operands:
+        return mnemonic
+    return '%s %s' % (mnemonic, ', '.join(operands))
+
+# One decoded instruction. op_code is the word as the VM fetches it, code
+# its first byte and group the instruction class, code >> 4. z is also the
+# N operand. known marks op codes in FORMATS, branch those in BRANCHES.
+DECODED = np.dtype([
+    ('addr', '<u4'),
+    ('op_code', '<u4'),
+    ('code', 'u1'),
+    ('group', 'u1'),
+    ('x', 'u1'),
+    ('y', 'u1'),
+    ('z', 'u1'),
+    ('imm', '<u2'),
+    ('known', '?'),
+    ('branch', '?'),
+])
+_KNOWN = np.zeros(256, dtype=bool)
+_KNOWN[list(FORMATS)] = True
+_BRANCH = np.zeros(256, dtype=bool)
+_BRANCH[list(BRANCHES)] = True
+
+def words(data):
+    """Return a little-endian uint32 view of the whole words in data"""
+    data = np.frombuffer(data, dtype=np.uint8)
+    return data[:len(data) & ~3].view('<u4')
+
+def decode(data, base=0):
+    """Decode every 4 byte word of data into a DECODED array
+
+    Read little-endian, a word holds the op code bytes in reverse, so
+    each field is a shift and mask of the whole array: the first byte is
+    the low byte and HHLL the high half. Addresses start at base.
+    """
+    word = words(data)
+    decoded = np.empty(len(word), dtype=DECODED)
+    decoded['addr'] = np.arange(base, base + 4 * len(word), 4,
+        dtype=np.uint32)
+    decoded['op_code'] = word.byteswap()
+    code = (word & 0xFF).astype(np.uint8)
+    decoded['code'] = code
+    decoded['group'] = code >> 4
+    decoded['x'] = (word >> 8) & 0xF
+    decoded['y'] = (word >> 12) & 0xF
+    decoded['z'] = (word >> 16) & 0xF
+    decoded['imm'] = word >> 16
+    decoded['known'] = _KNOWN[code]
+    decoded['branch'] = _BRANCH[code]
+    return decoded
+
+def texts(decoded):
+    """Return an object array of assembly text for a DECODED array
+
+    Each distinct op code is formatted once, so repeated instructions
+    and padding cost a lookup.
+    """
+    unique, inverse = np.unique(decoded['op_code'], return_inverse=True)
+    table = np.array([disassemble(int(op_code)) for op_code in unique],
+        dtype=object)
+    return table[inverse]
+
+def format_listing(decoded):
+    """Yield 'ADDR  OPCODE  text' lines for a DECODED array"""
+    for addr, op_code, text in zip(decoded['addr'].tolist(),
+            decoded['op_code'].tolist(), texts(decoded)):
+        yield '%04X  %08X  %s' % (addr, op_code, text)
+
+def listing(data, start=0, stop=None):
+    """Iterate (addr, op_code, text) for each 4 byte word from start to stop"""
+    decoded = decode(memoryview(data)[start:stop], start)
+    return zip(decoded['addr'].tolist(), decoded['op_code'].tolist(),
+        texts(decoded).tolist())
+
+def stream(file_handle, base=0, chunk=2**16):
+    """Yield DECODED arrays for successive words read from a binary file
+
+    Reads chunk words at a time, so dumps of any size decode in bounded
+    memory. A trailing partial word is ignored.
+    """
+    leftover = b''
+    while True:
+        data = file_handle.read(4 * chunk)
+        if not data:
+            return
+        data = leftover + data
+        size = len(data) & ~3
+        leftover = data[size:]
+        if size:
+            yield decode(data[:size], base)
+            base += size
@@ -0,0 +1,95 @@
+"""
+pchip16 disasm tests
+"""
+#pylint: disable=I0011,R0904
+
+import io
+import unittest
+
+import numpy as np
+
+from pchip16.disasm import branch_target, decode, disassemble, fetch, \
+    format_listing, immediate, listing, stream, texts
+
+class TestDisassemble(unittest.TestCase):
+    """Test op code to text"""
+    def test_operands(self):
+        cases = [
+            (0x00000000, 'NOP'),
+            (0x02000000, 'VBLNK'),
+            (0x03000500, 'BGC 5'),
+            (0x04000810, 'SPR #1008'),
+            (0x05213412, 'DRW R1, R2, #1234'),
+            (0x06210300, 'DRW R1, R2, R3'),
+            (0x08000003, 'FLIP 1, 1'),
+            (0x09000000, 'SND0'),
+            (0x0A003412, 'SND1 #1234'),
+            (0x0C003412, 'SND3 #1234'),
+            (0x0D011E00, 'SNP R1, #001E'),
+            (0x0E12AB34, 'SNG #12, #AB34'),
+            (0x12050010, 'JO #1000'),
+            (0x170F0010, 'CRES #1000'),
+            (0x13A50010, 'JME R5, RA, #1000'),
+            (0x15000000, 'RET'),
+            (0x16030000, 'JMP R3'),
+            (0x21000010, 'LDI SP, #1000'),
+            (0x24100000, 'MOV R0, R1'),
+            (0x42100200, 'ADD R0, R1, R2'),
+            (0xB0020300, 'SHL R2, 3'),
+            (0xD1040000, 'PAL R4'),
+        ]
+        for op_code, text in cases:
+            self.assertEqual(disassemble(op_code), text)
+    def test_unknown(self):
+        self.assertEqual(disassemble(0x0F000000), 'DB #0F000000')
+        self.assertEqual(disassemble(0xFF123456), 'DB #FF123456')
+    def test_branch_target(self):
+        self.assertEqual(branch_target(0x10003412), 0x1234)
+        self.assertEqual(branch_target(0x15000000), None)
+    def test_listing(self):
+        data = bytes([0x01, 0, 0, 0, 0x10, 0, 0x04, 0, 0xFF])
+        self.assertEqual(fetch(data, 4), 0x10000400)
+        self.assertEqual(list(listing(data)), [(0, 0x01000000, 'CLS'),
+            (4, 0x10000400, 'JMP #0004')])
+
+class TestDecode(unittest.TestCase):
+    """Test vectorised decoding against the scalar disassembler"""
+    def setUp(self):
+        self.data = np.random.RandomState(16).randint(0, 256, 2**16,
+            dtype=np.uint8).tobytes()
+    def test_fields(self):
+        decoded = decode(self.data)
+        self.assertEqual(len(decoded), 2**14)
+        for entry in decoded[::97]:
+            addr = int(entry['addr'])
+            op_code = fetch(self.data, addr)
+            self.assertEqual(int(entry['op_code']), op_code)
+            self.assertEqual(entry['code'], op_code >> 24)
+            self.assertEqual(entry['group'], op_code >> 28)
+            self.assertEqual(entry['x'], (op_code >> 16) & 0xF)
+            self.assertEqual(entry['y'], (op_code >> 20) & 0xF)
+            self.assertEqual(entry['z'], (op_code >> 8) & 0xF)
+            self.assertEqual(entry['imm'], immediate(op_code))
+            self.assertEqual(entry['branch'],
+                branch_target(op_code) is not None)
+    def test_texts(self):
+        decoded = decode(self.data)
+        expected = [disassemble(fetch(self.data, addr))
+            for addr in range(0, 2**16, 4)]
+        self.assertEqual(texts(decoded).tolist(), expected)
+    def test_base_and_partial_word(self):
+        decoded = decode(self.data[:10], 0x100)
+        self.assertEqual(decoded['addr'].tolist(), [0x100, 0x104])
+        self.assertEqual(list(listing(self.data, 6, 14)),
+            [(addr, fetch(self.data, addr),
+            disassemble(fetch(self.data, addr))) for addr in (6, 10)])
+    def test_format_listing(self):
+        data = bytes([0x20, 0x01, 0x34, 0x12])
+        self.assertEqual(list(format_listing(decode(data, 0x40))),
+            ['0040  20013412  LDI R1, #1234'])
+    def test_stream(self):
+        chunks = list(stream(io.BytesIO(self.data[:4003]), 0x10, chunk=100))
+        self.assertEqual([len(chunk) for chunk in chunks], [100] * 10)
+        joined = np.concatenate(chunks)
+        self.assertTrue(np.array_equal(joined, decode(self.data[:4000],
+            0x10)))
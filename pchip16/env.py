@@ -0,0 +1,205 @@
+"""
+pchip16 env - vectorised, gym-like environment over many VMs
+"""
+
+import random
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from .gpu import SCREEN_HEIGHT, SCREEN_WIDTH
+from .shared import attach_block
+from .vm import VM, ERRORS
+
+# Observation type -> (per-environment shape, dtype)
+OBSERVATIONS = {
+    'registers': ((16,), np.uint16),
+    'ram': ((2**16,), np.uint8),
+    'screen': ((SCREEN_HEIGHT, SCREEN_WIDTH), np.uint8),
+}
+
+class _Shard(object):
+    """The VMs for environments lo..hi, writing into shared arrays"""
+    def __init__(self, rom, lo, hi, obs_type, seed, observations, actions,
+            dones):
+        self.rom = rom
+        self.lo = lo
+        self.obs_type = obs_type
+        self.seed = seed
+        self.vms = [VM() for _ in range(lo, hi)]
+        self.observations = observations[lo:hi]
+        self.actions = actions[lo:hi]
+        # Strided views of each pad's words, read as Python ints in place
+        words = memoryview(self.actions).cast('B').cast('H')
+        self._pad1 = words[::2]
+        self._pad2 = words[1::2]
+        self.dones = dones[lo:hi]
+
+    def _observe(self, index):
+        """Copy environment index's observation into the shared array"""
+        vmac = self.vms[index]
+        if self.obs_type == 'registers':
+            self.observations[index] = vmac.register
+        elif self.obs_type == 'screen':
+            self.observations[index] = vmac.gpu.framebuffer
+        else:
+            self.observations[index] = vmac.mem._mem
+
+    def reset(self, mask=None):
+        """Restart environments where mask is set, or all of them"""
+        for index, vmac in enumerate(self.vms):
+            if mask is not None and not mask[self.lo + index]:
+                continue
+            if self.seed is None:
+                vmac.seed(random.getrandbits(32))
+            else:
+                vmac.seed(self.seed + self.lo + index)
+            vmac.reset()
+            vmac.load_rom(self.rom)
+            self.dones[index] = False
+            self._observe(index)
+
+    def step(self):
+        """Advance every live environment one frame"""
+        dones = self.dones
+        for index, (vmac, pad1, pad2) in enumerate(zip(self.vms, self._pad1,
+                self._pad2)):
+            if dones[index]:
+                continue
+            try:
+                vmac.run_frame((pad1, pad2))
+            except ERRORS:
+                dones[index] = True
+            self._observe(index)
+
+def _attach(name, shape, dtype):
+    """Return (shared memory, array) attached to block name"""
+    block = attach_block(name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+def _worker(conn, rom, lo, hi, obs_type, seed, layout):
+    """Worker process loop serving reset/step commands for one shard"""
+    blocks = []
+    arrays = []
+    shard = array = None
+    try:
+        for name, shape, dtype in layout:
+            block, array = _attach(name, shape, dtype)
+            blocks.append(block)
+            arrays.append(array)
+        shard = _Shard(rom, lo, hi, obs_type, seed, *arrays)
+        while True:
+            command, argument = conn.recv()
+            if command == 'reset':
+                shard.reset(argument)
+            elif command == 'step':
+                shard.step()
+            else:
+                break
+            conn.send(None)
+    finally:
+        # Views into the blocks must go before the blocks can close
+        shard = array = None
+        del arrays[:]
+        for block in blocks:
+            block.close()
+
+class VectorEnv(object):
+    """Step many VMs running one ROM with batched inputs and outputs
+
+    Observations, done flags and actions live in preallocated arrays that
+    every step writes in place; with workers they are shared memory and the
+    environments are split evenly across that many processes.
+    """
+    def __init__(self, rom, num_envs, workers=0, obs_type='registers',
+            seed=None, context=None):
+        self.num_envs = num_envs
+        shape, dtype = OBSERVATIONS[obs_type]
+        layout = [
+            ((num_envs,) + shape, dtype),
+            ((num_envs, 2), np.uint16),
+            ((num_envs,), np.bool_),
+        ]
+        self._blocks = []
+        self._pipes = []
+        self._processes = []
+        if not workers:
+            arrays = [np.zeros(shape, dtype) for shape, dtype in layout]
+            self.observations, self.actions, self.dones = arrays
+            self._shard = _Shard(rom, 0, num_envs, obs_type, seed, *arrays)
+            return
+        self._shard = None
+        arrays = []
+        names = []
+        for shape, dtype in layout:
+            block = SharedMemory(create=True,
+                size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+            self._blocks.append(block)
+            arrays.append(np.ndarray(shape, dtype=dtype, buffer=block.buf))
+            names.append((block.name, shape, dtype))
+        self.observations, self.actions, self.dones = arrays
+        context = context or get_context()
+        bounds = np.linspace(0, num_envs, workers + 1).astype(int).tolist()
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker, args=(child, rom, lo,
+                hi, obs_type, seed, names), daemon=True)
+            process.start()
+            self._pipes.append(parent)
+            self._processes.append(process)
+
+    def _broadcast(self, command, argument=None):
+        """Send command to every worker and wait for all to finish"""
+        for pipe in self._pipes:
+            pipe.send((command, argument))
+        for pipe in self._pipes:
+            pipe.recv()
+
+    def reset(self, mask=None):
+        """Restart environments (those set in mask) and return observations"""
+        if mask is not None:
+            mask = np.asarray(mask, dtype=bool)
+        if self._shard is not None:
+            self._shard.reset(mask)
+        else:
+            self._broadcast('reset', mask)
+        return self.observations
+
+    def step(self, actions):
+        """Latch (N,) or (N, 2) pad words and run one frame everywhere
+
+        Returns (observations, dones); both are the environment's own
+        arrays and are overwritten by the next call.
+        """
+        actions = np.asarray(actions)
+        if actions.ndim == 1:
+            self.actions[:, 0] = actions
+            self.actions[:, 1] = 0
+        else:
+            self.actions[:] = actions
+        if self._shard is not None:
+            self._shard.step()
+        else:
+            self._broadcast('step')
+        return self.observations, self.dones
+
+    def close(self):
+        """Stop workers and release shared memory"""
+        for pipe in self._pipes:
+            pipe.send(('close', None))
+        for process in self._processes:
+            process.join()
+        self._pipes = []
+        self._processes = []
+        self.observations = self.actions = self.dones = None
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
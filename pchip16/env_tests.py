@@ -0,0 +1,97 @@
+"""
+pchip16 VectorEnv tests
+"""
+#pylint: disable=I0011,R0904
+
+import unittest
+import numpy as np
+from pchip16 import VM, ROM
+from pchip16.env import VectorEnv, _worker
+from pchip16.rom_tests import FILE_PATH
+
+class TestVectorEnv(unittest.TestCase):
+    """Test stepping environments in and out of process"""
+    def setUp(self):
+        with open(FILE_PATH, 'rb') as file_handle:
+            self.rom = ROM(file_handle)
+    def expected(self, frames, seed):
+        vmac = VM(seed)
+        vmac.load_rom(self.rom)
+        for _ in range(frames):
+            vmac.run_frame()
+        return vmac
+    def check_env(self, env):
+        observations = env.reset()
+        self.assertEqual(observations.shape, (4, 16))
+        for _ in range(3):
+            returned, dones = env.step(np.zeros(4, dtype=np.uint16))
+        self.assertIs(returned, observations)
+        self.assertFalse(dones.any())
+        self.assertEqual(observations.tolist(),
+            [self.expected(3, 5 + index).register.tolist()
+                for index in range(4)])
+    def test_in_process(self):
+        with VectorEnv(self.rom, 4, seed=5) as env:
+            self.check_env(env)
+    def test_workers(self):
+        with VectorEnv(self.rom, 4, workers=2, seed=5) as env:
+            self.check_env(env)
+    def test_unseeded_differ(self):
+        with VectorEnv(self.rom, 4) as env:
+            env.reset()
+            observations, _ = env.step(np.zeros(4, dtype=np.uint16))
+            self.assertGreater(len(set(map(tuple, observations.tolist()))),
+                1)
+    def test_actions_latched(self):
+        with VectorEnv(self.rom, 3, obs_type='ram', seed=5) as env:
+            env.reset()
+            observations, _ = env.step(np.array([[1, 2], [0x300, 4],
+                [0xFFFF, 6]]))
+            self.assertEqual(observations[:, 0xFFF0:0xFFF4].tolist(),
+                [[1, 0, 2, 0], [0, 3, 4, 0], [0xFF, 0xFF, 6, 0]])
+            self.assertEqual([vmac.controllers for vmac in env._shard.vms],
+                [(1, 2), (0x300, 4), (0xFFFF, 6)])
+    def test_ram_observation(self):
+        with VectorEnv(self.rom, 2, obs_type='ram') as env:
+            observations = env.reset()
+            self.assertEqual(observations.shape, (2, 2**16))
+            self.assertEqual(observations[0, :len(self.rom.data)].tobytes(),
+                self.rom.data.tobytes())
+    def test_screen_observation(self):
+        with VectorEnv(self.rom, 2, workers=1, obs_type='screen') as env:
+            env.reset()
+            observations, _ = env.step([0, 0])
+            self.assertEqual(observations.shape, (2, 240, 320))
+            self.assertTrue(observations.any())
+    def test_screen_reset(self):
+        fresh = VM(7)
+        fresh.load_rom(self.rom)
+        with VectorEnv(self.rom, 1, obs_type='screen', seed=7) as env:
+            env.reset()
+            for _ in range(30):
+                env.step([0])
+            vmac = env._shard.vms[0]
+            vmac.execute(0x0B000001)
+            observations = env.reset()
+            self.assertEqual(observations[0].tobytes(),
+                fresh.gpu.framebuffer.tobytes())
+            self.assertEqual((vmac.gpu.sprite_width, vmac.gpu.sprite_height),
+                (0, 0))
+            self.assertFalse(vmac.audio.playing)
+            self.assertEqual(vmac.state_hash(), fresh.state_hash())
+            for _ in range(30):
+                observations, _ = env.step([0])
+                fresh.run_frame()
+            self.assertEqual(observations[0].tobytes(),
+                fresh.gpu.framebuffer.tobytes())
+    def test_done_and_partial_reset(self):
+        with VectorEnv(self.rom, 2) as env:
+            env.reset()
+            env._shard.vms[1].program_counter = 0xFFFE
+            _, dones = env.step([0, 0])
+            self.assertEqual(dones.tolist(), [False, True])
+            env.reset([False, True])
+            self.assertFalse(dones.any())
+    def test_worker_attach_fails(self):
+        self.assertRaises(FileNotFoundError, _worker, None, self.rom, 0, 1,
+            'registers', 0, [('pchip16-missing', (1, 16), np.uint16)])
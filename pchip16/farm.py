@@ -0,0 +1,114 @@
+"""
+pchip16 farm - run ROMs headless across a pool of worker processes
+"""
+
+import argparse
+import json
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import cpu_count
+from time import perf_counter
+
+from .rom import ROM
+from .vm import VM, ERRORS
+
+Job = namedtuple('Job', 'rom frames inputs seed')
+
+# Each worker process keeps the ROMs it has loaded, keyed by path
+_ROMS = {}
+
+def load_rom(path):
+    """Return the ROM at path, reading it at most once per process"""
+    rom = _ROMS.get(path)
+    if rom is None:
+        with open(path, 'rb') as file_handle:
+            rom = ROM(file_handle)
+        _ROMS[path] = rom
+    return rom
+
+def warm_up(paths):
+    """Worker initializer: load the corpus before the first job arrives"""
+    for path in paths:
+        load_rom(path)
+    VM()
+
+def read_inputs(file_handle):
+    """Parse an input script of one 'PAD1 [PAD2]' hex line per frame"""
+    inputs = []
+    for line in file_handle:
+        line = line.split('#')[0].split()
+        if not line:
+            continue
+        pads = [int(word, 16) for word in line[:2]]
+        inputs.append((pads[0], pads[1] if len(pads) > 1 else 0))
+    return tuple(inputs)
+
+def run_job(job):
+    """Run job.rom for job.frames frames and return a result dict"""
+    start = perf_counter()
+    vmac = VM(job.seed)
+    vmac.load_rom(load_rom(job.rom))
+    inputs = job.inputs or ()
+    frame_hashes = []
+    cycles = 0
+    error = None
+    try:
+        for frame in range(job.frames):
+            pads = inputs[frame] if frame < len(inputs) else (0, 0)
+            cycles += vmac.run_frame(pads)
+            frame_hashes.append(vmac.state_hash())
+    except ERRORS as err:
+        error = "%s: %s" % (type(err).__name__, err)
+    return {
+        'rom': job.rom,
+        'seed': job.seed,
+        'frames': len(frame_hashes),
+        'cycles': cycles,
+        'state_hash': vmac.state_hash(),
+        'frame_hashes': frame_hashes,
+        'wall_time': perf_counter() - start,
+        'error': error,
+    }
+
+def run_farm(jobs, workers=None, function=run_job):
+    """Yield (index, result) for jobs as they complete across workers
+
+    function is called with each job in a worker and must be picklable.
+    """
+    jobs = list(jobs)
+    paths = sorted(set(job.rom for job in jobs))
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_up,
+            initargs=(paths,)) as executor:
+        futures = dict((executor.submit(function, job), index)
+            for index, job in enumerate(jobs))
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+def main(argv=None):
+    """Command line entry point, writing one JSON line per job"""
+    parser = argparse.ArgumentParser(prog='pchip16-farm',
+        description="Run ROMs headless in parallel")
+    parser.add_argument('roms', nargs='+', metavar='ROM')
+    parser.add_argument('-n', '--frames', type=int, default=60)
+    parser.add_argument('-i', '--inputs', type=argparse.FileType('r'),
+        help="input script, one 'PAD1 [PAD2]' hex line per frame")
+    parser.add_argument('-s', '--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('-j', '--jobs', type=int, default=cpu_count(),
+        help="worker processes")
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'),
+        default=sys.stdout)
+    args = parser.parse_args(argv)
+    inputs = read_inputs(args.inputs) if args.inputs else ()
+    jobs = [Job(rom, args.frames, inputs, seed)
+        for rom in args.roms for seed in args.seeds]
+    failed = 0
+    for index, result in run_farm(jobs, args.jobs):
+        result['job'] = index
+        failed += result['error'] is not None
+        args.output.write(json.dumps(result) + '\n')
+        args.output.flush()
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
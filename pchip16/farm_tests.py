@@ -0,0 +1,44 @@
+"""
+pchip16 farm tests
+"""
+#pylint: disable=I0011,R0904
+
+import io
+import json
+import tempfile
+import unittest
+from pchip16 import farm
+from pchip16.rom_tests import FILE_PATH
+
+class TestRunJob(unittest.TestCase):
+    """Test single jobs run in-process"""
+    def test_frames(self):
+        result = farm.run_job(farm.Job(FILE_PATH, 3, (), 0))
+        self.assertIsNone(result['error'])
+        self.assertEqual(result['frames'], 3)
+        self.assertEqual(len(result['frame_hashes']), 3)
+        self.assertEqual(result['frame_hashes'][-1], result['state_hash'])
+        self.assertGreater(result['cycles'], 0)
+    def test_deterministic(self):
+        job = farm.Job(FILE_PATH, 5, ((0x1, 0x0),), 7)
+        self.assertEqual(farm.run_job(job)['frame_hashes'],
+            farm.run_job(job)['frame_hashes'])
+    def test_read_inputs(self):
+        script = io.StringIO("# pad1 pad2\n1 0\n\n80\n")
+        self.assertEqual(farm.read_inputs(script), ((0x1, 0x0), (0x80, 0x0)))
+
+class TestFarm(unittest.TestCase):
+    """Test jobs distributed over worker processes"""
+    def test_run_farm(self):
+        jobs = [farm.Job(FILE_PATH, 2, (), seed) for seed in range(4)]
+        results = dict(farm.run_farm(jobs, workers=2))
+        self.assertEqual(sorted(results), list(range(4)))
+        expected = farm.run_job(jobs[0])
+        self.assertEqual(results[0]['state_hash'], expected['state_hash'])
+    def test_main(self):
+        with tempfile.NamedTemporaryFile('r', suffix='.jsonl') as output:
+            status = farm.main([FILE_PATH, '-n', '2', '-j', '1', '-s', '0',
+                '1', '-o', output.name])
+            lines = [json.loads(line) for line in output]
+        self.assertEqual(status, 0)
+        self.assertEqual(sorted(line['job'] for line in lines), [0, 1])
@@ -0,0 +1,134 @@
+"""
+pchip16 golden - per-frame framebuffer hashes for regression runs
+"""
+
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from .farm import Job, load_rom, run_farm
+from .vm import VM, ERRORS
+
+GOLDEN_MAGIC = b'P16G'
+# Magic, ROM data CRC-32, seed, frame count
+GOLDEN_HEADER = struct.Struct('<4sIiI')
+
+class FrameHasher(object):
+    """Frame listener collecting a CRC-32 of each displayed frame
+
+    The hash covers the colour indices, background and palette, so equal
+    hashes mean identical output on screen.
+    """
+    def __init__(self):
+        self.hashes = array('I')
+
+    def __call__(self, vmac):
+        gpu = vmac.gpu
+        crc = zlib.crc32(gpu.framebuffer, gpu.background)
+        self.hashes.append(zlib.crc32(gpu.palette.colors, crc))
+
+def golden_path(rom, directory=None):
+    """Return where the golden hashes for rom are kept"""
+    if directory is None:
+        return rom + '.golden'
+    return os.path.join(directory, os.path.basename(rom) + '.golden')
+
+def save_golden(path, checksum, seed, hashes):
+    """Write a golden file of little-endian uint32 frame hashes"""
+    hashes = array('I', hashes)
+    if sys.byteorder == 'big':
+        hashes.byteswap()
+    with open(path, 'wb') as file_handle:
+        file_handle.write(GOLDEN_HEADER.pack(GOLDEN_MAGIC, checksum, seed,
+            len(hashes)))
+        file_handle.write(hashes.tobytes())
+
+def load_golden(path):
+    """Return (checksum, seed, hashes) from a golden file"""
+    with open(path, 'rb') as file_handle:
+        data = file_handle.read()
+    magic, checksum, seed, count = GOLDEN_HEADER.unpack_from(data)
+    if magic != GOLDEN_MAGIC:
+        raise ValueError("%s is not a golden file" % path)
+    hashes = array('I')
+    hashes.frombytes(data[GOLDEN_HEADER.size:])
+    if sys.byteorder == 'big':
+        hashes.byteswap()
+    if len(hashes) != count:
+        raise ValueError("%s is truncated" % path)
+    return checksum, seed, hashes
+
+def hash_frames(job):
+    """Run job and return a dict holding the frame hash of every frame"""
+    rom = load_rom(job.rom)
+    vmac = VM(job.seed)
+    vmac.load_rom(rom)
+    hasher = FrameHasher()
+    vmac.add_frame_listener(hasher)
+    inputs = job.inputs or ()
+    error = None
+    try:
+        for frame in range(job.frames):
+            vmac.run_frame(inputs[frame] if frame < len(inputs) else (0, 0))
+    except ERRORS as err:
+        error = "%s: %s" % (type(err).__name__, err)
+    return {
+        'rom': job.rom,
+        'checksum': rom.calc_checksum(),
+        'seed': job.seed,
+        'hashes': hasher.hashes,
+        'error': error,
+    }
+
+def first_divergence(expected, actual):
+    """Return the first frame where the hashes differ, or None"""
+    for frame, (want, got) in enumerate(zip(expected, actual)):
+        if want != got:
+            return frame
+    if len(expected) != len(actual):
+        return min(len(expected), len(actual))
+    return None
+
+def record(roms, frames, seed=0, workers=None, directory=None):
+    """Hash frames of each ROM across workers and write golden files
+
+    Yields (rom, message, ok) as each ROM finishes.
+    """
+    jobs = [Job(rom, frames, (), seed) for rom in roms]
+    for _, result in run_farm(jobs, workers, hash_frames):
+        hashes = result['hashes']
+        save_golden(golden_path(result['rom'], directory),
+            result['checksum'], seed, hashes)
+        if result['error'] is not None:
+            yield result['rom'], "recorded %i frames, stopped by %s" % (
+                len(hashes), result['error']), True
+        else:
+            yield result['rom'], "recorded %i frames" % len(hashes), True
+
+def verify(roms, workers=None, directory=None):
+    """Re-run each ROM against its golden file across workers
+
+    Yields (rom, message, ok) as each ROM finishes.
+    """
+    jobs = []
+    goldens = {}
+    for rom in roms:
+        try:
+            goldens[rom] = load_golden(golden_path(rom, directory))
+        except (OSError, ValueError, struct.error) as err:
+            yield rom, "no golden: %s" % err, False
+            continue
+        _, seed, hashes = goldens[rom]
+        jobs.append(Job(rom, len(hashes), (), seed))
+    for _, result in run_farm(jobs, workers, hash_frames):
+        checksum, _, expected = goldens[result['rom']]
+        if checksum != result['checksum']:
+            yield result['rom'], "ROM differs from the one recorded", False
+            continue
+        frame = first_divergence(expected, result['hashes'])
+        if frame is None:
+            yield result['rom'], "ok, %i frames" % len(expected), True
+        else:
+            yield result['rom'], "diverged at frame %i" % frame, False
@@ -0,0 +1,74 @@
+"""
+pchip16 golden tests
+"""
+#pylint: disable=I0011,R0904
+
+import os
+import shutil
+import tempfile
+import unittest
+from pchip16 import golden
+from pchip16.__main__ import main
+from pchip16.farm import Job
+from pchip16.rom_tests import FILE_PATH
+from pchip16.vm import VM
+
+class TestFrameHasher(unittest.TestCase):
+    """Test per-frame framebuffer hashing"""
+    def test_hashes(self):
+        vmac = VM()
+        # VBLNK ; JMP 0x0000
+        vmac.mem[0x0] = 0x0002
+        vmac.mem[0x4] = 0x0010
+        hasher = golden.FrameHasher()
+        vmac.add_frame_listener(hasher)
+        vmac.run_frame()
+        vmac.run_frame()
+        vmac.gpu.framebuffer[5, 5] = 1
+        vmac.run_frame()
+        vmac.gpu.background = 2
+        vmac.run_frame()
+        vmac.gpu.palette.load(bytes(48), 0)
+        vmac.run_frame()
+        hashes = hasher.hashes
+        self.assertEqual(hashes.itemsize, 4)
+        self.assertEqual(len(hashes), 5)
+        self.assertEqual(hashes[0], hashes[1])
+        self.assertEqual(len(set(hashes[1:])), 4)
+    def test_first_divergence(self):
+        self.assertIsNone(golden.first_divergence([1, 2], [1, 2]))
+        self.assertEqual(golden.first_divergence([1, 2, 3], [1, 5, 3]), 1)
+        self.assertEqual(golden.first_divergence([1, 2, 3], [1, 2]), 2)
+
+class TestGolden(unittest.TestCase):
+    """Test recording and verifying golden files"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    def test_fixture(self):
+        _, seed, expected = golden.load_golden(golden.golden_path(FILE_PATH))
+        result = golden.hash_frames(Job(FILE_PATH, len(expected), (), seed))
+        self.assertIsNone(golden.first_divergence(expected,
+            result['hashes']))
+    def test_round_trip(self):
+        path = os.path.join(self.directory, 'test.golden')
+        golden.save_golden(path, 0x1234, 7, [1, 0xFFFFFFFF])
+        checksum, seed, hashes = golden.load_golden(path)
+        self.assertEqual((checksum, seed, list(hashes)),
+            (0x1234, 7, [1, 0xFFFFFFFF]))
+    def test_record_verify(self):
+        self.assertEqual(main(['golden', 'record', FILE_PATH, '-n', '5',
+            '-j', '1', '-d', self.directory, '-o', os.devnull]), 0)
+        results = list(golden.verify([FILE_PATH], 1, self.directory))
+        self.assertEqual(results, [(FILE_PATH, "ok, 5 frames", True)])
+        path = golden.golden_path(FILE_PATH, self.directory)
+        checksum, seed, hashes = golden.load_golden(path)
+        hashes[3] ^= 1
+        golden.save_golden(path, checksum, seed, hashes)
+        results = list(golden.verify([FILE_PATH], 1, self.directory))
+        self.assertEqual(results, [(FILE_PATH, "diverged at frame 3",
+            False)])
+    def test_verify_missing(self):
+        results = list(golden.verify([FILE_PATH], 1, self.directory))
+        self.assertFalse(results[0][2])
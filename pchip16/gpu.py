@@ -0,0 +1,350 @@
+"""
+pchip16 GPU - 320x240 4bpp framebuffer and sprite blitting
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from .palette import Palette
+from .utils import to_dec
+
+SCREEN_WIDTH = 320
+SCREEN_HEIGHT = 240
+FULL_SCREEN = (0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+MAX_DIRTY_RECTS = 16
+
+def unpack_sprite(source, addr, width, height):
+    """Return (height, 2 * width) colour indices of the sprite at addr
+
+    source is any uint8 buffer holding memory and width is in bytes, two
+    4bpp pixels each, high nibble on the left. Reads past the end of
+    memory wrap around to address 0.
+    """
+    count = width * height
+    source = np.frombuffer(source, dtype=np.uint8)
+    if addr + count <= len(source):
+        data = source[addr:addr + count]
+    else:
+        data = source.take(np.arange(addr, addr + count), mode='wrap')
+    data = data.reshape(height, width)
+    pixels = np.empty((height, 2 * width), dtype=np.uint8)
+    np.right_shift(data, 4, out=pixels[:, 0::2])
+    np.bitwise_and(data, 0xF, out=pixels[:, 1::2])
+    return pixels
+
+def orient(pixels, flip_h, flip_v):
+    """Return a view of pixels flipped horizontally and/or vertically"""
+    if flip_h:
+        pixels = pixels[:, ::-1]
+    if flip_v:
+        pixels = pixels[::-1]
+    return pixels
+
+def blit(framebuffer, pixels, x_pos, y_pos, opaque=None):
+    """Draw the non-zero pixels at (x_pos, y_pos), clipped to the screen
+
+    Returns True if any drawn pixel landed on a non-zero pixel.
+    """
+    height, width = pixels.shape
+    left = max(x_pos, 0)
+    top = max(y_pos, 0)
+    right = min(x_pos + width, SCREEN_WIDTH)
+    bottom = min(y_pos + height, SCREEN_HEIGHT)
+    if left >= right or top >= bottom:
+        return False
+    rows = slice(top - y_pos, bottom - y_pos)
+    cols = slice(left - x_pos, right - x_pos)
+    pixels = pixels[rows, cols]
+    if opaque is None:
+        opaque = pixels != 0
+    else:
+        opaque = opaque[rows, cols]
+    target = framebuffer[top:bottom, left:right]
+    collision = bool(np.logical_and(opaque, target).any())
+    np.copyto(target, pixels, where=opaque)
+    return collision
+
+class SpriteCache(object):
+    """Decoded sprites keyed by (addr, width, height, flip_h, flip_v)
+
+    Each entry holds the oriented pixels and their opaque mask. Entries are
+    dropped when a write to mem touches their source bytes, and the least
+    recently used are evicted once the entries exceed max_bytes. A hit
+    costs one dict lookup; with check, it also compares a copy of the
+    source bytes with mem and raises AssertionError if a write went
+    unnoticed, which is for debugging only.
+    """
+    def __init__(self, mem, max_bytes=1 << 20, check=False):
+        self.mem = mem
+        self.max_bytes = max_bytes
+        self.check = check
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._pages = {}
+        self._sources = {}
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups served from the cache"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, addr, width, height, flip_h, flip_v):
+        """Return (pixels, opaque) for a sprite, decoding on a miss"""
+        key = (addr, width, height, bool(flip_h), bool(flip_v))
+        entry = self._entries.get(key)
+        if entry is not None:
+            if self.check:
+                self._check(key)
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+        self.misses += 1
+        pixels = orient(unpack_sprite(self.mem._mem, addr, width, height),
+            flip_h, flip_v)
+        opaque = pixels != 0
+        pixels.flags.writeable = False
+        opaque.flags.writeable = False
+        entry = (pixels, opaque)
+        self._entries[key] = entry
+        self.size += pixels.nbytes + opaque.nbytes
+        stop = addr + width * height
+        if self.check:
+            self._sources[key] = _source_bytes(self.mem._mem, addr, stop)
+        for page in _source_pages(addr, stop):
+            keys = self._pages.get(page)
+            if keys is None:
+                keys = self._pages[page] = set()
+                self.mem.add_write_hook(page << 8, (page + 1) << 8,
+                    self._written)
+            keys.add(key)
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+        return entry
+
+    def clear(self):
+        """Drop every entry"""
+        for key in list(self._entries):
+            self._drop(key)
+
+    def _drop(self, key):
+        """Remove key and release write hooks no longer needed"""
+        pixels, opaque = self._entries.pop(key)
+        self._sources.pop(key, None)
+        self.size -= pixels.nbytes + opaque.nbytes
+        addr, width, height = key[:3]
+        for page in _source_pages(addr, addr + width * height):
+            keys = self._pages.get(page)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self._pages[page]
+                self.mem.remove_write_hook(page << 8, (page + 1) << 8,
+                    self._written)
+
+    def _check(self, key):
+        """Raise AssertionError if key's source changed without a hook"""
+        source = self._sources.get(key)
+        addr, width, height = key[:3]
+        if source is not None and source != _source_bytes(self.mem._mem,
+                addr, addr + width * height):
+            raise AssertionError("sprite cache missed a write to %r"
+                % (key,))
+
+    def _written(self, start, stop):
+        """Write hook: drop entries whose source overlaps start..stop"""
+        stale = set()
+        for page in _source_pages(start, stop):
+            for key in self._pages.get(page, ()):
+                addr = key[0]
+                end = addr + key[1] * key[2]
+                if (start < end and addr < stop) or \
+                        (end > 2**16 and start < end - 2**16):
+                    stale.add(key)
+        for key in stale:
+            self._drop(key)
+        self.invalidations += len(stale)
+
+def _source_bytes(source, start, stop):
+    """Return a copy of source[start:stop], wrapping memory"""
+    if stop <= 2**16:
+        return source[start:stop].tobytes()
+    return source[start:].tobytes() + source[:stop - 2**16].tobytes()
+
+def _source_pages(start, stop):
+    """Return the 256 byte pages covering start..stop, wrapping memory"""
+    return set(page & 0xFF
+        for page in range(start >> 8, ((stop - 1) >> 8) + 1))
+
+def merge_rect(rects, rect, limit=MAX_DIRTY_RECTS):
+    """Add (left, top, right, bottom) rect to rects, merging overlaps
+
+    Overlapping or touching rectangles are replaced by their union. If more
+    than limit remain, rects collapses to their bounding box.
+    """
+    left, top, right, bottom = rect
+    merged = True
+    while merged:
+        merged = False
+        for index, other in enumerate(rects):
+            if left <= other[2] and other[0] <= right \
+                    and top <= other[3] and other[1] <= bottom:
+                left = min(left, other[0])
+                top = min(top, other[1])
+                right = max(right, other[2])
+                bottom = max(bottom, other[3])
+                del rects[index]
+                merged = True
+                break
+    rects.append((left, top, right, bottom))
+    if len(rects) > limit:
+        rects[:] = [(min(rect[0] for rect in rects),
+            min(rect[1] for rect in rects), max(rect[2] for rect in rects),
+            max(rect[3] for rect in rects))]
+    return rects
+
+class GPU(object):
+    """Framebuffer of colour indices plus the sprite drawing state
+
+    Index 0 in the framebuffer is transparent, showing the background
+    colour when the frame is displayed. CLS and DRW record the rectangles
+    they touch in dirty, which frame_delta() consumes; CLS only marks what
+    DRW has drawn since the previous CLS.
+    """
+    def __init__(self):
+        self.framebuffer = np.zeros((SCREEN_HEIGHT, SCREEN_WIDTH),
+            dtype=np.uint8)
+        self.background = 0
+        self.sprite_width = 0
+        self.sprite_height = 0
+        self.flip_h = False
+        self.flip_v = False
+        self.palette = Palette()
+        self._reset_delta()
+        self._drawn = []
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_shown'], state['dirty'], state['_drawn']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset_delta()
+
+    def _reset_delta(self):
+        """Forget what consumers have seen, so the next delta is whole"""
+        self._shown = np.zeros_like(self.framebuffer)
+        self._shown_background = None
+        self._shown_palette = None
+        self.dirty = [FULL_SCREEN]
+        self._drawn = [FULL_SCREEN]
+
+    def reset(self):
+        """Return the framebuffer, sprite state and palette to power-on"""
+        self.framebuffer[:] = 0
+        self.background = 0
+        self.sprite_width = 0
+        self.sprite_height = 0
+        self.flip_h = False
+        self.flip_v = False
+        self.palette.reset()
+        self._reset_delta()
+
+    def rgb(self, out=None, scale=1):
+        """Return the displayed frame as RGB24 through the palette"""
+        return self.palette.to_rgb(self.framebuffer, self.background, out,
+            scale)
+
+    def frame_delta(self):
+        """Return (background, regions) changed since the previous call
+
+        regions lists (x, y, pixels) for each rectangle whose colour
+        indices changed, pixels being a view valid until the next call.
+        A new background or palette reports the whole screen. The delta
+        state is shared, so each VM supports a single caller.
+        """
+        shown = self._shown
+        palette = (self.palette.version, id(self.palette))
+        if self.background != self._shown_background \
+                or palette != self._shown_palette:
+            self._shown_background = self.background
+            self._shown_palette = palette
+            shown[:] = self.framebuffer
+            self.dirty = []
+            return self.background, [(0, 0, shown)]
+        regions = []
+        for left, top, right, bottom in self.dirty:
+            changed = self.framebuffer[top:bottom, left:right] \
+                != shown[top:bottom, left:right]
+            rows = np.flatnonzero(changed.any(axis=1))
+            if not len(rows):
+                continue
+            cols = np.flatnonzero(changed.any(axis=0))
+            bottom = top + rows[-1] + 1
+            right = left + cols[-1] + 1
+            top += rows[0]
+            left += cols[0]
+            target = shown[top:bottom, left:right]
+            target[:] = self.framebuffer[top:bottom, left:right]
+            regions.append((int(left), int(top), target))
+        self.dirty = []
+        return self.background, regions
+
+    def clear(self):
+        """CLS: clear the framebuffer and background colour"""
+        self.framebuffer[:] = 0
+        self.background = 0
+        for rect in self._drawn:
+            merge_rect(self.dirty, rect)
+        self._drawn = []
+
+    def set_sprite(self, width, height):
+        """SPR: set sprite size, width in bytes"""
+        self.sprite_width = width
+        self.sprite_height = height
+
+    def set_flip(self, flip_h, flip_v):
+        """FLIP: set sprite orientation"""
+        self.flip_h = bool(flip_h)
+        self.flip_v = bool(flip_v)
+
+    def sprite(self, source, addr):
+        """Return the current-size sprite at addr in display orientation"""
+        pixels = unpack_sprite(source, addr, self.sprite_width,
+            self.sprite_height)
+        return orient(pixels, self.flip_h, self.flip_v)
+
+    def draw(self, source, x_pos, y_pos, addr, cache=None):
+        """DRW: blit the sprite at addr to signed (x_pos, y_pos)
+
+        With a SpriteCache over the same memory as source, decoded
+        sprites are reused. Returns True on collision with previously
+        drawn pixels.
+        """
+        width = 2 * self.sprite_width
+        height = self.sprite_height
+        if not width or not height:
+            return False
+        x_pos = to_dec(x_pos)
+        y_pos = to_dec(y_pos)
+        rect = (max(x_pos, 0), max(y_pos, 0),
+            min(x_pos + width, SCREEN_WIDTH),
+            min(y_pos + height, SCREEN_HEIGHT))
+        if rect[0] >= rect[2] or rect[1] >= rect[3]:
+            return False
+        merge_rect(self.dirty, rect)
+        merge_rect(self._drawn, rect)
+        if cache is None:
+            return blit(self.framebuffer, self.sprite(source, addr),
+                x_pos, y_pos)
+        pixels, opaque = cache.get(addr, self.sprite_width,
+            self.sprite_height, self.flip_h, self.flip_v)
+        return blit(self.framebuffer, pixels, x_pos, y_pos, opaque)
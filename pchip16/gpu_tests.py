@@ -0,0 +1,187 @@
+"""
+pchip16 GPU tests
+"""
+#pylint: disable=I0011,R0904
+
+import unittest
+from array import array
+import numpy as np
+from pchip16.gpu import GPU, SpriteCache, unpack_sprite, blit, merge_rect
+from pchip16.memory import Memory, HookedMemory
+
+class TestUnpack(unittest.TestCase):
+    """Test 4bpp sprite unpacking"""
+    def test_nibble_order(self):
+        source = array('B', [0x12, 0x34, 0x56, 0x78])
+        pixels = unpack_sprite(source, 0, 2, 2)
+        self.assertEqual(pixels.tolist(), [[1, 2, 3, 4], [5, 6, 7, 8]])
+    def test_wraps_memory(self):
+        source = array('B', [0xAB, 0x00, 0x00, 0xCD])
+        pixels = unpack_sprite(source, 3, 2, 1)
+        self.assertEqual(pixels.tolist(), [[0xC, 0xD, 0xA, 0xB]])
+
+class TestBlit(unittest.TestCase):
+    """Test clipping, transparency and collision"""
+    def setUp(self):
+        self.framebuffer = np.zeros((240, 320), dtype=np.uint8)
+        self.pixels = np.array([[1, 0], [0, 2]], dtype=np.uint8)
+    def test_transparency(self):
+        self.framebuffer[10:12, 10:12] = 9
+        blit(self.framebuffer, self.pixels, 10, 10)
+        self.assertEqual(self.framebuffer[10:12, 10:12].tolist(),
+            [[1, 9], [9, 2]])
+    def test_collision(self):
+        self.assertFalse(blit(self.framebuffer, self.pixels, 0, 0))
+        self.assertFalse(blit(self.framebuffer, self.pixels, 1, 0))
+        self.assertTrue(blit(self.framebuffer, self.pixels, 0, 0))
+    def test_clipping(self):
+        blit(self.framebuffer, self.pixels, -1, -1)
+        self.assertEqual(self.framebuffer[0, 0], 2)
+        blit(self.framebuffer, self.pixels, 319, 239)
+        self.assertEqual(self.framebuffer[239, 319], 1)
+        self.assertFalse(blit(self.framebuffer, self.pixels, 320, 0))
+        self.assertEqual(self.framebuffer.sum(), 3)
+
+class TestGPU(unittest.TestCase):
+    """Test GPU state handling"""
+    def setUp(self):
+        self.gpu = GPU()
+        self.source = array('B', [0x12, 0x30] + [0] * 14)
+    def test_flip(self):
+        self.gpu.set_sprite(2, 1)
+        self.gpu.set_flip(True, False)
+        self.assertEqual(self.gpu.sprite(self.source, 0).tolist(),
+            [[0, 3, 2, 1]])
+    def test_draw_negative_position(self):
+        self.gpu.set_sprite(2, 1)
+        self.gpu.draw(self.source, 0xFFFF, 0, 0)
+        self.assertEqual(self.gpu.framebuffer[0, :3].tolist(), [2, 3, 0])
+    def test_clear(self):
+        self.gpu.background = 3
+        self.gpu.framebuffer[5, 5] = 1
+        self.gpu.clear()
+        self.assertFalse(self.gpu.framebuffer.any())
+        self.assertEqual(self.gpu.background, 0)
+
+class TestDirtyRects(unittest.TestCase):
+    """Test dirty rectangle tracking and frame deltas"""
+    def setUp(self):
+        self.gpu = GPU()
+        self.gpu.set_sprite(1, 2)
+        self.source = array('B', [0x11, 0x22])
+        self.gpu.frame_delta()
+    def test_merge(self):
+        rects = [(0, 0, 4, 4)]
+        merge_rect(rects, (10, 10, 12, 12))
+        self.assertEqual(len(rects), 2)
+        merge_rect(rects, (4, 0, 10, 10))
+        self.assertEqual(rects, [(0, 0, 12, 12)])
+    def test_merge_limit(self):
+        rects = []
+        for index in range(5):
+            merge_rect(rects, (index * 10, 0, index * 10 + 2, 2), limit=4)
+        self.assertEqual(rects, [(0, 0, 42, 2)])
+    def test_clear_marks_drawn(self):
+        self.gpu.draw(self.source, 5, 7, 0)
+        self.gpu.frame_delta()
+        self.gpu.clear()
+        self.assertEqual(self.gpu.dirty, [(5, 7, 7, 9)])
+        self.gpu.clear()
+        self.assertEqual(self.gpu.dirty, [(5, 7, 7, 9)])
+    def test_draw_marks_clipped_rect(self):
+        self.gpu.draw(self.source, 0xFFFF, 10, 0)
+        self.assertEqual(self.gpu.dirty, [(0, 10, 1, 12)])
+        self.gpu.draw(self.source, 400, 10, 0)
+        self.assertEqual(self.gpu.dirty, [(0, 10, 1, 12)])
+    def test_first_delta_is_full(self):
+        background, regions = GPU().frame_delta()
+        self.assertEqual(background, 0)
+        self.assertEqual(len(regions), 1)
+        self.assertEqual(regions[0][2].shape, (240, 320))
+    def test_delta(self):
+        self.gpu.draw(self.source, 5, 7, 0)
+        self.gpu.draw(self.source, 100, 50, 0)
+        _, regions = self.gpu.frame_delta()
+        self.assertEqual([(x, y, pixels.tolist()) for x, y, pixels in
+            regions], [(5, 7, [[1, 1], [2, 2]]), (100, 50, [[1, 1], [2, 2]])])
+        self.assertEqual(self.gpu.frame_delta(), (0, []))
+    def test_unchanged_draw_dropped(self):
+        self.gpu.draw(self.source, 5, 7, 0)
+        self.gpu.frame_delta()
+        self.gpu.draw(self.source, 5, 7, 0)
+        self.assertEqual(self.gpu.frame_delta(), (0, []))
+    def test_clear_reports_only_changes(self):
+        self.gpu.draw(self.source, 5, 7, 0)
+        self.gpu.frame_delta()
+        self.gpu.clear()
+        self.gpu.draw(self.source, 6, 7, 0)
+        _, regions = self.gpu.frame_delta()
+        self.assertEqual([(x, y, pixels.tolist()) for x, y, pixels in
+            regions], [(5, 7, [[0, 1, 1], [0, 2, 2]])])
+    def test_background_is_full(self):
+        self.gpu.background = 3
+        background, regions = self.gpu.frame_delta()
+        self.assertEqual(background, 3)
+        self.assertEqual(regions[0][:2], (0, 0))
+        self.assertEqual(regions[0][2].shape, (240, 320))
+    def test_palette_is_full(self):
+        self.gpu.palette.load(bytes(48), 0)
+        _, regions = self.gpu.frame_delta()
+        self.assertEqual(regions[0][2].shape, (240, 320))
+
+class TestSpriteCache(unittest.TestCase):
+    """Test decoded sprite reuse and invalidation"""
+    def setUp(self):
+        self.mem = Memory()
+        self.mem[0x400] = 0x3412
+        self.cache = SpriteCache(self.mem)
+    def test_hit(self):
+        first = self.cache.get(0x400, 2, 1, False, False)
+        second = self.cache.get(0x400, 2, 1, False, False)
+        self.assertIs(first, second)
+        self.assertEqual(self.cache.hit_rate, 0.5)
+        self.assertEqual(first[0].tolist(), [[1, 2, 3, 4]])
+    def test_flip_is_separate_entry(self):
+        self.cache.get(0x400, 2, 1, False, False)
+        pixels, _ = self.cache.get(0x400, 2, 1, True, False)
+        self.assertEqual(pixels.tolist(), [[4, 3, 2, 1]])
+        self.assertEqual(self.cache.misses, 2)
+    def test_write_invalidates(self):
+        self.cache.get(0x400, 2, 1, False, False)
+        self.mem[0x402] = 0xFFFF
+        self.assertEqual(self.cache.invalidations, 0)
+        self.mem[0x3FF] = 0x5500
+        self.assertEqual(self.cache.invalidations, 1)
+        pixels, _ = self.cache.get(0x400, 2, 1, False, False)
+        self.assertEqual(pixels.tolist(), [[5, 5, 3, 4]])
+    def test_wrapped_source(self):
+        cache = SpriteCache(self.mem, check=True)
+        self.mem[0xFFFE] = 0x2100
+        self.mem[0] = 0x4300
+        self.assertEqual(cache.get(0xFFFF, 2, 1, False, False)[0].tolist(),
+            [[2, 1, 0, 0]])
+        self.mem[0] = 0x4365
+        self.assertEqual(cache.get(0xFFFF, 2, 1, False, False)[0].tolist(),
+            [[2, 1, 6, 5]])
+        self.assertEqual(cache.invalidations, 1)
+    def test_check(self):
+        cache = SpriteCache(self.mem, check=True)
+        cache.get(0x400, 2, 1, False, False)
+        self.mem._mem[0x400] = 0x56
+        self.assertRaises(AssertionError, cache.get, 0x400, 2, 1, False,
+            False)
+    def test_hooks_released(self):
+        self.cache.get(0x400, 2, 1, False, False)
+        self.assertIsInstance(self.mem, HookedMemory)
+        self.cache.clear()
+        self.assertNotIsInstance(self.mem, HookedMemory)
+    def test_eviction(self):
+        cache = SpriteCache(self.mem, max_bytes=16)
+        cache.get(0x400, 2, 1, False, False)
+        cache.get(0x500, 2, 1, False, False)
+        cache.get(0x400, 2, 1, False, False)
+        cache.get(0x600, 2, 1, False, False)
+        self.assertEqual(cache.evictions, 1)
+        self.assertLessEqual(cache.size, 16)
+        cache.get(0x400, 2, 1, False, False)
+        self.assertEqual(cache.hits, 2)
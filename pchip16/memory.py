@@ -3,13 +3,45 @@ pchip16 Memory classes
 """
 
 from array import array
+from pickle import PickleBuffer
+from random import Random
+
+import numpy as np
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+PAGE_SHIFT = 8
+PAGES = 2**16 >> PAGE_SHIFT
+
+def _zobrist_keys(count, seed):
+    """Return count odd 64 bit keys from a fixed seed"""
+    rand = Random(seed)
+    return array('Q', (rand.getrandbits(64) | 1 for i in range(count) ) )
+
+# A byte's contribution to the memory hash is ADDRESS_KEYS[i] * BYTE_KEYS[v]
+# truncated to 64 bits. Zero bytes contribute nothing, so cleared memory
+# hashes to 0 without visiting every address. The hash is only maintained
+# once asked for, see Memory.state_hash.
+ADDRESS_KEYS = _zobrist_keys(2**16, 0xC16)
+BYTE_KEYS = _zobrist_keys(256, 0x16C)
+BYTE_KEYS[0] = 0
+_ADDRESS_KEYS = np.frombuffer(ADDRESS_KEYS, dtype=np.uint64)
+_BYTE_KEYS = np.frombuffer(BYTE_KEYS, dtype=np.uint64)
 
 class Memory(object):
-    """Memory with 16-bit reads and writes"""
+    """Memory with 16-bit reads and writes
+
+    _hash is None until state_hash or rehash first hashes the contents;
+    from then on writes keep it up to date.
+    """
+    # Every subclass keeps this layout, so _retype can switch an instance's
+    # class and slot loads stay as fast as before it was ever switched
+    __slots__ = ('size', '_hash', '_mem', '_write_hooks', '_read_hooks',
+        '_io_read', '_io_write', '_io_base', '_heatmap')
     def __init__(self, data=None, size = 2**16):
         self.size = size
+        self._hash = None
         if data is None:
-            self._mem = array('B', (0 for i in range(size) ) )
+            self._mem = array('B', bytes(size))
         else:
             self.fromstring(data)
     def __getitem__(self, index):
@@ -18,8 +50,7 @@ class Memory(object):
         self._mem[index] = value & 0xFF
         self._mem[index + 1] = value >> 8
     def __delitem__(self, index):
-        self._mem[index] = 0
-        self._mem[index + 1] = 0
+        self[index] = 0
     def __len__(self):
         """Return the highest non-zero address in normal memory"""
         end = 0xFDF0
@@ -27,18 +58,345 @@ class Memory(object):
             end -= 2
         return end
 
+    def __reduce_ex__(self, protocol):
+        """Pickle contents as one buffer, out-of-band under protocol 5"""
+        if protocol >= 5:
+            data = PickleBuffer(self._mem)
+        else:
+            data = self._mem.tobytes()
+        # Hooks and handlers are process-local, so memory unpickles plain
+        cls = Memory if self._hash is None else HashedMemory
+        return (_rebuild_memory, (cls, data, self.size, self._hash))
+
+    def add_write_hook(self, start, stop, hook):
+        """Call hook(start, stop) after writes to pages in start..stop
+
+        Memory without hooks keeps its plain __setitem__; the first hook
+        switches this instance to HookedMemory.
+        """
+        self._page_tables()
+        for page in _pages(start, stop):
+            if hook not in self._write_hooks[page]:
+                self._write_hooks[page] += (hook,)
+        self._retype()
+
+    def remove_write_hook(self, start, stop, hook):
+        """Stop calling hook for writes to pages in start..stop"""
+        if not isinstance(self, HookedMemory):
+            return
+        hooks = self._write_hooks
+        for page in _pages(start, stop):
+            hooks[page] = tuple(other for other in hooks[page]
+                if other != hook)
+        self._retype()
+
+    def add_read_hook(self, start, stop, hook):
+        """Call hook(start, stop) after reads from pages in start..stop
+
+        The first read hook switches this instance to WatchedMemory;
+        memory without read hooks keeps its cheaper __getitem__.
+        """
+        self._page_tables()
+        for page in _pages(start, stop):
+            if hook not in self._read_hooks[page]:
+                self._read_hooks[page] += (hook,)
+        self._retype()
+
+    def remove_read_hook(self, start, stop, hook):
+        """Stop calling hook for reads from pages in start..stop"""
+        if not isinstance(self, HookedMemory):
+            return
+        hooks = self._read_hooks
+        for page in _pages(start, stop):
+            hooks[page] = tuple(other for other in hooks[page]
+                if other != hook)
+        self._retype()
+
+    def map_io(self, start, stop, read=None, write=None):
+        """Route word accesses to addresses start..stop through handlers
+
+        read(index) returns the word at index and write(index, value)
+        stores one; either may be None to leave that direction on RAM. A
+        word access is routed by the address of its first byte. Only
+        mapped memory pays for the routing: the first mapping switches
+        this instance to MappedMemory, where an access below the lowest
+        mapped address costs one comparison over plain Memory. VMs latch
+        the controllers into RAM instead, so their memory stays plain.
+        """
+        self._page_tables()
+        for addr in range(start, stop):
+            for handlers, handler in ((self._io_read, read),
+                    (self._io_write, write)):
+                if handler is None:
+                    handlers.pop(addr, None)
+                else:
+                    handlers[addr] = handler
+        self._io_base = min(list(self._io_read) + list(self._io_write)
+            + [2**16])
+        self._retype()
+
+    def unmap_io(self, start, stop):
+        """Return addresses start..stop to plain RAM"""
+        if isinstance(self, HookedMemory):
+            self.map_io(start, stop)
+
+    def enable_heatmap(self):
+        """Count word reads and writes per address, returning the Heatmap
+
+        Counting switches this instance to CountingMemory, leaving other
+        instances and the disabled path untouched.
+        """
+        if getattr(self, '_heatmap', None) is None:
+            self._page_tables()
+            self._heatmap = Heatmap()
+            self._retype()
+        return self._heatmap
+
+    def disable_heatmap(self):
+        """Stop counting, returning the Heatmap collected or None"""
+        heatmap = getattr(self, '_heatmap', None)
+        if heatmap is not None:
+            del self._heatmap
+            self._retype()
+        return heatmap
+
+    def _page_tables(self):
+        """Create the empty per-page hook and handler tables"""
+        if not isinstance(self, HookedMemory):
+            self._write_hooks = [() for page in range(PAGES)]
+            self._read_hooks = [() for page in range(PAGES)]
+            self._io_read = {}
+            self._io_write = {}
+            self._io_base = 2**16
+
+    def _retype(self):
+        """Switch to the cheapest class serving the mapped pages and hooks"""
+        if getattr(self, '_heatmap', None) is not None:
+            self.__class__ = CountingMemory
+        elif any(self._read_hooks):
+            self.__class__ = WatchedMemory
+        elif any(self._write_hooks):
+            if self._io_read or self._io_write:
+                self.__class__ = HookedMappedMemory
+            else:
+                self.__class__ = HookedMemory
+        elif self._io_read or self._io_write:
+            self.__class__ = MappedMemory
+        else:
+            del self._write_hooks, self._read_hooks
+            del self._io_read, self._io_write, self._io_base
+            self.__class__ = Memory if self._hash is None else HashedMemory
+
+    def state_hash(self):
+        """Return the hash of memory contents
+
+        The first call hashes memory from scratch; after that writes keep
+        the hash up to date, so memory nobody hashes never pays for it.
+        """
+        if self._hash is None:
+            return self.rehash()
+        return self._hash
+
+    def rehash(self):
+        """Recompute the memory hash from scratch and keep it maintained"""
+        data = np.frombuffer(self._mem, dtype=np.uint8)
+        index = np.flatnonzero(data)
+        # uint64 products wrap, truncating to 64 bits like MASK64
+        keys = _ADDRESS_KEYS[index] * _BYTE_KEYS[data[index]]
+        self._hash = int(np.bitwise_xor.reduce(keys)) if len(keys) else 0
+        if type(self) is Memory:
+            self.__class__ = HashedMemory
+        return self._hash
+
     def tostring(self):
         """Return string representation of memory contents"""
-        return self._mem[0:len(self)].tostring()
+        return self._mem[0:len(self)].tobytes()
 
     def fromstring(self, data):
         """Return string representation of memory contents"""
-        self._mem = array('B')
-        self._mem.fromstring(data)
-        self._mem.extend((0 for i in range(2**16 - len(data))))
+        mem = array('B')
+        mem.frombytes(data)
+        mem.frombytes(bytes(2**16 - len(mem)))
+        if isinstance(getattr(self, '_mem', None), memoryview):
+            # Shared memory is written in place so other views see it
+            self._mem[:] = mem
+        else:
+            self._mem = mem
+        if self._hash is not None:
+            self.rehash()
+
+class HashedMemory(Memory):
+    """Memory updating the state hash on each write"""
+    __slots__ = ()
+    def __setitem__(self, index, value):
+        mem = self._mem
+        low = value & 0xFF
+        high = value >> 8
+        key = ADDRESS_KEYS[index]
+        next_key = ADDRESS_KEYS[index + 1]
+        self._hash ^= (key * BYTE_KEYS[mem[index]] ^ key * BYTE_KEYS[low]
+            ^ next_key * BYTE_KEYS[mem[index + 1]]
+            ^ next_key * BYTE_KEYS[high]) & MASK64
+        mem[index] = low
+        mem[index + 1] = high
+
+class HookedMemory(Memory):
+    """Memory calling per-page hooks after each write, hashing if hashed"""
+    __slots__ = ()
+    def __setitem__(self, index, value):
+        if self._hash is None:
+            # Memory.__setitem__, inline
+            self._mem[index] = value & 0xFF
+            self._mem[index + 1] = value >> 8
+        else:
+            HashedMemory.__setitem__(self, index, value)
+        hooks = self._write_hooks[index >> PAGE_SHIFT]
+        if (index + 1) & 0xFF == 0:
+            hooks += self._write_hooks[((index + 1) >> PAGE_SHIFT) % PAGES]
+        for hook in hooks:
+            hook(index, index + 2)
+
+    def fromstring(self, data):
+        """Replace memory contents, notifying every hook"""
+        Memory.fromstring(self, data)
+        for hook in set(hook for hooks in self._write_hooks
+                for hook in hooks):
+            hook(0, 2**16)
+
+class MappedMemory(HookedMemory):
+    """Memory serving addresses from _io_base up through I/O handlers
+
+    An access below the lowest mapped address takes the Memory path
+    inline after one range check. At or above it, the handler mapped at
+    the first byte's address serves the word, or RAM if there is none.
+    Used while no hooks are set, so RAM writes skip the hook tables.
+    """
+    __slots__ = ()
+    def __getitem__(self, index):
+        mem = self._mem
+        if 0 <= index < self._io_base:
+            return (mem[index + 1] << 8) + mem[index]
+        read = self._io_read.get(index & 0xFFFF)
+        if read is None:
+            return (mem[index + 1] << 8) + mem[index]
+        return read(index)
+
+    def __setitem__(self, index, value):
+        if not 0 <= index < self._io_base:
+            write = self._io_write.get(index & 0xFFFF)
+            if write is not None:
+                write(index, value)
+                return
+        if self._hash is None:
+            # Memory.__setitem__, inline
+            self._mem[index] = value & 0xFF
+            self._mem[index + 1] = value >> 8
+        else:
+            HashedMemory.__setitem__(self, index, value)
+
+class HookedMappedMemory(MappedMemory):
+    """MappedMemory calling per-page hooks after each RAM write"""
+    __slots__ = ()
+    def __setitem__(self, index, value):
+        if not 0 <= index < self._io_base:
+            write = self._io_write.get(index & 0xFFFF)
+            if write is not None:
+                write(index, value)
+                return
+        HookedMemory.__setitem__(self, index, value)
+
+class WatchedMemory(HookedMappedMemory):
+    """HookedMappedMemory calling per-page hooks after each read"""
+    __slots__ = ()
+    def __getitem__(self, index):
+        value = MappedMemory.__getitem__(self, index)
+        hooks = self._read_hooks[index >> PAGE_SHIFT]
+        if (index + 1) & 0xFF == 0:
+            hooks += self._read_hooks[((index + 1) >> PAGE_SHIFT) % PAGES]
+        for hook in hooks:
+            hook(index, index + 2)
+        return value
+
+class CountingMemory(WatchedMemory):
+    """WatchedMemory counting each word access at its first address"""
+    __slots__ = ()
+    def __getitem__(self, index):
+        self._heatmap.reads[index] += 1
+        return WatchedMemory.__getitem__(self, index)
+
+    def __setitem__(self, index, value):
+        self._heatmap.writes[index] += 1
+        HookedMappedMemory.__setitem__(self, index, value)
+
+class Heatmap(object):
+    """Per-address word read and write counts from Memory.enable_heatmap
+
+    Counts cover accesses through Memory indexing: loads, stores, the
+    stack, CALL and RET. Instruction fetches and sprite and palette data,
+    which read the buffer directly, are not counted.
+    """
+    def __init__(self):
+        self.reads = array('I', bytes(4 * 2**16))
+        self.writes = array('I', bytes(4 * 2**16))
+
+    def clear(self):
+        """Zero every counter"""
+        for counts in self.arrays():
+            counts[:] = 0
+
+    def arrays(self):
+        """Return uint32 (reads, writes) views sharing the counters"""
+        return (np.frombuffer(self.reads, dtype=np.uint32),
+            np.frombuffer(self.writes, dtype=np.uint32))
+
+    def pages(self):
+        """Return (256, 2) read and write totals per 256 byte page"""
+        counts = np.stack(self.arrays()).astype(np.uint64)
+        return counts.reshape(2, PAGES, 2**PAGE_SHIFT).sum(axis=2).T
+
+    def summary(self, top=None):
+        """Return [(page, reads, writes)] for touched pages, busiest first"""
+        totals = self.pages()
+        busy = np.flatnonzero(totals.sum(axis=1))
+        order = busy[np.argsort(-totals[busy].sum(axis=1).astype(np.int64),
+            kind='stable')]
+        return [(int(page), int(totals[page, 0]), int(totals[page, 1]))
+            for page in order[:top]]
+
+    def hottest(self, top=10):
+        """Return [(addr, reads, writes)] for the busiest addresses"""
+        reads, writes = self.arrays()
+        totals = reads.astype(np.int64) + writes
+        order = np.argsort(-totals, kind='stable')[:top]
+        return [(int(addr), int(reads[addr]), int(writes[addr]))
+            for addr in order if totals[addr]]
+
+    def save(self, path):
+        """Write reads, writes and page totals to a NumPy .npz file"""
+        reads, writes = self.arrays()
+        np.savez_compressed(path, reads=reads, writes=writes,
+            pages=self.pages())
+
+def _pages(start, stop):
+    """Return the page numbers covering start..stop, wrapping at 64 KiB"""
+    return [page % PAGES for page in
+        range(start >> PAGE_SHIFT, ((stop - 1) >> PAGE_SHIFT) + 1)]
+
+def _rebuild_memory(cls, data, size, state_hash):
+    """Unpickle a Memory with a single copy of its buffer"""
+    mem = cls.__new__(cls)
+    mem.size = size
+    mem._mem = array('B')
+    mem._mem.frombytes(data)
+    mem._hash = state_hash
+    return mem
 
 
 class Register(array):
     """16 x 16 bit registers"""
-    def __new__(cls):
-        return super(Register, cls).__new__(cls, 'H', (0 for i in range(16) ) )
+    def __new__(cls, data=None):
+        if data is None:
+            data = bytes(32)
+        return super(Register, cls).__new__(cls, 'H', data)
+    def __reduce__(self):
+        return (self.__class__, (self.tobytes(),))
@@ -3,10 +3,13 @@ pchip16 rom test runner
 """
 #pylint: disable=I0011, R0904
 
+import pickle
 import unittest
 from pchip16.rom_tests import TestROM
-from pchip16.memory import Memory
+from pchip16.memory import Memory, Register, HookedMemory, MappedMemory, \
+    CountingMemory, HashedMemory
 from pchip16.rom import ROM
+from pchip16.vm import VM
 
 class TestROMLoading(TestROM):
     """Test loading ROM into memory"""
@@ -24,3 +27,188 @@ class TestChecksum(TestROMLoading):
         rom = ROM()
         rom.data.fromstring(self.mem.tostring())
         self.assertEqual(rom.calc_checksum(), 0xD7B62213)
+
+class TestMemoryHash(unittest.TestCase):
+    """Test the incremental memory hash"""
+    def setUp(self):
+        self.mem = Memory()
+    def test_empty_hash(self):
+        self.assertEqual(self.mem.state_hash(), 0)
+    def test_incremental_matches_rehash(self):
+        for addr, value in ((0x0, 0x1234), (0x1, 0xBEEF), (0xFFF0, 0xFF)):
+            self.mem[addr] = value
+        incremental = self.mem.state_hash()
+        self.assertEqual(self.mem.rehash(), incremental)
+    def test_position_dependent(self):
+        self.mem[0x10] = 0x1
+        first = self.mem.state_hash()
+        del self.mem[0x10]
+        self.mem[0x20] = 0x1
+        self.assertNotEqual(self.mem.state_hash(), first)
+    def test_opt_in(self):
+        self.mem[0x10] = 0x1
+        self.assertIs(type(self.mem), Memory)
+        self.mem.state_hash()
+        self.assertIs(type(self.mem), HashedMemory)
+        self.mem[0x10] = 0xBEEF
+        self.assertEqual(self.mem.state_hash(), Memory(
+            self.mem._mem.tobytes()).state_hash())
+    def test_hooks_keep_hashing(self):
+        self.mem.state_hash()
+        hook = lambda start, stop: None
+        self.mem.add_write_hook(0x0, 0x100, hook)
+        self.mem[0x10] = 0x1234
+        self.mem.remove_write_hook(0x0, 0x100, hook)
+        self.assertIs(type(self.mem), HashedMemory)
+        self.assertEqual(self.mem.state_hash(), self.mem.rehash())
+
+class TestMemoryPickle(unittest.TestCase):
+    """Test pickling memory in and out of band"""
+    def setUp(self):
+        self.mem = Memory()
+        self.mem[0xBEEE] = 0xCAFE
+    def test_in_band(self):
+        for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(self.mem, protocol))
+            self.assertEqual(copy[0xBEEE], 0xCAFE)
+            self.assertEqual(copy.state_hash(), self.mem.state_hash())
+    def test_out_of_band(self):
+        buffers = []
+        data = pickle.dumps(self.mem, 5, buffer_callback=buffers.append)
+        self.assertEqual(len(buffers), 1)
+        self.assertLess(len(data), 1024)
+        copy = pickle.loads(data, buffers=buffers)
+        self.assertEqual(copy[0xBEEE], 0xCAFE)
+        copy[0xBEEE] = 0
+        self.assertEqual(self.mem[0xBEEE], 0xCAFE)
+    def test_register(self):
+        register = Register()
+        register[0xF] = 0xBEEF
+        copy = pickle.loads(pickle.dumps(register))
+        self.assertIsInstance(copy, Register)
+        self.assertEqual(copy, register)
+
+class TestWriteHooks(unittest.TestCase):
+    """Test per-page write hooks"""
+    def setUp(self):
+        self.mem = Memory()
+        self.calls = []
+    def hook(self, start, stop):
+        self.calls.append((start, stop))
+    def test_page_filter(self):
+        self.mem.add_write_hook(0x100, 0x200, self.hook)
+        self.mem[0x0FE] = 0x1
+        self.mem[0x180] = 0x1
+        self.assertEqual(self.calls, [(0x180, 0x182)])
+    def test_page_crossing(self):
+        self.mem.add_write_hook(0x100, 0x200, self.hook)
+        self.mem[0x0FF] = 0x1
+        self.assertEqual(self.calls, [(0x0FF, 0x101)])
+    def test_remove_restores_class(self):
+        self.mem.add_write_hook(0x100, 0x200, self.hook)
+        self.assertIsInstance(self.mem, HookedMemory)
+        self.mem.remove_write_hook(0x100, 0x200, self.hook)
+        self.assertIs(type(self.mem), Memory)
+    def test_pickle_drops_hooks(self):
+        self.mem.add_write_hook(0x100, 0x200, self.hook)
+        self.assertIs(type(pickle.loads(pickle.dumps(self.mem))), Memory)
+
+class TestIOMap(unittest.TestCase):
+    """Test I/O pages routed through handlers"""
+    def setUp(self):
+        self.mem = Memory()
+        self.writes = []
+    def read(self, index):
+        return index & 0xFFFF
+    def write(self, index, value):
+        self.writes.append((index, value))
+    def test_read(self):
+        self.mem.map_io(0xFF00, 0x10000, read=self.read)
+        self.assertIsInstance(self.mem, MappedMemory)
+        self.assertEqual(self.mem[0xFFF0], 0xFFF0)
+        self.assertEqual(self.mem[-0x10], 0xFFF0)
+        self.mem[0xFFF0] = 0x1234
+        self.assertEqual(self.mem._mem[0xFFF0], 0x34)
+    def test_write(self):
+        self.mem.map_io(0xFF00, 0x10000, write=self.write)
+        self.mem[0xFFF2] = 0x80
+        self.assertEqual(self.writes, [(0xFFF2, 0x80)])
+        self.assertEqual(self.mem[0xFFF2], 0)
+        self.assertEqual(self.mem.state_hash(), 0)
+    def test_ram_pages(self):
+        self.mem.map_io(0xFF00, 0x10000, self.read, self.write)
+        self.mem[0xFEFE] = 0xBEEF
+        self.assertEqual(self.mem[0xFEFE], 0xBEEF)
+        self.assertEqual(self.writes, [])
+        with self.assertRaises(IndexError):
+            self.mem[0x10000]
+    def test_unmap_restores_class(self):
+        self.mem.map_io(0xFF00, 0x10000, self.read)
+        self.mem.add_write_hook(0x0, 0x100, self.write)
+        self.mem.unmap_io(0xFF00, 0x10000)
+        self.assertIs(type(self.mem), HookedMemory)
+        self.mem.remove_write_hook(0x0, 0x100, self.write)
+        self.assertIs(type(self.mem), Memory)
+    def test_write_hooks_still_called(self):
+        self.mem.map_io(0xFF00, 0x10000, write=self.write)
+        self.mem.add_write_hook(0x0, 0x100, self.write)
+        self.mem[0x10] = 0x1
+        self.assertEqual(self.writes, [(0x10, 0x12)])
+    def test_pickle_drops_handlers(self):
+        self.mem.map_io(0xFF00, 0x10000, self.read)
+        self.assertIs(type(pickle.loads(pickle.dumps(self.mem))), Memory)
+
+class TestHeatmap(unittest.TestCase):
+    """Test per-address access counting"""
+    def setUp(self):
+        self.mem = Memory()
+        self.heatmap = self.mem.enable_heatmap()
+    def test_counts(self):
+        self.assertIsInstance(self.mem, CountingMemory)
+        self.mem[0x10] = 1
+        self.mem[0x10] = 2
+        self.assertEqual(self.mem[0x10], 2)
+        self.mem[0x1FF] = 3
+        self.assertEqual((self.heatmap.reads[0x10], self.heatmap.writes[0x10]),
+            (1, 2))
+        reads, writes = self.heatmap.arrays()
+        self.assertEqual((reads.sum(), writes.sum()), (1, 3))
+        self.assertEqual(self.heatmap.summary(), [(0, 1, 2), (1, 0, 1)])
+        self.assertEqual(self.heatmap.hottest(1), [(0x10, 1, 2)])
+        self.assertEqual(self.heatmap.pages().shape, (256, 2))
+    def test_keeps_hooks_and_io(self):
+        written = []
+        self.mem.add_write_hook(0, 0x100, lambda *span: written.append(span))
+        self.mem.map_io(0xFF00, 0x10000, read=lambda index: 7)
+        self.assertIsInstance(self.mem, CountingMemory)
+        self.mem[4] = 1
+        self.assertEqual(self.mem[0xFFF0], 7)
+        self.assertEqual(written, [(4, 6)])
+        self.assertEqual(self.heatmap.reads[0xFFF0], 1)
+        self.mem.disable_heatmap()
+        self.assertIsInstance(self.mem, MappedMemory)
+    def test_disable(self):
+        self.mem[0] = 1
+        self.assertIs(self.mem.disable_heatmap(), self.heatmap)
+        self.assertIs(type(self.mem), Memory)
+        self.mem[0] = 2
+        self.assertEqual(self.heatmap.writes[0], 1)
+        self.assertIsNone(self.mem.disable_heatmap())
+    def test_stack(self):
+        vmac = VM()
+        heatmap = vmac.mem.enable_heatmap()
+        # PUSHALL then POPALL
+        vmac.mem[0] = 0x00C2
+        vmac.mem[4] = 0x00C3
+        heatmap.clear()
+        vmac.cycle()
+        vmac.cycle()
+        self.assertEqual(heatmap.summary(), [(0xFD, 8, 8), (0xFE, 8, 8)])
+        self.assertEqual(heatmap.writes[0xFDF0], 1)
+    def test_clear_and_pickle(self):
+        self.mem[0] = 1
+        self.heatmap.clear()
+        self.assertEqual(self.heatmap.writes[0], 0)
+        copy = pickle.loads(pickle.dumps(self.mem))
+        self.assertIs(type(copy), Memory)
+        self.assertEqual(copy[0], 1)
@@ -0,0 +1,112 @@
+"""
+pchip16 movie - record and replay per-frame controller input
+"""
+
+import struct
+import sys
+from array import array
+
+from .vm import VM
+
+MOVIE_MAGIC = b'P16M'
+MOVIE_VERSION = 1
+# Magic, version, pads per frame, ROM data CRC-32, seed, frame count. Only
+# the seed's low 32 bits reach seed_state, so only they are stored.
+MOVIE_HEADER = struct.Struct('<4sHHIII')
+PADS = 2
+
+class Movie(object):
+    """ROM checksum, RNG seed and one packed input word per pad per frame"""
+    def __init__(self, checksum, seed=0, inputs=()):
+        self.checksum = checksum
+        self.seed = seed
+        self.inputs = array('H', inputs)
+
+    def __len__(self):
+        """Return the number of frames"""
+        return len(self.inputs) // PADS
+
+    def __getitem__(self, frame):
+        """Return the (pad 1, pad 2) words for frame"""
+        return tuple(self.inputs[frame * PADS:(frame + 1) * PADS])
+
+    def append(self, controllers):
+        """Add a frame of controller words"""
+        self.inputs.extend(controllers)
+
+    def save(self, path):
+        """Write the movie to path"""
+        inputs = array('H', self.inputs)
+        if sys.byteorder == 'big':
+            inputs.byteswap()
+        with open(path, 'wb') as file_handle:
+            file_handle.write(MOVIE_HEADER.pack(MOVIE_MAGIC, MOVIE_VERSION,
+                PADS, self.checksum, self.seed & 0xFFFFFFFF, len(self)))
+            file_handle.write(inputs.tobytes())
+
+    @classmethod
+    def load(cls, path):
+        """Read a movie written by save"""
+        with open(path, 'rb') as file_handle:
+            data = file_handle.read()
+        magic, version, pads, checksum, seed, frames = \
+            MOVIE_HEADER.unpack_from(data)
+        if magic != MOVIE_MAGIC or version != MOVIE_VERSION or pads != PADS:
+            raise ValueError("%s is not a version %i movie" % (path,
+                MOVIE_VERSION))
+        movie = cls(checksum, seed)
+        movie.inputs.frombytes(data[MOVIE_HEADER.size:])
+        if sys.byteorder == 'big':
+            movie.inputs.byteswap()
+        if len(movie) != frames:
+            raise ValueError("%s is truncated" % path)
+        return movie
+
+class MovieRecorder(object):
+    """Frame listener appending the pads latched each frame to a Movie
+
+    Record a VM created as VM(seed), so replays start from the same RND
+    state.
+    """
+    def __init__(self, rom, seed=0):
+        self.movie = Movie(rom.calc_checksum(), seed)
+
+    def __call__(self, vmac):
+        self.movie.append(vmac.controllers)
+
+class Replayer(object):
+    """Play a movie's inputs back into a fresh VM running rom
+
+    The VM's RND generator is seeded from the movie. Each frame latches
+    the recorded pads into the controller addresses before running to
+    VBLNK.
+    """
+    def __init__(self, movie, rom, vmac=None):
+        if rom.calc_checksum() != movie.checksum:
+            raise ValueError("ROM checksum %08x does not match movie %08x"
+                % (rom.calc_checksum(), movie.checksum))
+        self.movie = movie
+        self.vmac = VM() if vmac is None else vmac
+        self.vmac.seed(movie.seed)
+        self.vmac.load_rom(rom)
+        self.frame = 0
+
+    def step(self, present=True):
+        """Replay one frame, returning False once the movie has ended"""
+        if self.frame >= len(self.movie):
+            return False
+        self.vmac.run_frame(self.movie[self.frame], present)
+        self.frame += 1
+        return True
+
+    def run(self, until=None, turbo_until=0):
+        """Replay up to frame until, or the end of the movie
+
+        Frames before turbo_until run without presenting: no audio is
+        rendered and no frame listeners are called. Returns the VM.
+        """
+        end = len(self.movie) if until is None else min(until,
+            len(self.movie))
+        while self.frame < end:
+            self.step(self.frame >= turbo_until)
+        return self.vmac
@@ -0,0 +1,89 @@
+"""
+pchip16 movie tests
+"""
+#pylint: disable=I0011,R0904
+
+import os
+import shutil
+import tempfile
+import unittest
+from pchip16.golden import FrameHasher
+from pchip16.movie import Movie, MovieRecorder, Replayer
+from pchip16.rom import ROM
+from pchip16.rom_tests import FILE_PATH
+from pchip16.vm import VM, seed_state
+
+INPUTS = [(frame % 16, frame >> 2) for frame in range(40)]
+
+class TestMovie(unittest.TestCase):
+    """Test the movie container and its file format"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    def test_frames(self):
+        movie = Movie(0x1234, 5)
+        movie.append((0x1, 0x80))
+        movie.append((0x2, 0x0))
+        self.assertEqual(len(movie), 2)
+        self.assertEqual(movie[1], (0x2, 0x0))
+        self.assertEqual(movie.inputs.itemsize, 2)
+    def test_save_load(self):
+        path = os.path.join(self.directory, 'test.movie')
+        movie = Movie(0xDEADBEEF, -3, [1, 2, 3, 4])
+        movie.save(path)
+        self.assertEqual(os.path.getsize(path), 20 + 8)
+        loaded = Movie.load(path)
+        self.assertEqual((loaded.checksum, loaded.seed, list(loaded.inputs)),
+            (0xDEADBEEF, 2**32 - 3, [1, 2, 3, 4]))
+        self.assertEqual(seed_state(loaded.seed), seed_state(-3))
+    def test_wide_seeds(self):
+        path = os.path.join(self.directory, 'wide.movie')
+        for seed in (2**31, 2**32 - 1, 2**40 + 7):
+            Movie(0, seed).save(path)
+            loaded = Movie.load(path)
+            self.assertEqual(seed_state(loaded.seed), seed_state(seed))
+    def test_load_bad_file(self):
+        path = os.path.join(self.directory, 'bad.movie')
+        with open(path, 'wb') as file_handle:
+            file_handle.write(b'P16G' + bytes(16))
+        self.assertRaises(ValueError, Movie.load, path)
+
+class TestReplay(unittest.TestCase):
+    """Test recorded runs replay identically"""
+    def setUp(self):
+        with open(FILE_PATH, 'rb') as file_handle:
+            self.rom = ROM(file_handle)
+        self.vmac = VM(9)
+        self.vmac.load_rom(self.rom)
+        self.recorder = MovieRecorder(self.rom, 9)
+        self.hasher = FrameHasher()
+        self.vmac.add_frame_listener(self.recorder)
+        self.vmac.add_frame_listener(self.hasher)
+        for pads in INPUTS:
+            self.vmac.run_frame(pads)
+    def test_recorded(self):
+        movie = self.recorder.movie
+        self.assertEqual(len(movie), len(INPUTS))
+        self.assertEqual(movie[7], INPUTS[7])
+        self.assertEqual(movie.checksum, self.rom.calc_checksum())
+    def test_replay(self):
+        replayer = Replayer(self.recorder.movie, self.rom)
+        hasher = FrameHasher()
+        replayer.vmac.add_frame_listener(hasher)
+        vmac = replayer.run()
+        self.assertEqual(vmac.state_hash(), self.vmac.state_hash())
+        self.assertEqual(hasher.hashes, self.hasher.hashes)
+        self.assertFalse(replayer.step())
+    def test_turbo(self):
+        replayer = Replayer(self.recorder.movie, self.rom)
+        hasher = FrameHasher()
+        replayer.vmac.add_frame_listener(hasher)
+        replayer.run(until=30, turbo_until=25)
+        self.assertEqual(replayer.frame, 30)
+        self.assertEqual(hasher.hashes, self.hasher.hashes[25:30])
+        replayer.run()
+        self.assertEqual(replayer.vmac.state_hash(), self.vmac.state_hash())
+    def test_wrong_rom(self):
+        movie = Movie(self.rom.calc_checksum() ^ 1)
+        self.assertRaises(ValueError, Replayer, movie, self.rom)
@@ -0,0 +1,106 @@
+"""
+pchip16 palette - 16 colour lookup tables for converting frames
+"""
+
+import numpy as np
+
+DEFAULT_COLORS = [
+    0x000000, 0x000000, 0x888888, 0xBF3932,
+    0xDE7AAE, 0x4C3D21, 0x905F25, 0xE49452,
+    0xEAD979, 0x537A3B, 0xABD54A, 0x252E38,
+    0x00467F, 0x68ABCC, 0xBCDEE4, 0xFFFFFF,
+]
+
+# ITU-R BT.601 luma weights in 8 bit fixed point
+LUMA_WEIGHTS = (77, 150, 29)
+RGBA32 = np.dtype('<u4')
+
+def _default_colors():
+    """Return DEFAULT_COLORS as a 16x3 uint8 array"""
+    return np.array([((color >> 16) & 0xFF, (color >> 8) & 0xFF,
+        color & 0xFF) for color in DEFAULT_COLORS], dtype=np.uint8)
+
+class Palette(object):
+    """Colour table plus per-background lookup tables for each format
+
+    Framebuffer index 0 shows the background colour, so every format keeps
+    one 16 entry table per background index and conversion is a single
+    np.take of the framebuffer through the right table. Conversions write
+    into out, or into a buffer kept per format and reused every call.
+    """
+    def __init__(self):
+        self.colors = _default_colors()
+        self.version = 0
+        self._buffers = {}
+        self._update()
+
+    def __getstate__(self):
+        return {'colors': self.colors}
+
+    def reset(self):
+        """Restore the default colours"""
+        self.colors = _default_colors()
+        self.version += 1
+        self._update()
+
+    def __setstate__(self, state):
+        self.colors = state['colors']
+        self.version = 0
+        self._buffers = {}
+        self._update()
+
+    def _update(self):
+        """Rebuild the lookup tables from self.colors"""
+        rgb = np.repeat(self.colors[np.newaxis], 16, axis=0)
+        rgb[:, 0] = self.colors
+        self.rgb_lut = rgb
+        wide = rgb.astype(np.uint32)
+        self.rgba_lut = (wide[..., 0] | (wide[..., 1] << 8)
+            | (wide[..., 2] << 16) | np.uint32(0xFF000000)).astype(RGBA32)
+        self.gray_lut = ((wide * LUMA_WEIGHTS).sum(axis=2) >> 8) \
+            .astype(np.uint8)
+
+    def load(self, source, addr):
+        """PAL: load 16 RGB triples from addr in source memory"""
+        data = np.frombuffer(source, dtype=np.uint8)
+        self.colors = data.take(np.arange(addr, addr + 48),
+            mode='wrap').reshape(16, 3)
+        self.version += 1
+        self._update()
+
+    def _out(self, kind, shape, dtype, out):
+        """Return out, or the preallocated buffer for kind"""
+        if out is not None:
+            return out
+        buf = self._buffers.get(kind)
+        if buf is None or buf.shape != shape:
+            buf = self._buffers[kind] = np.empty(shape, dtype=dtype)
+        return buf
+
+    @staticmethod
+    def _source(framebuffer, scale):
+        """Return framebuffer sampled every scale pixels"""
+        if scale == 1:
+            return framebuffer
+        return framebuffer[::scale, ::scale]
+
+    def to_rgb(self, framebuffer, background=0, out=None, scale=1):
+        """Convert to (H, W, 3) uint8 RGB24"""
+        source = self._source(framebuffer, scale)
+        out = self._out(('rgb', scale), source.shape + (3,), np.uint8, out)
+        return np.take(self.rgb_lut[background], source, axis=0, out=out,
+            mode='clip')
+
+    def to_rgba(self, framebuffer, background=0, out=None, scale=1):
+        """Convert to (H, W) little-endian uint32, bytes R, G, B, A"""
+        source = self._source(framebuffer, scale)
+        out = self._out(('rgba', scale), source.shape, RGBA32, out)
+        return np.take(self.rgba_lut[background], source, out=out,
+            mode='clip')
+
+    def to_gray(self, framebuffer, background=0, out=None, scale=1):
+        """Convert to (H, W) uint8 luma"""
+        source = self._source(framebuffer, scale)
+        out = self._out(('gray', scale), source.shape, np.uint8, out)
+        return np.take(self.gray_lut[background], source, out=out,
+            mode='clip')
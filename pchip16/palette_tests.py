@@ -0,0 +1,47 @@
+"""
+pchip16 palette tests
+"""
+#pylint: disable=I0011,R0904
+
+import unittest
+from array import array
+import numpy as np
+from pchip16.palette import Palette
+
+class TestPalette(unittest.TestCase):
+    """Test indexed to RGB conversion"""
+    def setUp(self):
+        self.palette = Palette()
+        self.framebuffer = np.zeros((240, 320), dtype=np.uint8)
+        self.framebuffer[0, 0] = 0xF
+        self.framebuffer[0, 1] = 0x3
+    def test_rgb(self):
+        rgb = self.palette.to_rgb(self.framebuffer)
+        self.assertEqual(rgb.shape, (240, 320, 3))
+        self.assertEqual(rgb[0, :3].tolist(),
+            [[0xFF, 0xFF, 0xFF], [0xBF, 0x39, 0x32], [0, 0, 0]])
+    def test_background(self):
+        rgb = self.palette.to_rgb(self.framebuffer, background=0xF)
+        self.assertEqual(rgb[1, 1].tolist(), [0xFF, 0xFF, 0xFF])
+        self.assertEqual(rgb[0, 1].tolist(), [0xBF, 0x39, 0x32])
+    def test_rgba_bytes(self):
+        rgba = self.palette.to_rgba(self.framebuffer)
+        self.assertEqual(rgba[0, 1:2].tobytes(), b'\xBF\x39\x32\xFF')
+    def test_gray(self):
+        gray = self.palette.to_gray(self.framebuffer)
+        self.assertEqual(gray[0, 0], 0xFF)
+        self.assertEqual(gray[1, 1], 0)
+    def test_buffer_reused(self):
+        first = self.palette.to_rgb(self.framebuffer)
+        self.assertIs(self.palette.to_rgb(self.framebuffer), first)
+    def test_caller_buffer(self):
+        out = np.empty((120, 160), dtype=np.uint8)
+        result = self.palette.to_gray(self.framebuffer, out=out, scale=2)
+        self.assertIs(result, out)
+        self.assertEqual(out[0, 0], 0xFF)
+    def test_load(self):
+        source = array('B', bytes(0x100))
+        source[0x10:0x13] = array('B', [1, 2, 3])
+        self.palette.load(source, 0x10)
+        rgb = self.palette.to_rgb(self.framebuffer)
+        self.assertEqual(rgb[5, 5].tolist(), [1, 2, 3])
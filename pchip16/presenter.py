@@ -0,0 +1,118 @@
+"""
+pchip16 presenter - hand completed frames to a consumer thread
+"""
+
+from collections import deque
+from queue import Empty, SimpleQueue
+from threading import Thread
+
+import numpy as np
+
+from .gpu import SCREEN_HEIGHT, SCREEN_WIDTH
+
+class Frame(object):
+    """One completed frame: colour indices, background, palette and sound"""
+    def __init__(self):
+        self.framebuffer = np.zeros((SCREEN_HEIGHT, SCREEN_WIDTH),
+            dtype=np.uint8)
+        self.background = 0
+        self.colors = np.zeros((16, 3), dtype=np.uint8)
+        self.samples = np.zeros(0, dtype=np.int16)
+        self.frame_count = 0
+
+    def capture(self, vmac):
+        """Copy vmac's frame into this buffer"""
+        gpu = vmac.gpu
+        np.copyto(self.framebuffer, gpu.framebuffer)
+        self.background = gpu.background
+        np.copyto(self.colors, gpu.palette.colors)
+        samples = vmac.audio.samples
+        if self.samples.shape != samples.shape:
+            self.samples = np.empty_like(samples)
+        np.copyto(self.samples, samples)
+        self.frame_count = vmac.frame_count
+
+class Presenter(object):
+    """Frame listener passing frames to consumer(frame) on its own thread
+
+    Frames are copied into one of buffers preallocated Frames, taken from a
+    free list and handed over through a queue the VM never waits on; the
+    VM thread takes no lock that the consumer can hold. When every buffer
+    is in use the frame is dropped and counted. With latest, the consumer
+    is given only the newest completed frame and older ones are skipped,
+    otherwise frames are presented in order. A Frame is recycled once
+    consumer returns, so consumers must copy anything they keep.
+    """
+    def __init__(self, consumer, buffers=2, latest=True):
+        if buffers < 1:
+            raise ValueError("need at least one buffer")
+        self.consumer = consumer
+        self.latest = latest
+        self.frames = 0
+        self.presented = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.error = None
+        self._free = deque(Frame() for _ in range(buffers))
+        self._ready = SimpleQueue()
+        self._thread = Thread(target=self._present, daemon=True)
+        self._thread.start()
+
+    def __call__(self, vmac):
+        self.frames += 1
+        try:
+            frame = self._free.popleft()
+        except IndexError:
+            self.dropped += 1
+            return
+        frame.capture(vmac)
+        self._ready.put(frame)
+
+    def _next(self):
+        """Return the frame to present, or None once closed"""
+        frame = self._ready.get()
+        while self.latest and frame is not None:
+            try:
+                newer = self._ready.get_nowait()
+            except Empty:
+                break
+            if newer is None:
+                self._ready.put(None)
+                break
+            self._free.append(frame)
+            self.skipped += 1
+            frame = newer
+        return frame
+
+    def _present(self):
+        """Presenter thread: consume frames until the None sentinel"""
+        while True:
+            frame = self._next()
+            if frame is None:
+                break
+            if self.error is None:
+                try:
+                    self.consumer(frame)
+                    self.presented += 1
+                except Exception as err: #pylint: disable=I0011,W0703
+                    self.error = err
+            self._free.append(frame)
+
+    def close(self):
+        """Present the frames still queued, then stop the thread
+
+        Raises the first error consumer raised, if any.
+        """
+        if self._thread is None:
+            return
+        self._ready.put(None)
+        self._thread.join()
+        self._thread = None
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,84 @@
+"""
+pchip16 presenter tests
+"""
+#pylint: disable=I0011,R0904
+
+import threading
+import time
+import unittest
+from zlib import crc32
+
+from pchip16 import VM, ROM
+from pchip16.rom_tests import FILE_PATH
+from pchip16.presenter import Presenter
+
+class TestPresenter(unittest.TestCase):
+    """Test frames handed to a consumer thread"""
+    def setUp(self):
+        with open(FILE_PATH, 'rb') as file_handle:
+            self.rom = ROM(file_handle)
+        self.vm = VM()
+        self.vm.load_rom(self.rom)
+        self.expected = {}
+        self.vm.add_frame_listener(self.remember)
+    def remember(self, vmac):
+        self.expected[vmac.frame_count] = (crc32(vmac.gpu.framebuffer),
+            vmac.gpu.background)
+    def test_in_order(self):
+        seen = []
+        presenter = Presenter(lambda frame: seen.append((frame.frame_count,
+            crc32(frame.framebuffer), frame.background)), buffers=64,
+            latest=False)
+        self.vm.add_frame_listener(presenter)
+        for _ in range(30):
+            self.vm.run_frame()
+        presenter.close()
+        self.assertEqual(presenter.dropped, 0)
+        self.assertEqual(presenter.presented, 30)
+        self.assertEqual([frame for frame, _, _ in seen], list(range(1, 31)))
+        for frame, checksum, background in seen:
+            self.assertEqual((checksum, background), self.expected[frame])
+    def test_slow_consumer(self):
+        release = threading.Event()
+        seen = []
+        def consume(frame):
+            release.wait()
+            seen.append(frame.frame_count)
+        presenter = Presenter(consume, buffers=2)
+        self.vm.add_frame_listener(presenter)
+        for _ in range(20):
+            self.vm.run_frame()
+        self.assertEqual(presenter.frames, 20)
+        self.assertGreaterEqual(presenter.dropped, 17)
+        release.set()
+        presenter.close()
+        self.assertEqual(presenter.presented + presenter.skipped
+            + presenter.dropped, 20)
+        self.assertEqual(seen, sorted(seen))
+    def test_latest(self):
+        gate = threading.Event()
+        seen = []
+        def consume(frame):
+            gate.wait()
+            seen.append(frame.frame_count)
+        presenter = Presenter(consume, buffers=8)
+        self.vm.add_frame_listener(presenter)
+        self.vm.run_frame()
+        while presenter._ready.qsize():
+            time.sleep(0.001)
+        for _ in range(5):
+            self.vm.run_frame()
+        gate.set()
+        presenter.close()
+        self.assertEqual(seen, [1, 6])
+        self.assertEqual(presenter.skipped, 4)
+    def test_error(self):
+        def consume(frame):
+            raise OSError("display gone")
+        presenter = Presenter(consume)
+        self.vm.add_frame_listener(presenter)
+        self.vm.run_frame()
+        self.assertRaises(OSError, presenter.close)
+        presenter.close()
+    def test_buffers(self):
+        self.assertRaises(ValueError, Presenter, id, buffers=0)
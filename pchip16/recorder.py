@@ -0,0 +1,172 @@
+"""
+pchip16 recorder - stream headless frames to raw, Y4M or PNG files
+"""
+
+import struct
+import zlib
+from queue import Full, Queue
+from threading import Thread
+
+import numpy as np
+
+from .gpu import SCREEN_HEIGHT, SCREEN_WIDTH
+
+# ITU-R BT.601 studio swing RGB to YCbCr in 8 bit fixed point
+YCBCR_MATRIX = np.array([
+    [66, 129, 25],
+    [-38, -74, 112],
+    [112, -94, -18],
+])
+YCBCR_OFFSET = np.array([16, 128, 128])
+
+def resolve(framebuffer, background):
+    """Return palette indices with transparent pixels as background"""
+    lut = np.arange(16, dtype=np.uint8)
+    lut[0] = background
+    return lut.take(framebuffer, mode='clip')
+
+def to_ycbcr(colors):
+    """Return (16, 3) uint8 YCbCr for (16, 3) RGB colors"""
+    ycc = (colors.astype(np.int32) @ YCBCR_MATRIX.T + 128) >> 8
+    return (ycc + YCBCR_OFFSET).astype(np.uint8)
+
+def _chunk(kind, data):
+    """Return a PNG chunk"""
+    return struct.pack('>I', len(data)) + kind + data + \
+        struct.pack('>I', zlib.crc32(kind + data))
+
+def encode_png(indices, colors, level=6):
+    """Return an 8 bit palette PNG of (H, W) indices into (16, 3) colors"""
+    height, width = indices.shape
+    rows = np.zeros((height, width + 1), dtype=np.uint8)
+    rows[:, 1:] = indices
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        _chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0,
+            0)),
+        _chunk(b'PLTE', colors.astype(np.uint8).tobytes()),
+        _chunk(b'IDAT', zlib.compress(rows.tobytes(), level)),
+        _chunk(b'IEND', b''),
+    ])
+
+class RawWriter(object):
+    """Concatenated 320x240 frames of one palette index byte per pixel"""
+    def __init__(self, path):
+        self.file_handle = open(path, 'wb')
+
+    def write(self, framebuffer, background, colors):
+        """Append one frame"""
+        self.file_handle.write(resolve(framebuffer, background).tobytes())
+
+    def close(self):
+        """Flush and close the file"""
+        self.file_handle.close()
+
+class Y4MWriter(object):
+    """YUV4MPEG2 stream at 60 fps in full resolution 4:4:4"""
+    def __init__(self, path):
+        self.file_handle = open(path, 'wb')
+        self.file_handle.write(b'YUV4MPEG2 W%i H%i F60:1 Ip A1:1 C444\n'
+            % (SCREEN_WIDTH, SCREEN_HEIGHT))
+
+    def write(self, framebuffer, background, colors):
+        """Append one frame as Y, Cb and Cr planes"""
+        planes = to_ycbcr(colors).T.take(resolve(framebuffer, background),
+            axis=1)
+        self.file_handle.write(b'FRAME\n')
+        self.file_handle.write(planes.tobytes())
+
+    def close(self):
+        """Flush and close the file"""
+        self.file_handle.close()
+
+class PNGWriter(object):
+    """One palette PNG per frame, path being a %-pattern like 'f%05i.png'"""
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+
+    def write(self, framebuffer, background, colors):
+        """Write the next numbered file"""
+        with open(self.path % self.count, 'wb') as file_handle:
+            file_handle.write(encode_png(resolve(framebuffer, background),
+                colors))
+        self.count += 1
+
+    def close(self):
+        """Nothing is held open between frames"""
+        pass
+
+WRITERS = {
+    'raw': RawWriter,
+    'y4m': Y4MWriter,
+    'png': PNGWriter,
+}
+
+class Recorder(object):
+    """Frame listener that encodes and writes frames on a background thread
+
+    Each call copies the frame into a bounded queue and returns at once; if
+    the writer has fallen queue_size frames behind, the frame is dropped
+    and counted instead of stalling the VM. Use with VM.add_frame_listener.
+    """
+    def __init__(self, path, fmt='raw', queue_size=64):
+        self.frames = 0
+        self.written = 0
+        self.dropped = 0
+        self.max_queue_depth = 0
+        self.error = None
+        self._writer = WRITERS[fmt](path)
+        self._queue = Queue(queue_size)
+        self._thread = Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        """Frames waiting to be written"""
+        return self._queue.qsize()
+
+    def __call__(self, vmac):
+        gpu = vmac.gpu
+        self.frames += 1
+        try:
+            self._queue.put_nowait((gpu.framebuffer.copy(), gpu.background,
+                gpu.palette.colors))
+        except Full:
+            self.dropped += 1
+            return
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+
+    def _drain(self):
+        """Writer thread: encode queued frames until the None sentinel"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self._writer.write(*item)
+                self.written += 1
+            except (OSError, ValueError, TypeError) as err:
+                self.error = err
+
+    def close(self):
+        """Write the remaining frames, then stop the thread
+
+        Raises the first error the writer thread hit, if any.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._writer.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,89 @@
+"""
+pchip16 recorder tests
+"""
+#pylint: disable=I0011,R0904
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+from threading import Event
+import numpy as np
+from pchip16.recorder import Recorder, encode_png, to_ycbcr
+from pchip16.vm import VM
+
+class TestRecorder(unittest.TestCase):
+    """Test frame streaming in each format"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.vmac = VM()
+        # VBLNK ; JMP 0x0000
+        self.vmac.mem[0x0] = 0x0002
+        self.vmac.mem[0x4] = 0x0010
+        self.vmac.gpu.framebuffer[1, 2] = 5
+        self.vmac.gpu.background = 3
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    def record(self, fmt, name, frames=3):
+        path = os.path.join(self.directory, name)
+        with Recorder(path, fmt) as recorder:
+            self.vmac.add_frame_listener(recorder)
+            for _ in range(frames):
+                self.vmac.run_frame()
+        self.assertEqual(recorder.written, frames)
+        self.assertEqual(recorder.dropped, 0)
+        return path
+    def test_raw(self):
+        with open(self.record('raw', 'out.raw'), 'rb') as file_handle:
+            data = file_handle.read()
+        self.assertEqual(len(data), 3 * 320 * 240)
+        self.assertEqual(data[:3], b'\x03\x03\x03')
+        self.assertEqual(data[320 + 2], 5)
+    def test_y4m(self):
+        with open(self.record('y4m', 'out.y4m'), 'rb') as file_handle:
+            data = file_handle.read()
+        header, frames = data.split(b'\n', 1)
+        self.assertEqual(header, b'YUV4MPEG2 W320 H240 F60:1 Ip A1:1 C444')
+        self.assertEqual(len(frames), 3 * (6 + 3 * 320 * 240))
+        ycc = to_ycbcr(self.vmac.gpu.palette.colors)
+        self.assertEqual(frames[6], ycc[3, 0])
+        self.assertEqual(frames[6 + 320 * 240 + 322], ycc[5, 1])
+    def test_png(self):
+        self.record('png', 'f%03i.png', 2)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+            ['f000.png', 'f001.png'])
+    def test_dropped_frames(self):
+        recorder = Recorder(os.path.join(self.directory, 'out.raw'),
+            queue_size=2)
+        release = Event()
+        write = recorder._writer.write
+        recorder._writer.write = lambda *frame: release.wait() and \
+            write(*frame)
+        self.vmac.add_frame_listener(recorder)
+        for _ in range(6):
+            self.vmac.run_frame()
+        self.assertGreaterEqual(recorder.dropped, 3)
+        self.assertEqual(recorder.max_queue_depth, 2)
+        release.set()
+        recorder.close()
+        self.assertEqual(recorder.frames, 6)
+        self.assertEqual(recorder.written + recorder.dropped, 6)
+        self.assertEqual(recorder.queue_depth, 0)
+
+class TestPNG(unittest.TestCase):
+    """Test the palette PNG encoder"""
+    def test_round_trip(self):
+        indices = np.arange(12, dtype=np.uint8).reshape(3, 4)
+        colors = np.arange(48, dtype=np.uint8).reshape(16, 3)
+        data = encode_png(indices, colors)
+        self.assertEqual(data[:8], b'\x89PNG\r\n\x1a\n')
+        self.assertEqual(struct.unpack('>II', data[16:24]), (4, 3))
+        start = data.index(b'IDAT') + 4
+        length = struct.unpack('>I', data[start - 8:start - 4])[0]
+        rows = zlib.decompress(data[start:start + length])
+        self.assertEqual(rows, b''.join(b'\x00' + row.tobytes()
+            for row in indices))
+        palette = data.index(b'PLTE') + 4
+        self.assertEqual(data[palette:palette + 48], colors.tobytes())
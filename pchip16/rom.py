@@ -5,6 +5,7 @@ pchip16 ROM module - for loading programs into memory from file
 from .utils import to_word
 from crcmod import mkCrcFun
 from array import array
+from pickle import PickleBuffer
 
 CRC32_FUNC = mkCrcFun(0x104C11DB7, initCrc=0, xorOut=0xFFFFFFFF)
 
@@ -25,8 +26,8 @@ class ROM(object):
         """Load contents of file_handle into memory"""
         self.size = file_handle.tell()
         header = file_handle.read(16)
-        if header[0:4] == "CH16":
-            header = [ord(c) for c in header]
+        if header[0:4] == b"CH16":
+            header = list(bytearray(header))
             version = header[5]
             self.version = "%d.%d" % (version >> 4, version & 0xF)
             size = header[6:0xA]
@@ -37,8 +38,28 @@ class ROM(object):
             self.checksum = to_word(header[0xC:0x10])
         data = file_handle.read()
         self.data = array('B')
-        self.data.fromstring(data)
+        self.data.frombytes(data)
+
+    def __reduce_ex__(self, protocol):
+        """Pickle ROM data as one buffer, out-of-band under protocol 5"""
+        if protocol >= 5:
+            data = PickleBuffer(self.data)
+        else:
+            data = self.data.tobytes()
+        return (_rebuild_rom, (self.__class__, data, self.version, self.size,
+            self.start_address, self.checksum))
 
     def calc_checksum(self):
         """Compute the checksum of current ROM data"""
-        return CRC32_FUNC(self.data.tostring() )
+        return CRC32_FUNC(self.data.tobytes() )
+
+def _rebuild_rom(cls, data, version, size, start_address, checksum):
+    """Unpickle a ROM with a single copy of its data"""
+    rom = cls.__new__(cls)
+    rom.data = array('B')
+    rom.data.frombytes(data)
+    rom.version = version
+    rom.size = size
+    rom.start_address = start_address
+    rom.checksum = checksum
+    return rom
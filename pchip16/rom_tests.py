@@ -5,6 +5,7 @@ pchip16 rom test runner
 
 FILE_PATH = "data/Bounce.c16"
 
+import pickle
 import unittest
 from pchip16 import ROM
 
@@ -36,3 +37,13 @@ class TestChecksum(TestROM):
     """Test checksum algorithm gives the same result"""
     def test_checksum(self):
         self.assertEqual(self.rom.calc_checksum(), 0xD7B62213)
+
+class TestPickle(TestROM):
+    """Test ROM survives pickling with its data"""
+    def test_round_trip(self):
+        buffers = []
+        data = pickle.dumps(self.rom, 5, buffer_callback=buffers.append)
+        rom = pickle.loads(data, buffers=buffers)
+        self.assertEqual(rom.data, self.rom.data)
+        self.assertEqual(rom.version, "1.1")
+        self.assertEqual(rom.checksum, 0xD7B62213)
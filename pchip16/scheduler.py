@@ -0,0 +1,148 @@
+"""
+pchip16 scheduler - round-robin many VMs in one thread by cycle quanta
+"""
+
+from time import perf_counter
+
+from .vm import ERRORS
+
+READY = 'ready'
+HALTED = 'halted'
+FAULTED = 'faulted'
+EXPIRED = 'expired'
+DONE = 'done'
+
+class Slot(object):
+    """A VM's place in the Scheduler, with its progress counters"""
+    def __init__(self, vmac, name, quantum, priority, deadline, budget):
+        self.vm = vmac
+        self.name = name
+        self.priority = priority
+        self.quantum = quantum * priority
+        self.deadline = deadline
+        self.budget = budget
+        self.instructions = 0
+        self.turns = 0
+        self.status = READY
+        self.error = None
+
+    def progress(self):
+        """Return this VM's counters as a dict"""
+        return {
+            'name': self.name,
+            'status': self.status,
+            'instructions': self.instructions,
+            'turns': self.turns,
+            'frames': self.vm.frame_count,
+            'error': None if self.error is None else repr(self.error),
+        }
+
+class Scheduler(object):
+    """Interleave VMs in one thread, each turn running a cycle quantum
+
+    A turn gives a VM quantum * priority instructions, ending early at a
+    VBLNK, which counts a frame. VMs retire when they halt on a jump to
+    itself, raise as VM.execute does for an invalid op code, pass their
+    deadline (a time.perf_counter value, checked before each turn) or use
+    up their instruction budget. Turns reuse each VM's own state and
+    allocate nothing.
+    """
+    def __init__(self, quantum=1000):
+        self.quantum = quantum
+        self.slots = []
+        self.instructions = 0
+        self.elapsed = 0.0
+        self._ready = []
+
+    def add(self, vmac, priority=1, deadline=None, budget=None, name=None):
+        """Schedule vmac and return its Slot
+
+        priority is a positive int multiplying the quantum.
+        """
+        if not isinstance(priority, int) or priority < 1:
+            raise ValueError("priority must be a positive int, not %r"
+                % (priority,))
+        if name is None:
+            name = len(self.slots)
+        slot = Slot(vmac, name, self.quantum, priority, deadline, budget)
+        self.slots.append(slot)
+        self._ready.append(slot)
+        return slot
+
+    @property
+    def ready(self):
+        """Number of VMs still running"""
+        return len(self._ready)
+
+    def run(self, rounds=None):
+        """Give every ready VM a turn per round until none are left
+
+        Stops after rounds rounds if given. Returns the number of VMs
+        still ready.
+        """
+        ready = self._ready
+        turn = self._turn
+        start = perf_counter()
+        done = 0
+        while ready and (rounds is None or done < rounds):
+            index = 0
+            while index < len(ready):
+                if turn(ready[index]):
+                    index += 1
+                else:
+                    ready[index] = ready[-1]
+                    ready.pop()
+            done += 1
+        self.elapsed += perf_counter() - start
+        return len(ready)
+
+    def _turn(self, slot):
+        """Run one quantum of slot, returning False once it retires"""
+        if slot.deadline is not None and perf_counter() >= slot.deadline:
+            slot.status = EXPIRED
+            return False
+        vmac = slot.vm
+        cycles = slot.quantum
+        if slot.budget is not None:
+            cycles = min(cycles, slot.budget - slot.instructions)
+        slot.turns += 1
+        try:
+            count = vmac.run(cycles)
+            slot.instructions += count
+            self.instructions += count
+            if vmac.vblank_wait:
+                vmac.frame_count += 1
+            if slot.budget is not None and slot.instructions >= slot.budget:
+                slot.status = DONE
+                return False
+            # A jump to its own address never makes further progress
+            addr = vmac.program_counter
+            op_code = vmac.fetch()
+            if op_code >> 24 == 0x10 and ((op_code & 0xFF) << 8
+                    | (op_code >> 8) & 0xFF) == addr:
+                slot.status = HALTED
+                return False
+        except ERRORS as err:
+            slot.error = err
+            slot.status = FAULTED
+            return False
+        return True
+
+    def stats(self):
+        """Return aggregate throughput and the count of VMs per status"""
+        statuses = dict((status, 0)
+            for status in (READY, HALTED, FAULTED, EXPIRED, DONE))
+        for slot in self.slots:
+            statuses[slot.status] += 1
+        return {
+            'vms': len(self.slots),
+            'instructions': self.instructions,
+            'elapsed': self.elapsed,
+            'instructions_per_second':
+                self.instructions / self.elapsed if self.elapsed else 0.0,
+            'statuses': statuses,
+        }
+
+    def progress(self):
+        """Return every VM's progress dict, in the order added"""
+        return [slot.progress() for slot in self.slots]
@@ -0,0 +1,103 @@
+"""
+pchip16 scheduler tests
+"""
+#pylint: disable=I0011,R0904
+
+import unittest
+from time import perf_counter
+from pchip16.scheduler import (Scheduler, DONE, EXPIRED, FAULTED, HALTED,
+    READY)
+from pchip16.vm import VM
+
+def looping_vm():
+    """Return a VM adding to r0 forever: ADDI R0, 1 ; JMP 0x0000"""
+    vmac = VM()
+    vmac.mem[0x0] = 0x0040
+    vmac.mem[0x2] = 0x0001
+    vmac.mem[0x4] = 0x0010
+    return vmac
+
+class TestScheduler(unittest.TestCase):
+    """Test quanta, priorities and retirement"""
+    def setUp(self):
+        self.scheduler = Scheduler(quantum=10)
+    def test_fair(self):
+        first = self.scheduler.add(looping_vm())
+        second = self.scheduler.add(looping_vm())
+        self.assertEqual(self.scheduler.run(rounds=5), 2)
+        self.assertEqual(first.instructions, 50)
+        self.assertEqual(second.instructions, 50)
+        self.assertEqual(first.turns, 5)
+    def test_priority(self):
+        low = self.scheduler.add(looping_vm())
+        high = self.scheduler.add(looping_vm(), priority=3)
+        self.scheduler.run(rounds=4)
+        self.assertEqual(high.instructions, 3 * low.instructions)
+    def test_priority_must_be_positive_int(self):
+        for priority in (0, -1, 1.5, '2'):
+            self.assertRaises(ValueError, self.scheduler.add, looping_vm(),
+                priority=priority)
+        self.assertEqual(self.scheduler.slots, [])
+    def test_vblank_ends_turn(self):
+        vmac = VM()
+        # VBLNK ; JMP 0x0000
+        vmac.mem[0x0] = 0x0002
+        vmac.mem[0x4] = 0x0010
+        slot = self.scheduler.add(vmac)
+        self.scheduler.run(rounds=3)
+        self.assertEqual(slot.instructions, 5)
+        self.assertEqual(vmac.frame_count, 3)
+    def test_halt(self):
+        vmac = VM()
+        # NOP ; JMP 0x0004
+        vmac.mem[0x4] = 0x0010
+        vmac.mem[0x6] = 0x0004
+        slot = self.scheduler.add(vmac)
+        self.assertEqual(self.scheduler.run(), 0)
+        self.assertEqual(slot.status, HALTED)
+    def test_invalid_op_code(self):
+        vmac = looping_vm()
+        vmac.mem[0x4] = 0xFF10
+        slot = self.scheduler.add(vmac)
+        other = self.scheduler.add(looping_vm())
+        self.scheduler.run(rounds=2)
+        self.assertEqual(slot.status, FAULTED)
+        self.assertIsInstance(slot.error, ValueError)
+        self.assertEqual(other.status, READY)
+        self.assertEqual(other.turns, 2)
+    def test_budget(self):
+        slot = self.scheduler.add(looping_vm(), budget=25)
+        self.scheduler.run()
+        self.assertEqual(slot.status, DONE)
+        self.assertEqual(slot.instructions, 25)
+        self.assertEqual(slot.turns, 3)
+    def test_deadline(self):
+        slot = self.scheduler.add(looping_vm(), deadline=perf_counter())
+        self.scheduler.run()
+        self.assertEqual(slot.status, EXPIRED)
+        self.assertEqual(slot.instructions, 0)
+    def test_deadline_mid_round(self):
+        first = looping_vm()
+        later = self.scheduler.add(first)
+        second = self.scheduler.add(looping_vm(), deadline=perf_counter() + 60)
+        run = first.run
+        def expire(cycles):
+            # The second VM's deadline passes during the first one's turn
+            second.deadline = perf_counter()
+            return run(cycles)
+        first.run = expire
+        self.scheduler.run(rounds=1)
+        self.assertEqual(later.instructions, 10)
+        self.assertEqual(second.status, EXPIRED)
+        self.assertEqual(second.instructions, 0)
+    def test_thousands(self):
+        for _ in range(2000):
+            self.scheduler.add(looping_vm(), budget=30)
+        self.assertEqual(self.scheduler.run(), 0)
+        stats = self.scheduler.stats()
+        self.assertEqual(stats['instructions'], 2000 * 30)
+        self.assertEqual(stats['statuses'][DONE], 2000)
+        self.assertGreater(stats['instructions_per_second'], 0)
+        progress = self.scheduler.progress()
+        self.assertEqual(progress[1999]['instructions'], 30)
+        self.assertEqual(progress[1999]['name'], 1999)
@@ -0,0 +1,490 @@
+"""
+pchip16 server - play ROMs remotely over TCP or WebSocket
+"""
+
+import asyncio
+import struct
+from base64 import b64encode
+from hashlib import sha1
+from itertools import count
+from time import perf_counter
+
+import numpy as np
+
+from .gpu import SCREEN_HEIGHT, SCREEN_WIDTH
+from .palette import Palette
+from .session import Histogram, SessionManager
+
+# Raw TCP clients open with MAGIC, then every message is length prefixed
+MAGIC = b'P16P'
+LENGTH = struct.Struct('<I')
+MAX_MESSAGE = 1 << 20
+MSG_FRAME = 1
+MSG_PALETTE = 2
+MSG_INPUT = 3
+# Type, frame number, last input sequence applied, background, rectangles
+FRAME = struct.Struct('<BIIBH')
+# x, y, width, height, RLE byte count
+RECT = struct.Struct('<HHHHI')
+# Type, sequence, pad 1, pad 2
+INPUT = struct.Struct('<BIHH')
+WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+# Round trip bucket upper bounds in milliseconds
+LATENCY_BOUNDS = (1, 2, 5, 10, 17, 25, 34, 50, 75, 100, 200, 500, 1000)
+
+def rle_encode(pixels):
+    """Run-length encode 4 bit colour indices, one byte per run
+
+    Each byte holds the run length less one in its high nibble and the
+    colour in its low nibble, so runs longer than 16 are split.
+    """
+    flat = np.ascontiguousarray(pixels, dtype=np.uint8).ravel()
+    if not len(flat):
+        return b''
+    starts = np.flatnonzero(np.diff(flat)) + 1
+    starts = np.concatenate(([0], starts))
+    lengths = np.diff(np.append(starts, len(flat)))
+    pieces = (lengths + 15) // 16
+    runs = np.full(pieces.sum(), 16, dtype=np.int64)
+    runs[np.cumsum(pieces) - 1] = lengths - 16 * (pieces - 1)
+    values = np.repeat(flat[starts], pieces)
+    return (((runs - 1) << 4) | values).astype(np.uint8).tobytes()
+
+def rle_decode(data):
+    """Return the flat colour indices of rle_encode output"""
+    data = np.frombuffer(data, dtype=np.uint8)
+    return np.repeat(data & 0xF, (data >> 4).astype(np.int64) + 1)
+
+def encode_frame(frame, input_seq, background, regions):
+    """Return a frame message for (x, y, pixels) regions"""
+    parts = [FRAME.pack(MSG_FRAME, frame, input_seq, background,
+        len(regions))]
+    for x_pos, y_pos, pixels in regions:
+        data = rle_encode(pixels)
+        height, width = pixels.shape
+        parts.append(RECT.pack(x_pos, y_pos, width, height, len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+class TCPChannel(object):
+    """Length prefixed messages over a stream"""
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def backlog(self):
+        """Bytes queued in the transport, not yet taken by the socket"""
+        return self.writer.transport.get_write_buffer_size()
+
+    def send(self, payload):
+        """Queue one message"""
+        self.writer.write(LENGTH.pack(len(payload)) + payload)
+
+    async def receive(self):
+        """Return the next message, or None at end of stream"""
+        try:
+            size, = LENGTH.unpack(await self.reader.readexactly(4))
+        except asyncio.IncompleteReadError:
+            return None
+        if size > MAX_MESSAGE:
+            raise ValueError("message of %i bytes" % size)
+        return await self.reader.readexactly(size)
+
+class WebSocketChannel(TCPChannel):
+    """Binary WebSocket messages over an upgraded HTTP connection"""
+    def send(self, payload, opcode=0x2):
+        """Queue one unmasked, unfragmented frame"""
+        size = len(payload)
+        if size < 126:
+            header = struct.pack('!BB', 0x80 | opcode, size)
+        elif size < 1 << 16:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, size)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, size)
+        self.writer.write(header + payload)
+
+    async def receive(self):
+        """Return the next data message, or None once closed
+
+        Fragmented messages are joined. Control frames may arrive between
+        their fragments; a continuation without a first fragment, or a new
+        message before the last one's final fragment, closes with 1002.
+        """
+        reader = self.reader
+        fragments = None
+        total = 0
+        while True:
+            try:
+                first, second = await reader.readexactly(2)
+            except asyncio.IncompleteReadError:
+                return None
+            size = second & 0x7F
+            if size == 126:
+                size, = struct.unpack('!H', await reader.readexactly(2))
+            elif size == 127:
+                size, = struct.unpack('!Q', await reader.readexactly(8))
+            if size > MAX_MESSAGE:
+                raise ValueError("message of %i bytes" % size)
+            mask = await reader.readexactly(4) if second & 0x80 else None
+            payload = await reader.readexactly(size)
+            if mask is not None:
+                payload = (np.frombuffer(payload, dtype=np.uint8)
+                    ^ np.resize(np.frombuffer(mask, dtype=np.uint8),
+                    size)).tobytes()
+            opcode = first & 0xF
+            if opcode == 0x8:
+                self.send(payload[:2], 0x8)
+                return None
+            if opcode == 0x9:
+                self.send(payload, 0xA)
+                continue
+            if opcode not in (0x0, 0x1, 0x2):
+                continue
+            if (opcode == 0x0) != (fragments is not None):
+                self.send(struct.pack('!H', 1002), 0x8)
+                return None
+            if fragments is None:
+                fragments = []
+            total += size
+            if total > MAX_MESSAGE:
+                raise ValueError("message of %i bytes" % total)
+            fragments.append(payload)
+            if first & 0x80:
+                return b''.join(fragments)
+
+class Viewer(object):
+    """Frame listener pushing each frame's changes to one client
+
+    While the transport holds more than high_water unsent bytes, frames
+    are dropped. The dirty rectangles keep accumulating in the GPU, so
+    the next frame sent carries every change since the last one sent.
+
+    Deltas come from GPU.frame_delta, which clears the GPU's dirty state,
+    so a VM can only have one Viewer (or other frame_delta consumer).
+    """
+    def __init__(self, channel, high_water=1 << 16):
+        self.channel = channel
+        self.high_water = high_water
+        self.input_seq = 0
+        self.sent = 0
+        self.dropped = 0
+        self.bytes_sent = 0
+        self._palette = None
+
+    def __call__(self, vmac):
+        if self.channel.backlog() > self.high_water:
+            self.dropped += 1
+            return
+        gpu = vmac.gpu
+        palette = (gpu.palette.version, id(gpu.palette))
+        if palette != self._palette:
+            self._palette = palette
+            message = bytes([MSG_PALETTE]) + gpu.palette.colors.tobytes()
+            self.channel.send(message)
+            self.bytes_sent += len(message)
+        background, regions = gpu.frame_delta()
+        message = encode_frame(vmac.frame_count, self.input_seq, background,
+            regions)
+        self.channel.send(message)
+        self.sent += 1
+        self.bytes_sent += len(message)
+
+class PlayServer(object):
+    """Serve one paced VM running rom per connection
+
+    Raw TCP clients send MAGIC then length prefixed messages. Browsers
+    fetch a built-in player page over HTTP and connect by WebSocket on the
+    same port. Clients receive a palette message and then a frame message
+    every frame, and send input messages to set the controllers.
+    """
+    def __init__(self, rom, host='127.0.0.1', port=0, seed=0,
+            frame_rate=60, high_water=1 << 16):
+        self.rom = rom
+        self.host = host
+        self.port = port
+        self.seed = seed
+        self.high_water = high_water
+        self.manager = SessionManager(frame_rate)
+        self.viewers = {}
+        self._names = count()
+        self._server = None
+        self._handlers = set()
+
+    async def start(self):
+        """Start listening, setting port if it was 0"""
+        self._server = await asyncio.start_server(self._handle, self.host,
+            self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        """Stop listening, end every session and drop its connection"""
+        self._server.close()
+        for viewer in self.viewers.values():
+            viewer.channel.writer.close()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self.manager.close()
+        await self._server.wait_closed()
+
+    async def serve_forever(self):
+        """Start if needed and serve until cancelled"""
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()
+
+    def stats(self):
+        """Return per-session counters including frames sent and dropped"""
+        stats = self.manager.stats()
+        for name, viewer in self.viewers.items():
+            stats[name].update(sent=viewer.sent, dropped=viewer.dropped,
+                bytes_sent=viewer.bytes_sent)
+        return stats
+
+    async def _handle(self, reader, writer):
+        """Run a session for one connection"""
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        try:
+            head = await reader.readexactly(4)
+            if head == b'GET ':
+                channel = await self._http(reader, writer)
+            elif head == MAGIC:
+                channel = TCPChannel(reader, writer)
+            else:
+                channel = None
+            if channel is not None:
+                await self._play(channel)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+            self._handlers.discard(handler)
+
+    async def _http(self, reader, writer):
+        """Answer a GET with the player page or a WebSocket upgrade"""
+        request = await reader.readuntil(b'\r\n\r\n')
+        headers = {}
+        for line in request.split(b'\r\n')[1:]:
+            name, _, value = line.partition(b':')
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get(b'sec-websocket-key')
+        if headers.get(b'upgrade', b'').lower() != b'websocket' or not key:
+            body = PLAYER_PAGE.encode()
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n'
+                b'Content-Length: %i\r\nConnection: close\r\n\r\n' % len(body)
+                + body)
+            await writer.drain()
+            return None
+        accept = b64encode(sha1(key + WS_GUID).digest())
+        writer.write(b'HTTP/1.1 101 Switching Protocols\r\n'
+            b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        return WebSocketChannel(reader, writer)
+
+    async def _play(self, channel):
+        """Attach a new session to channel and apply its input messages"""
+        name = next(self._names)
+        session = self.manager.add(self.rom, self.seed, name)
+        viewer = Viewer(channel, self.high_water)
+        session.vm.add_frame_listener(viewer)
+        self.viewers[name] = viewer
+        try:
+            while True:
+                message = await channel.receive()
+                if message is None:
+                    break
+                if message[:1] == bytes([MSG_INPUT]) \
+                        and len(message) == INPUT.size:
+                    _, seq, pad1, pad2 = INPUT.unpack(message)
+                    session.controllers = (pad1, pad2)
+                    viewer.input_seq = seq
+        finally:
+            del self.viewers[name]
+            await self.manager.remove(name)
+
+class PlayClient(object):
+    """TCP client rebuilding the screen and timing input round trips
+
+    The latency of an input is the time from sending it to receiving the
+    first frame that has applied it.
+    """
+    def __init__(self):
+        self.framebuffer = np.zeros((SCREEN_HEIGHT, SCREEN_WIDTH),
+            dtype=np.uint8)
+        self.background = 0
+        self.colors = Palette().colors
+        self.frame = None
+        self.frames = 0
+        self.skipped = 0
+        self.bytes_received = 0
+        self.latency = Histogram(LATENCY_BOUNDS)
+        self._seq = 0
+        self._pending = {}
+        self._channel = None
+
+    async def connect(self, host, port):
+        """Open a raw TCP connection to a PlayServer"""
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(MAGIC)
+        self._channel = TCPChannel(reader, writer)
+        return self
+
+    def send_input(self, pad1, pad2=0):
+        """Send controller state, returning its sequence number"""
+        self._seq += 1
+        self._pending[self._seq] = perf_counter()
+        self._channel.send(INPUT.pack(MSG_INPUT, self._seq, pad1, pad2))
+        return self._seq
+
+    async def receive(self):
+        """Apply the next message, returning its type or None at the end"""
+        message = await self._channel.receive()
+        if message is None:
+            return None
+        self.bytes_received += len(message) + LENGTH.size
+        kind = message[0]
+        if kind == MSG_PALETTE:
+            self.colors = np.frombuffer(message[1:], dtype=np.uint8) \
+                .reshape(16, 3)
+        elif kind == MSG_FRAME:
+            self._frame(message)
+        return kind
+
+    def _frame(self, message):
+        """Apply a frame message to framebuffer"""
+        _, frame, input_seq, background, rects = FRAME.unpack_from(message)
+        offset = FRAME.size
+        for _ in range(rects):
+            x_pos, y_pos, width, height, size = RECT.unpack_from(message,
+                offset)
+            offset += RECT.size
+            pixels = rle_decode(message[offset:offset + size])
+            offset += size
+            self.framebuffer[y_pos:y_pos + height, x_pos:x_pos + width] = \
+                pixels.reshape(height, width)
+        self.background = background
+        if self.frame is not None and frame > self.frame + 1:
+            self.skipped += frame - self.frame - 1
+        self.frame = frame
+        self.frames += 1
+        now = perf_counter()
+        for seq in [seq for seq in self._pending if seq <= input_seq]:
+            self.latency.add((now - self._pending.pop(seq)) * 1000)
+
+    async def close(self):
+        """Close the connection"""
+        self._channel.writer.close()
+        await self._channel.writer.wait_closed()
+
+    async def play(self, seconds, input_rate=10):
+        """Receive frames for seconds, sending input_rate inputs a second"""
+        loop = asyncio.get_running_loop()
+        end = loop.time() + seconds
+        next_input = loop.time()
+        pad = 0
+        while loop.time() < end:
+            if loop.time() >= next_input:
+                pad = (pad + 1) & 0xFF
+                self.send_input(pad)
+                next_input += 1.0 / input_rate
+            try:
+                kind = await asyncio.wait_for(self.receive(),
+                    max(end - loop.time(), 0))
+            except asyncio.TimeoutError:
+                break
+            if kind is None:
+                break
+        return self
+
+async def load_test(host, port, sessions, seconds, input_rate=10):
+    """Play sessions clients at once, returning them"""
+    clients = [await PlayClient().connect(host, port)
+        for _ in range(sessions)]
+    await asyncio.gather(*[client.play(seconds, input_rate)
+        for client in clients])
+    for client in clients:
+        await client.close()
+    return clients
+
+def summarise(clients, seconds):
+    """Return a one line report of a load test"""
+    latency = Histogram(LATENCY_BOUNDS)
+    frames = skipped = received = 0
+    for client in clients:
+        latency.merge(client.latency)
+        frames += client.frames
+        skipped += client.skipped
+        received += client.bytes_received
+    sessions = max(len(clients), 1)
+    return ("%i sessions: %.1f fps each, %i frames skipped, %.1f KiB/s "
+        "each, input latency mean %.1f p50 %.1f p99 %.1f max %.1f ms" % (
+        len(clients), frames / float(sessions) / seconds, skipped,
+        received / 1024.0 / sessions / seconds, latency.mean,
+        latency.percentile(50), latency.percentile(99), latency.max))
+
+PLAYER_PAGE = """<!DOCTYPE html>
+<html><head><title>pchip16</title>
+<style>body{background:#222;color:#ccc;font-family:sans-serif}
+canvas{width:640px;height:480px;image-rendering:pixelated}</style></head>
+<body><canvas id="screen" width="320" height="240"></canvas>
+<p>Arrows: d-pad, Shift: select, Enter: start, Z: A, X: B</p>
+<script>
+var KEYS = {ArrowUp: 1, ArrowDown: 2, ArrowLeft: 4, ArrowRight: 8,
+    Shift: 16, Enter: 32, z: 64, x: 128};
+var canvas = document.getElementById('screen');
+var context = canvas.getContext('2d');
+var image = context.createImageData(320, 240);
+var indices = new Uint8Array(320 * 240);
+var colors = new Uint8Array(48);
+var pad = 0, seq = 0;
+var socket = new WebSocket('ws://' + location.host + '/');
+socket.binaryType = 'arraybuffer';
+function send() {
+    var message = new DataView(new ArrayBuffer(9));
+    message.setUint8(0, 3);
+    message.setUint32(1, ++seq, true);
+    message.setUint16(5, pad, true);
+    socket.send(message.buffer);
+}
+function key(event, down) {
+    var bit = KEYS[event.key];
+    if (!bit) return;
+    event.preventDefault();
+    pad = down ? pad | bit : pad & ~bit;
+    send();
+}
+document.onkeydown = function (event) { key(event, true); };
+document.onkeyup = function (event) { key(event, false); };
+socket.onmessage = function (event) {
+    var view = new DataView(event.data);
+    var bytes = new Uint8Array(event.data);
+    if (bytes[0] == 2) { colors = bytes.slice(1, 49); return; }
+    var background = view.getUint8(9), rects = view.getUint16(10, true);
+    var offset = 12;
+    for (var rect = 0; rect < rects; rect++) {
+        var x = view.getUint16(offset, true), y = view.getUint16(offset + 2, true);
+        var width = view.getUint16(offset + 4, true);
+        var size = view.getUint32(offset + 8, true);
+        offset += 12;
+        var pixel = 0;
+        for (var end = offset + size; offset < end; offset++) {
+            var run = (bytes[offset] >> 4) + 1, value = bytes[offset] & 15;
+            for (; run > 0; run--, pixel++) {
+                indices[(y + Math.floor(pixel / width)) * 320 + x
+                    + pixel % width] = value;
+            }
+        }
+    }
+    var data = image.data;
+    for (var i = 0; i < indices.length; i++) {
+        var color = (indices[i] || background) * 3;
+        data[4 * i] = colors[color];
+        data[4 * i + 1] = colors[color + 1];
+        data[4 * i + 2] = colors[color + 2];
+        data[4 * i + 3] = 255;
+    }
+    context.putImageData(image, 0, 0);
+};
+</script></body></html>
+"""
@@ -0,0 +1,204 @@
+"""
+pchip16 server tests
+"""
+#pylint: disable=I0011,R0904
+
+import asyncio
+import struct
+import unittest
+from base64 import b64encode
+from hashlib import sha1
+
+import numpy as np
+
+from pchip16 import VM, ROM
+from pchip16.rom_tests import FILE_PATH
+from pchip16.server import (FRAME, MSG_FRAME, MSG_PALETTE, WS_GUID,
+    PlayClient, PlayServer, Viewer, encode_frame, rle_decode, rle_encode)
+
+class TestRLE(unittest.TestCase):
+    """Test 4bpp run-length encoding"""
+    def test_round_trip(self):
+        pixels = np.array([[1, 1, 2, 0, 0, 0], [15, 15, 15, 15, 3, 3]],
+            dtype=np.uint8)
+        data = rle_encode(pixels)
+        self.assertEqual(data, bytes([0x11, 0x02, 0x20, 0x3F, 0x13]))
+        self.assertEqual(rle_decode(data).tolist(), pixels.ravel().tolist())
+    def test_long_runs(self):
+        pixels = np.repeat(np.array([7, 0, 7], dtype=np.uint8), [40, 16, 1])
+        data = rle_encode(pixels)
+        self.assertEqual(data, bytes([0xF7, 0xF7, 0x77, 0xF0, 0x07]))
+        self.assertEqual(rle_decode(data).tolist(), pixels.tolist())
+    def test_empty(self):
+        self.assertEqual(rle_encode(np.zeros((0, 4), dtype=np.uint8)), b'')
+        self.assertEqual(len(rle_decode(b'')), 0)
+    def test_frame(self):
+        pixels = np.full((2, 3), 5, dtype=np.uint8)
+        message = encode_frame(9, 4, 2, [(10, 20, pixels)])
+        self.assertEqual(FRAME.unpack_from(message), (MSG_FRAME, 9, 4, 2, 1))
+
+class FakeChannel(object):
+    """Channel recording messages with a settable backlog"""
+    def __init__(self):
+        self.messages = []
+        self.queued = 0
+    def backlog(self):
+        return self.queued
+    def send(self, payload):
+        self.messages.append(payload)
+
+class TestViewer(unittest.TestCase):
+    """Test frame delivery and backpressure"""
+    def setUp(self):
+        with open(FILE_PATH, 'rb') as file_handle:
+            self.rom = ROM(file_handle)
+        self.vm = VM()
+        self.vm.load_rom(self.rom)
+        self.channel = FakeChannel()
+        self.viewer = Viewer(self.channel, high_water=100)
+    def test_palette_then_frames(self):
+        self.viewer(self.vm)
+        self.viewer(self.vm)
+        kinds = [message[0] for message in self.channel.messages]
+        self.assertEqual(kinds, [MSG_PALETTE, MSG_FRAME, MSG_FRAME])
+        self.assertEqual(self.viewer.sent, 2)
+    def test_drop_when_backlogged(self):
+        client = PlayClient()
+        self.vm.run_frame()
+        self.viewer(self.vm)
+        self.channel.queued = 1000
+        for _ in range(3):
+            self.vm.run_frame()
+            self.viewer(self.vm)
+        self.assertEqual(self.viewer.dropped, 3)
+        self.channel.queued = 0
+        self.vm.run_frame()
+        self.viewer(self.vm)
+        for message in self.channel.messages:
+            if message[0] == MSG_FRAME:
+                client._frame(message)
+        self.assertEqual(client.skipped, 3)
+        self.assertTrue(np.array_equal(client.framebuffer,
+            self.vm.gpu.framebuffer))
+
+class TestServer(unittest.TestCase):
+    """Test sessions over a real socket"""
+    def setUp(self):
+        with open(FILE_PATH, 'rb') as file_handle:
+            self.rom = ROM(file_handle)
+    def run_server(self, body):
+        async def run():
+            play = await PlayServer(self.rom, frame_rate=120).start()
+            try:
+                return await body(play)
+            finally:
+                await play.close()
+        return asyncio.run(asyncio.wait_for(run(), 10))
+    def test_frames_match(self):
+        async def body(play):
+            client = await PlayClient().connect(play.host, play.port)
+            while client.frame is None or client.frame < 10:
+                await client.receive()
+            await client.close()
+            return client
+        client = self.run_server(body)
+        expected = VM(0)
+        expected.load_rom(self.rom)
+        for _ in range(client.frame):
+            expected.run_frame()
+        self.assertTrue(np.array_equal(client.framebuffer,
+            expected.gpu.framebuffer))
+        self.assertEqual(client.background, expected.gpu.background)
+    def test_input_latency(self):
+        async def body(play):
+            client = await PlayClient().connect(play.host, play.port)
+            await client.receive()
+            client.send_input(0x81)
+            while client.latency.count == 0:
+                await client.receive()
+            controllers = play.manager.sessions[0].controllers
+            await client.close()
+            return client, controllers
+        client, controllers = self.run_server(body)
+        self.assertEqual(controllers, (0x81, 0))
+        self.assertEqual(client.latency.count, 1)
+    def test_websocket(self):
+        async def body(play):
+            reader, writer = await asyncio.open_connection(play.host,
+                play.port)
+            key = b64encode(b'0123456789abcdef')
+            writer.write(b'GET / HTTP/1.1\r\nHost: test\r\n'
+                b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                b'Sec-WebSocket-Key: ' + key + b'\r\n'
+                b'Sec-WebSocket-Version: 13\r\n\r\n')
+            response = await reader.readuntil(b'\r\n\r\n')
+            first, second = await reader.readexactly(2)
+            mask = b'\x01\x02\x03\x04'
+            payload = struct.pack('<BIHH', 3, 1, 8, 0)
+            masked = bytes(byte ^ mask[index % 4]
+                for index, byte in enumerate(payload))
+            writer.write(bytes([0x82, 0x80 | len(payload)]) + mask + masked)
+            await writer.drain()
+            session = play.manager.sessions[0]
+            while session.controllers != (8, 0):
+                await asyncio.sleep(0.01)
+            writer.close()
+            return response, key, first, second
+        response, key, first, second = self.run_server(body)
+        accept = b64encode(sha1(key + WS_GUID).digest())
+        self.assertIn(b'101 Switching Protocols', response)
+        self.assertIn(b'Sec-WebSocket-Accept: ' + accept, response)
+        self.assertEqual(first, 0x82)
+        self.assertEqual(second, 49)
+    @staticmethod
+    async def upgrade(play):
+        """Open a WebSocket connection, returning (reader, writer)"""
+        reader, writer = await asyncio.open_connection(play.host, play.port)
+        writer.write(b'GET / HTTP/1.1\r\nHost: test\r\n'
+            b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+            b'Sec-WebSocket-Key: ' + b64encode(b'0123456789abcdef') +
+            b'\r\nSec-WebSocket-Version: 13\r\n\r\n')
+        await reader.readuntil(b'\r\n\r\n')
+        return reader, writer
+    @staticmethod
+    def masked_frame(first, payload):
+        """Return a client frame with header byte first"""
+        mask = b'\x01\x02\x03\x04'
+        return bytes([first, 0x80 | len(payload)]) + mask + bytes(
+            byte ^ mask[index % 4] for index, byte in enumerate(payload))
+    def test_websocket_fragments(self):
+        async def body(play):
+            _, writer = await self.upgrade(play)
+            payload = struct.pack('<BIHH', 3, 1, 8, 0)
+            writer.write(self.masked_frame(0x02, payload[:3])
+                + self.masked_frame(0x89, b'ping')
+                + self.masked_frame(0x00, payload[3:6])
+                + self.masked_frame(0x80, payload[6:]))
+            await writer.drain()
+            session = play.manager.sessions[0]
+            while session.controllers != (8, 0):
+                await asyncio.sleep(0.01)
+            writer.close()
+            return session.controllers
+        self.assertEqual(self.run_server(body), (8, 0))
+    def test_websocket_stray_continuation(self):
+        async def body(play):
+            reader, writer = await self.upgrade(play)
+            writer.write(self.masked_frame(0x80, b'\x03'))
+            await writer.drain()
+            frames = await reader.read()
+            writer.close()
+            return frames
+        frames = self.run_server(body)
+        self.assertTrue(frames.endswith(b'\x88\x02\x03\xea'))
+    def test_player_page(self):
+        async def body(play):
+            reader, writer = await asyncio.open_connection(play.host,
+                play.port)
+            writer.write(b'GET / HTTP/1.1\r\nHost: test\r\n\r\n')
+            response = await reader.read()
+            writer.close()
+            return response
+        response = self.run_server(body)
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 OK'))
+        self.assertIn(b'<canvas', response)
@@ -0,0 +1,174 @@
+"""
+pchip16 session - real time VMs run cooperatively on an asyncio loop
+"""
+
+import asyncio
+from bisect import bisect_left
+from itertools import count
+
+from .vm import VM, ERRORS
+
+FRAME_RATE = 60
+# Frame interval bucket upper bounds in milliseconds, finest around 16.7
+FRAME_TIME_BOUNDS = (4, 8, 12, 15, 16, 16.5, 17, 17.5, 18, 20, 25, 34, 50,
+    100, 250)
+
+class Histogram(object):
+    """Counts of values falling at or below each of bounds, plus overflow"""
+    def __init__(self, bounds=FRAME_TIME_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        """Count one value"""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """Add the counts of other, which must have the same bounds"""
+        if other.bounds != self.bounds:
+            raise ValueError("histogram bounds differ")
+        self.counts = [mine + theirs for mine, theirs in
+            zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self):
+        """Mean of the values counted"""
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        """Return the bound of the bucket holding the percent-th value
+
+        Values past the last bound report the largest value seen.
+        """
+        if not self.count:
+            return 0.0
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for bound, number in zip(self.bounds, self.counts):
+            seen += number
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def as_dict(self):
+        """Return a JSON friendly summary"""
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'bounds': list(self.bounds),
+            'counts': list(self.counts),
+        }
+
+class Session(object):
+    """One VM paced at frame_rate on the running event loop
+
+    Frames are scheduled at fixed ticks from the start time, so timer
+    jitter does not accumulate. Frames ending over half a period after
+    their tick count as late, and a session more than a frame behind drops
+    the missed ticks, counting them in skipped, instead of running a burst
+    of frames to catch up. Network code sets controllers, which are
+    latched at the start of the next frame.
+    """
+    def __init__(self, vmac, name=None, frame_rate=FRAME_RATE):
+        self.vm = vmac
+        self.name = name
+        self.frame_rate = frame_rate
+        self.controllers = (0, 0)
+        self.frames = 0
+        self.late = 0
+        self.skipped = 0
+        self.error = None
+        self.frame_times = Histogram()
+
+    async def run(self, frames=None):
+        """Run frames frames, or until cancelled or the VM faults"""
+        loop = asyncio.get_running_loop()
+        period = 1.0 / self.frame_rate
+        tick = last = loop.time()
+        end = None if frames is None else self.frames + frames
+        while end is None or self.frames < end:
+            tick += period
+            try:
+                await self.vm.run_frame_async(self.controllers, until=tick)
+            except ERRORS as err:
+                self.error = err
+                break
+            now = loop.time()
+            self.frames += 1
+            self.frame_times.add((now - last) * 1000)
+            last = now
+            behind = now - tick
+            if behind > period / 2:
+                self.late += 1
+            if behind > period:
+                missed = int(behind / period)
+                self.skipped += missed
+                tick += missed * period
+
+    def stats(self):
+        """Return counters and the frame time histogram"""
+        return {
+            'name': self.name,
+            'frames': self.frames,
+            'late': self.late,
+            'skipped': self.skipped,
+            'error': None if self.error is None else repr(self.error),
+            'frame_times': self.frame_times.as_dict(),
+        }
+
+class SessionManager(object):
+    """Start, track and stop Sessions as tasks on the running loop"""
+    def __init__(self, frame_rate=FRAME_RATE):
+        self.frame_rate = frame_rate
+        self.sessions = {}
+        self._tasks = {}
+        self._names = count()
+
+    def add(self, rom, seed=0, name=None, frames=None):
+        """Start a session running rom and return it
+
+        Must be called with an event loop running.
+        """
+        if name is None:
+            name = next(self._names)
+        if name in self.sessions:
+            raise ValueError("session %r already exists" % (name,))
+        vmac = VM(seed)
+        vmac.load_rom(rom)
+        session = Session(vmac, name, self.frame_rate)
+        self.sessions[name] = session
+        self._tasks[name] = asyncio.ensure_future(session.run(frames))
+        return session
+
+    async def remove(self, name):
+        """Stop session name and forget it"""
+        task = self._tasks.pop(name)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return self.sessions.pop(name)
+
+    async def wait(self):
+        """Wait for every session with a frame limit to finish"""
+        await asyncio.gather(*self._tasks.values())
+
+    async def close(self):
+        """Stop every session"""
+        for name in list(self._tasks):
+            await self.remove(name)
+
+    def stats(self):
+        """Return each session's stats keyed by name"""
+        return dict((name, session.stats())
+            for name, session in self.sessions.items())
@@ -0,0 +1,116 @@
+"""
+pchip16 session tests
+"""
+#pylint: disable=I0011,R0904
+
+import asyncio
+import time
+import unittest
+from pchip16 import VM, ROM
+from pchip16.rom_tests import FILE_PATH
+from pchip16.session import Histogram, Session, SessionManager
+
+class TestHistogram(unittest.TestCase):
+    """Test frame time bucketing"""
+    def test_buckets(self):
+        histogram = Histogram((1, 2, 4))
+        for value in (0.5, 1, 1.5, 3, 10):
+            histogram.add(value)
+        self.assertEqual(histogram.counts, [2, 1, 1, 1])
+        self.assertEqual(histogram.mean, 3.2)
+        self.assertEqual(histogram.max, 10)
+        self.assertEqual(histogram.percentile(40), 1)
+        self.assertEqual(histogram.percentile(60), 2)
+        self.assertEqual(histogram.percentile(100), 10)
+    def test_merge(self):
+        first = Histogram((1, 2))
+        second = Histogram((1, 2))
+        first.add(0.5)
+        second.add(1.5)
+        second.add(3)
+        first.merge(second)
+        self.assertEqual((first.counts, first.count, first.max),
+            ([1, 1, 1], 3, 3))
+        self.assertRaises(ValueError, first.merge, Histogram((1,)))
+    def test_empty(self):
+        self.assertEqual(Histogram().percentile(99), 0.0)
+
+class TestSession(unittest.TestCase):
+    """Test paced frames on an event loop"""
+    def setUp(self):
+        with open(FILE_PATH, 'rb') as file_handle:
+            self.rom = ROM(file_handle)
+    def make_vm(self):
+        vmac = VM()
+        vmac.load_rom(self.rom)
+        return vmac
+    def test_run_frame_async(self):
+        vmac = self.make_vm()
+        expected = self.make_vm()
+        async def run():
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            await vmac.run_frame_async(until=start + 0.02)
+            return loop.time() - start
+        self.assertGreaterEqual(asyncio.run(run()), 0.019)
+        expected.run_frame()
+        self.assertEqual(vmac.state_hash(), expected.state_hash())
+    def test_pacing(self):
+        session = Session(self.make_vm(), frame_rate=200)
+        start = time.monotonic()
+        asyncio.run(session.run(20))
+        elapsed = time.monotonic() - start
+        self.assertEqual(session.frames, 20)
+        self.assertGreaterEqual(elapsed, 0.099)
+        self.assertEqual(session.frame_times.count, 20)
+        self.assertEqual(session.vm.frame_count, 20)
+    def test_fault_ends_session(self):
+        vmac = self.make_vm()
+        vmac.program_counter = 0xFFFE
+        session = Session(vmac)
+        asyncio.run(session.run(5))
+        self.assertIsInstance(session.error, IndexError)
+        self.assertEqual(session.frames, 0)
+    def test_skips_when_behind(self):
+        session = Session(self.make_vm(), frame_rate=1000)
+        real_run = session.vm.run_frame
+        def slow_run(*args):
+            time.sleep(0.005)
+            return real_run(*args)
+        session.vm.run_frame = slow_run
+        asyncio.run(session.run(5))
+        self.assertEqual(session.frames, 5)
+        self.assertGreater(session.skipped, 0)
+        self.assertGreater(session.late, 0)
+
+class TestSessionManager(unittest.TestCase):
+    """Test many sessions sharing one loop"""
+    def setUp(self):
+        with open(FILE_PATH, 'rb') as file_handle:
+            self.rom = ROM(file_handle)
+    def test_many_sessions(self):
+        manager = SessionManager(frame_rate=200)
+        async def run():
+            for seed in range(50):
+                manager.add(self.rom, seed, frames=10)
+            await manager.wait()
+        asyncio.run(run())
+        stats = manager.stats()
+        self.assertEqual(len(stats), 50)
+        self.assertEqual(set(stat['frames'] for stat in stats.values()),
+            set([10]))
+        self.assertEqual(stats[3]['frame_times']['count'], 10)
+    def test_remove(self):
+        manager = SessionManager()
+        async def run():
+            session = manager.add(self.rom, name='player')
+            self.assertRaises(ValueError, manager.add, self.rom,
+                name='player')
+            await asyncio.sleep(0.05)
+            removed = await manager.remove('player')
+            self.assertIs(removed, session)
+            self.assertGreater(session.frames, 0)
+            manager.add(self.rom)
+            await manager.close()
+        asyncio.run(run())
+        self.assertEqual(manager.stats(), {})
@@ -0,0 +1,160 @@
+"""
+pchip16 shared - VM state in shared memory for out-of-process observers
+"""
+
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from time import monotonic, sleep
+
+import numpy as np
+
+from .gpu import SCREEN_HEIGHT, SCREEN_WIDTH
+
+MAGIC = 0x36315350
+# Header words
+MAGIC_WORD = 0
+SEQUENCE = 1
+FRAME = 2
+PROGRAM_COUNTER = 3
+STACK_POINTER = 4
+FLAGS = 5
+BACKGROUND = 6
+HEADER_WORDS = 16
+# Byte offsets of each region in the block
+REGISTERS = HEADER_WORDS * 4
+PALETTE = REGISTERS + 32
+MEMORY = 256
+FRAMEBUFFER = MEMORY + 2**16
+SIZE = FRAMEBUFFER + SCREEN_WIDTH * SCREEN_HEIGHT
+
+def attach_block(name):
+    """Open block name without handing it to this process's tracker
+
+    Before Python 3.13 attaching registers the block, and a resource
+    tracker not shared with its creator would unlink it at exit.
+    """
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    private = resource_tracker._resource_tracker._fd is None
+    block = SharedMemory(name=name)
+    if private:
+        resource_tracker.unregister(block._name, 'shared_memory')
+    return block
+
+class SharedState(object):
+    """Views of one shared block holding a VM's memory, registers and frame
+
+    A VM shared through VM.share() runs on these views directly. The
+    sequence word is odd while a frame is running and even once it and the
+    header are complete, so observers attached by name read frames in place
+    with begin()/retry(), as with a seqlock.
+    """
+    def __init__(self, name=None, create=False):
+        if create:
+            self.block = SharedMemory(name=name, create=True, size=SIZE)
+        else:
+            self.block = attach_block(name)
+        self.owner = create
+        self.name = self.block.name
+        buf = self.block.buf
+        self.header = np.ndarray((HEADER_WORDS,), dtype=np.uint32,
+            buffer=buf)
+        if create:
+            self.header[MAGIC_WORD] = MAGIC
+        elif self.header[MAGIC_WORD] != MAGIC:
+            self.block.close()
+            raise ValueError("%s is not pchip16 state" % name)
+        self.registers = buf[REGISTERS:REGISTERS + 32].cast('H')
+        self.palette = np.ndarray((16, 3), dtype=np.uint8, buffer=buf,
+            offset=PALETTE)
+        self.mem = buf[MEMORY:MEMORY + 2**16]
+        self.framebuffer = np.ndarray((SCREEN_HEIGHT, SCREEN_WIDTH),
+            dtype=np.uint8, buffer=buf, offset=FRAMEBUFFER)
+
+    @property
+    def sequence(self):
+        """The seqlock word, odd while the VM is mid-frame"""
+        return int(self.header[SEQUENCE])
+
+    @property
+    def frame_count(self):
+        """Frames completed by the VM"""
+        return int(self.header[FRAME])
+
+    def begin_write(self):
+        """Mark the state as changing"""
+        self.header[SEQUENCE] += 1
+
+    def end_write(self, vmac):
+        """Publish vmac's scalar state and mark the frame complete"""
+        header = self.header
+        header[FRAME] = vmac.frame_count
+        header[PROGRAM_COUNTER] = vmac.program_counter
+        header[STACK_POINTER] = vmac.stack_pointer
+        header[FLAGS] = vmac.flags
+        header[BACKGROUND] = vmac.gpu.background
+        self.palette[:] = vmac.gpu.palette.colors
+        header[SEQUENCE] += 1
+
+    def begin(self):
+        """Wait for a complete frame and return its sequence for retry()"""
+        header = self.header
+        while True:
+            sequence = int(header[SEQUENCE])
+            if not sequence & 1:
+                return sequence
+            sleep(0)
+
+    def retry(self, sequence):
+        """Return True if the state changed since begin() returned sequence"""
+        return int(self.header[SEQUENCE]) != sequence
+
+    def wait(self, frame, timeout=None, interval=0.001):
+        """Wait until frame_count reaches frame, returning False on timeout"""
+        end = None if timeout is None else monotonic() + timeout
+        while self.frame_count < frame:
+            if end is not None and monotonic() >= end:
+                return False
+            sleep(interval)
+        return True
+
+    def snapshot(self):
+        """Return a consistent copy of the state as a dict"""
+        while True:
+            sequence = self.begin()
+            header = self.header
+            state = {
+                'frame_count': int(header[FRAME]),
+                'program_counter': int(header[PROGRAM_COUNTER]),
+                'stack_pointer': int(header[STACK_POINTER]),
+                'flags': int(header[FLAGS]),
+                'background': int(header[BACKGROUND]),
+                'registers': self.registers.tolist(),
+                'palette': self.palette.copy(),
+                'mem': self.mem.tobytes(),
+                'framebuffer': self.framebuffer.copy(),
+            }
+            if not self.retry(sequence):
+                return state
+
+    def close(self):
+        """Release the views, unlinking the block if this process made it
+
+        Every other view of the block, such as a VM still sharing it, must
+        be dropped first.
+        """
+        self.registers.release()
+        self.mem.release()
+        del self.header, self.palette, self.framebuffer
+        del self.registers, self.mem
+        self.block.close()
+        if self.owner:
+            self.block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
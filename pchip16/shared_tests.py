@@ -0,0 +1,109 @@
+"""
+pchip16 shared tests
+"""
+#pylint: disable=I0011,R0904
+
+import pickle
+import unittest
+from multiprocessing import get_context
+from zlib import crc32
+
+import numpy as np
+
+from pchip16 import VM, ROM
+from pchip16.rom_tests import FILE_PATH
+from pchip16.shared import SharedState
+
+def _observe(name, frame, conn):
+    """Child process: wait for frame and send back a framebuffer CRC"""
+    with SharedState(name) as state:
+        state.wait(frame, timeout=10)
+        while True:
+            sequence = state.begin()
+            checksum = crc32(state.framebuffer)
+            frame_count = state.frame_count
+            if not state.retry(sequence):
+                break
+    conn.send((frame_count, checksum))
+
+class TestSharedVM(unittest.TestCase):
+    """Test a VM running on shared memory"""
+    def setUp(self):
+        with open(FILE_PATH, 'rb') as file_handle:
+            self.rom = ROM(file_handle)
+        self.vm = VM()
+        self.vm.load_rom(self.rom)
+        self.shared = self.vm.share()
+        self.expected = VM()
+        self.expected.load_rom(self.rom)
+    def tearDown(self):
+        self.vm.unshare()
+    def run_frames(self, frames):
+        for _ in range(frames):
+            self.vm.run_frame()
+            self.expected.run_frame()
+    def test_matches_private(self):
+        self.run_frames(20)
+        self.assertEqual(self.vm.state_hash(), self.expected.state_hash())
+        self.assertTrue(np.array_equal(self.shared.framebuffer,
+            self.expected.gpu.framebuffer))
+        self.assertEqual(self.vm.mem.rehash(), self.expected.mem.rehash())
+    def test_attach(self):
+        self.run_frames(5)
+        with SharedState(self.shared.name) as state:
+            snapshot = state.snapshot()
+            self.assertEqual(snapshot['frame_count'], 5)
+            self.assertEqual(snapshot['program_counter'],
+                self.expected.program_counter)
+            self.assertEqual(snapshot['registers'],
+                self.expected.register.tolist())
+            self.assertEqual(snapshot['mem'],
+                self.expected.mem._mem.tobytes())
+            self.assertTrue(np.array_equal(snapshot['framebuffer'],
+                self.expected.gpu.framebuffer))
+            self.assertTrue(np.array_equal(snapshot['palette'],
+                self.expected.gpu.palette.colors))
+    def test_sequence(self):
+        sequences = []
+        self.vm.mem.add_write_hook(0, 2**16,
+            lambda start, stop: sequences.append(self.shared.sequence))
+        before = self.shared.begin()
+        self.vm.run_frame()
+        self.assertTrue(all(sequence & 1 for sequence in sequences))
+        self.assertTrue(self.shared.retry(before))
+        self.assertEqual(self.shared.sequence, before + 2)
+    def test_fault_ends_frame(self):
+        self.vm.program_counter = 0xFFFE
+        self.assertRaises(IndexError, self.vm.run_frame)
+        self.assertFalse(self.shared.sequence & 1)
+    def test_pickle_private(self):
+        self.run_frames(3)
+        copy = pickle.loads(pickle.dumps(self.vm, 5))
+        self.assertIsNone(copy.shared)
+        self.assertEqual(copy.state_hash(), self.vm.state_hash())
+        copy.run_frame()
+        self.assertEqual(self.shared.frame_count, 3)
+    def test_unshare(self):
+        self.run_frames(3)
+        self.vm.unshare()
+        self.run_frames(3)
+        self.assertIsNone(self.vm.shared)
+        self.assertEqual(self.vm.state_hash(), self.expected.state_hash())
+        self.vm.share()
+    def test_other_process(self):
+        context = get_context('spawn')
+        parent, child = context.Pipe()
+        process = context.Process(target=_observe,
+            args=(self.shared.name, 10, child))
+        process.start()
+        self.run_frames(10)
+        frame_count, checksum = parent.recv()
+        process.join()
+        self.assertEqual(frame_count, 10)
+        self.assertEqual(checksum, crc32(self.expected.gpu.framebuffer))
+    def test_not_state(self):
+        state = SharedState(self.shared.name)
+        state.header[0] = 0
+        state.close()
+        self.assertRaises(ValueError, SharedState, self.shared.name)
+        self.shared.header[0] = 0x36315350
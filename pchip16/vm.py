@@ -7,10 +7,33 @@ ZERO = 0x1 << 2
 OVERFLOW = 0x1 << 6
 NEGATIVE = 0x1 << 7
 
-from random import randint
+CYCLES_PER_FRAME = 1000000 // 60
+CONTROLLER_1 = 0xFFF0
+CONTROLLER_2 = 0xFFF2
+# VM method handling each instruction family, by op_code >> 28
+INSTRUCTIONS = ('misc', 'jump', 'load', 'store', 'add', 'sub', 'bit_and',
+    'bit_or', 'bit_xor', 'mul', 'div', 'shift', 'stack', 'palette')
+# Exceptions VM.execute raises when the running program faults
+ERRORS = (ValueError, IndexError, ZeroDivisionError, NotImplementedError)
+
+from array import array
+from asyncio import get_running_loop, sleep
+from copyreg import __newobj__
+from hashlib import blake2b
+from struct import pack
+from .audio import Audio, TONES
+from .gpu import GPU, SpriteCache
 from .memory import Memory, Register
+from .shared import SharedState
 from .utils import is_neg, complement, to_dec, to_hex
 
+def seed_state(seed):
+    """Return a non-zero xorshift32 state mixed from integer seed"""
+    value = (seed * 0x9E3779B9 + 0x7F4A7C15) & 0xFFFFFFFF
+    value = ((value ^ (value >> 16)) * 0x85EBCA6B) & 0xFFFFFFFF
+    value = ((value ^ (value >> 13)) * 0xC2B2AE35) & 0xFFFFFFFF
+    return (value ^ (value >> 16)) or 0x6D2B79F5
+
 def mask_code(op_code, mask):
     """Raise error for op_codes in mask"""
     if op_code & mask:
@@ -21,36 +44,236 @@ class VM(object):
     program_counter = 0
     stack_pointer = 0xFDF0
     flags = 0
-    mem = Memory()
-    register = Register()
-
-    def __init__(self):
-        for reg in range(0xf):
-            self.register[reg] = 0
+    frame_count = 0
+    vblank_wait = False
+    controllers = (0, 0)
+    shared = None
+    coverage = None
+    debugger = None
+
+    def __init__(self, seed=0):
+        self.rng_state = seed_state(seed)
+        self.mem = Memory()
+        self.register = Register()
+        self.gpu = GPU()
+        self.audio = Audio()
+        self.sprite_cache = SpriteCache(self.mem)
+        self.frame_listeners = []
+
+    def __reduce_ex__(self, protocol):
+        """Pickle per-instance state, including the memory buffer"""
+        state = dict(self.__dict__)
+        state.update(program_counter=self.program_counter,
+            stack_pointer=self.stack_pointer, flags=self.flags)
+        del state['sprite_cache'], state['frame_listeners']
+        state.pop('debugger', None)
+        if self.shared is not None:
+            # Unpickles as a private copy
+            del state['shared']
+            state['register'] = Register(self.register.tobytes())
+        return (__newobj__, (self.__class__,), state)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.sprite_cache = SpriteCache(self.mem)
+        self.frame_listeners = []
+
+    def add_frame_listener(self, listener):
+        """Call listener(vm) at the end of every run_frame"""
+        self.frame_listeners.append(listener)
+
+    def remove_frame_listener(self, listener):
+        """Stop calling listener"""
+        self.frame_listeners.remove(listener)
+
+    def share(self, name=None):
+        """Move memory, registers and framebuffer into shared memory
+
+        Returns the SharedState; observers attach with SharedState(name).
+        Each run_frame is bracketed by its sequence word, so observers see
+        the state as of the end of a frame. Changes made outside run_frame
+        are published by the next frame.
+        """
+        shared = SharedState(name, create=True)
+        shared.mem[:] = self.mem._mem
+        shared.registers[:] = self.register
+        shared.framebuffer[:] = self.gpu.framebuffer
+        self.mem._mem = shared.mem
+        self.register = shared.registers
+        self.gpu.framebuffer = shared.framebuffer
+        shared.begin_write()
+        shared.end_write(self)
+        self.shared = shared
+        return shared
+
+    def unshare(self):
+        """Copy state back to private buffers and release the shared block"""
+        shared = self.shared
+        if shared is None:
+            return
+        self.mem._mem = array('B', shared.mem.tobytes())
+        self.register = Register(shared.registers.tobytes())
+        self.gpu.framebuffer = shared.framebuffer.copy()
+        del self.shared
+        shared.close()
+
+    def seed(self, seed):
+        """Restart the RND generator from integer seed"""
+        self.rng_state = seed_state(seed)
 
     def step(self):
         """Execute instruction at self.program_counter and increment"""
         self.program_counter += 1
 
+    def fetch(self):
+        """Return the op code stored at self.program_counter"""
+        mem = self.mem._mem
+        addr = self.program_counter
+        return (mem[addr] << 24) | (mem[addr + 1] << 16) \
+            | (mem[addr + 2] << 8) | mem[addr + 3]
+
+    def cycle(self):
+        """Fetch, advance past and execute a single instruction"""
+        op_code = self.fetch()
+        self.program_counter += 4
+        self.execute(op_code)
+
+    def run(self, cycles):
+        """Execute up to cycles instructions, stopping after a VBLNK
+
+        Returns the number of instructions executed. With a Coverage set
+        as coverage, execution is recorded into it. While a Debugger has
+        breakpoints or watchpoints set, its loop runs instead.
+        """
+        if self.debugger is not None:
+            return self.debugger.run(cycles)
+        if self.coverage is not None:
+            return self._run_covered(cycles)
+        fetch = self.fetch
+        execute = self.execute
+        self.vblank_wait = False
+        for count in range(cycles):
+            op_code = fetch()
+            self.program_counter += 4
+            execute(op_code)
+            if self.vblank_wait:
+                return count + 1
+        return cycles
+
+    def _run_covered(self, cycles):
+        """run() marking executed addresses and taken edges in coverage"""
+        fetch = self.fetch
+        execute = self.execute
+        executed = self.coverage.executed
+        edges = self.coverage.edges
+        self.vblank_wait = False
+        for count in range(cycles):
+            addr = self.program_counter
+            executed[addr >> 3] |= 1 << (addr & 7)
+            op_code = fetch()
+            self.program_counter = following = addr + 4
+            execute(op_code)
+            if self.program_counter != following:
+                # edge_index(addr, self.program_counter)
+                edge = ((addr >> 1) ^ self.program_counter) & 0xFFFF
+                edges[edge >> 3] |= 1 << (edge & 7)
+            if self.vblank_wait:
+                return count + 1
+        return cycles
+
+    def run_frame(self, controllers=(0, 0), present=True):
+        """Latch controller state and run one 60 Hz frame
+
+        If present, the frame's audio is rendered and frame listeners are
+        called once the frame completes; neither affects the machine state.
+        Returns the number of instructions executed.
+        """
+        self.controllers = controllers
+        shared = self.shared
+        if shared is not None:
+            shared.begin_write()
+        try:
+            self.mem[CONTROLLER_1], self.mem[CONTROLLER_2] = controllers
+            count = self.run(CYCLES_PER_FRAME)
+            self.frame_count += 1
+        finally:
+            if shared is not None:
+                shared.end_write(self)
+        if present:
+            self.audio.render()
+            for listener in self.frame_listeners:
+                listener(self)
+        return count
+
+    async def run_frame_async(self, controllers=(0, 0), present=True,
+            until=None):
+        """run_frame, then yield to the event loop
+
+        With until, a time on the running loop's monotonic clock, sleep
+        until then before returning, otherwise yield just once.
+        """
+        count = self.run_frame(controllers, present)
+        delay = 0
+        if until is not None:
+            delay = max(until - get_running_loop().time(), 0)
+        await sleep(delay)
+        return count
+
+    def reset(self):
+        """Return everything but memory and the RNG to power-on
+
+        Registers, pc, sp, flags, frame count and controllers are cleared,
+        along with the GPU, palette and audio state.
+        """
+        for reg in range(16):
+            self.register[reg] = 0
+        self.program_counter = VM.program_counter
+        self.stack_pointer = VM.stack_pointer
+        self.flags = VM.flags
+        self.frame_count = VM.frame_count
+        self.controllers = VM.controllers
+        self.vblank_wait = False
+        self.gpu.reset()
+        self.audio.reset()
+
+    def load_rom(self, rom):
+        """Copy rom into memory and jump to its start address"""
+        self.mem.fromstring(rom.data)
+        self.program_counter = rom.start_address
+
+    def state_hash(self):
+        """Return a 64 bit hash of memory, registers, pc, sp, flags and RNG
+
+        Memory is hashed incrementally on write from the first call on, the
+        remaining 48 bytes of state are folded in here, so the cost does not
+        depend on memory size.
+        """
+        digest = blake2b(self.register.tobytes(), digest_size=8)
+        digest.update(pack('<4I', self.program_counter, self.stack_pointer,
+            self.flags, self.rng_state))
+        return self.mem.state_hash() ^ int.from_bytes(digest.digest(),
+            'little')
+
+    def find_loop(self, max_cycles, visited=None):
+        """Run until a state repeats, returning the cycles executed
+
+        Returns None if no state repeated within max_cycles. Pass a shared
+        visited set to deduplicate states across several runs.
+        """
+        if visited is None:
+            visited = set()
+        for count in range(max_cycles):
+            state = self.state_hash()
+            if state in visited:
+                return count
+            visited.add(state)
+            self.cycle()
+        return None
+
     def execute(self, op_code):
         """Carry out instruction specified by op_code"""
-        instructions = [
-            self.misc,
-            self.jump,
-            self.load, 
-            self.store,
-            self.add,
-            self.sub,
-            self.bit_and,
-            self.bit_or,
-            self.bit_xor,
-            self.mul,
-            self.div,
-            self.shift,
-            self.stack,
-        ]
         try:
-            instruction = instructions[op_code >> 28]
+            instruction = getattr(self, INSTRUCTIONS[op_code >> 28])
             instruction(op_code)
         except IndexError:
             raise ValueError("Invalid opcode %i" %(op_code >> 28))
@@ -59,6 +282,36 @@ class VM(object):
         if op_code == 0x00000000:
             #"""Do nothing"""
             pass
+        elif op_code == 0x01000000:
+            #"""CLS"""
+            self.gpu.clear()
+        elif op_code == 0x02000000:
+            #"""VBLNK"""
+            self.vblank_wait = True
+        elif op_code >> 24 == 0x03:
+            #"""BGC N"""
+            mask_code(op_code, 0xFFF0FF)
+            self.gpu.background = (op_code >> 8) & 0xF
+        elif op_code >> 16 == 0x0400:
+            #"""SPR HHLL"""
+            self.gpu.set_sprite((op_code >> 8) & 0xFF, op_code & 0xFF)
+        elif op_code >> 24 == 0x05:
+            #"""DRW RX, RY, HHLL"""
+            y_reg = (op_code >> 20) & 0xF
+            x_reg = (op_code >> 16) & 0xF
+            addr = ((op_code & 0xFF) << 8) + ((op_code >> 8) & 0xFF)
+            self._draw(x_reg, y_reg, addr)
+        elif op_code >> 24 == 0x06:
+            #"""DRW RX, RY, RZ"""
+            mask_code(op_code, 0xF0FF)
+            y_reg = (op_code >> 20) & 0xF
+            x_reg = (op_code >> 16) & 0xF
+            z_reg = (op_code >> 8) & 0xF
+            self._draw(x_reg, y_reg, self.register[z_reg])
+        elif op_code >> 8 == 0x080000:
+            #"""FLIP H, V"""
+            mask_code(op_code, 0xFC)
+            self.gpu.set_flip(op_code & 0x2, op_code & 0x1)
         elif op_code >> 20 == 0x070:
             #"""RND RX, HHLL"""
             x_reg = (op_code >> 16) & 0xF
@@ -66,7 +319,40 @@ class VM(object):
             ll_addr = (op_code - hh_addr - (op_code >> 16 << 16) ) >> 8
 
             rand_max = self.mem[(hh_addr << 8) & ll_addr]
-            self.register[x_reg] = randint(0, rand_max)
+            # xorshift32, scaled to 0..rand_max
+            state = self.rng_state
+            state ^= (state << 13) & 0xFFFFFFFF
+            state ^= state >> 17
+            state ^= (state << 5) & 0xFFFFFFFF
+            self.rng_state = state
+            self.register[x_reg] = (state * (rand_max + 1)) >> 32
+        elif op_code == 0x09000000:
+            #"""SND0"""
+            self.audio.stop()
+        elif 0x0A <= op_code >> 24 <= 0x0C:
+            #"""SND1-3 HHLL"""
+            mask_code(op_code, 0xFF0000)
+            imm = ((op_code & 0xFF) << 8) + ((op_code >> 8) & 0xFF)
+            self.audio.tone(TONES[(op_code >> 24) - 0x0A], imm)
+        elif op_code >> 24 == 0x0D:
+            #"""SNP RX, HHLL"""
+            mask_code(op_code, 0xF00000)
+            x_reg = (op_code >> 16) & 0xF
+            imm = ((op_code & 0xFF) << 8) + ((op_code >> 8) & 0xFF)
+            self.audio.play(self.mem[self.register[x_reg]], imm)
+        elif op_code >> 24 == 0x0E:
+            #"""SNG AD, VTSR"""
+            self.audio.configure((op_code >> 20) & 0xF, (op_code >> 16) & 0xF,
+                (op_code >> 4) & 0xF, op_code & 0xF, (op_code >> 12) & 0xF,
+                (op_code >> 8) & 0x3)
+
+    def _draw(self, x_reg, y_reg, addr):
+        """Draw the current sprite from addr, CARRY flags a collision"""
+        if self.gpu.draw(self.mem._mem, self.register[x_reg],
+                self.register[y_reg], addr, self.sprite_cache):
+            self.flags |= CARRY
+        else:
+            self.flags &= ~CARRY
 
     # pylint: disable-msg=I0011,R0911
     def cond_jump(self, branch_type):
@@ -668,6 +954,20 @@ class VM(object):
         else:
             raise ValueError("Invalid opcode")
 
+    def palette(self, op_code):
+        """Palette loads"""
+        if op_code >> 16 == 0xD000:
+            #"""PAL HHLL"""
+            addr = ((op_code & 0xFF) << 8) + ((op_code >> 8) & 0xFF)
+            self.gpu.palette.load(self.mem._mem, addr)
+        elif op_code >> 20 == 0xD10:
+            #"""PAL RX"""
+            mask_code(op_code, 0xFFFF)
+            x_reg = (op_code >> 16) & 0xF
+            self.gpu.palette.load(self.mem._mem, self.register[x_reg])
+        else:
+            raise ValueError("Invalid opcode")
+
     def stack(self, op_code):
         """Stack push/pop instructions"""
         if op_code >> 20 == 0xC00:
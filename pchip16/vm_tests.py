@@ -3,11 +3,22 @@ pchip16 test runner
 """
 #pylint: disable=I0011, R0904
 
+import pickle
 import unittest
 from pchip16 import VM
+from pchip16.memory import Memory
 from pchip16.vm import CARRY, ZERO, OVERFLOW, NEGATIVE
 import pchip16.utils as utils
 
+def make_vm(words):
+    """Return a VM with big-endian op code words from address 0"""
+    vmac = VM()
+    for index, word in enumerate(words):
+        addr = 4 * index
+        vmac.mem[addr] = ((word >> 16) & 0xFF) << 8 | word >> 24
+        vmac.mem[addr + 2] = (word & 0xFF) << 8 | ((word >> 8) & 0xFF)
+    return vmac
+
 class TestVM(unittest.TestCase):
     """Test aspects of the virtual machine"""
     def setUp(self):
@@ -24,6 +35,24 @@ class TestMisc(TestVM):
         self.vmac.mem[0xDEAD] = 0xBEEF
         self.vmac.execute(0x0701ADDE)
         self.assertLessEqual(self.vmac.register[1], 0xBEEF)
+    def test_RND_seeded(self):
+        values = []
+        for seed in (3, 3, 4):
+            vmac = VM(seed)
+            vmac.mem[0x0] = 0x00FF
+            vmac.execute(0x0701ADDE)
+            vmac.execute(0x0702ADDE)
+            values.append((vmac.register[1], vmac.register[2]))
+        self.assertEqual(values[0], values[1])
+        self.assertNotEqual(values[0], values[2])
+        self.assertLessEqual(max(values[0] + values[2]), 0xFF)
+    def test_RND_state_hashed(self):
+        other = VM()
+        self.vmac.execute(0x0701ADDE)
+        other.execute(0x0701ADDE)
+        self.assertEqual(self.vmac.state_hash(), other.state_hash())
+        self.vmac.seed(1)
+        self.assertNotEqual(self.vmac.state_hash(), other.state_hash())
 
 class TestJumpCodes(TestVM):
     def test_JMP_HHLL_instruction(self):
@@ -926,3 +955,182 @@ class TestStackCodes(TestVM):
         self.assertRaises(ValueError, self.vmac.execute, 0xC5123456)
     def test_invalid_instruction(self):
         self.assertRaises(ValueError, self.vmac.execute, 0xC6000000)
+
+class TestStateHash(TestVM):
+    def test_hash_tracks_memory(self):
+        initial = self.vmac.state_hash()
+        self.vmac.mem[0x1234] = 0xBEEF
+        self.assertNotEqual(self.vmac.state_hash(), initial)
+        self.vmac.mem[0x1234] = 0x0
+        self.assertEqual(self.vmac.state_hash(), initial)
+    def test_hash_tracks_registers(self):
+        initial = self.vmac.state_hash()
+        self.vmac.register[0xF] = 0x1
+        self.assertNotEqual(self.vmac.state_hash(), initial)
+    def test_hash_tracks_pc_sp_flags(self):
+        initial = self.vmac.state_hash()
+        self.vmac.program_counter = 4
+        pc_hash = self.vmac.state_hash()
+        self.vmac.stack_pointer += 2
+        sp_hash = self.vmac.state_hash()
+        self.vmac.flags |= ZERO
+        self.assertEqual(len({initial, pc_hash, sp_hash,
+            self.vmac.state_hash()}), 4)
+    def test_equal_states_hash_equal(self):
+        other = VM()
+        for vmac in (self.vmac, other):
+            vmac.mem[0x10] = 0xAA55
+            vmac.register[3] = 0x7
+        self.assertEqual(self.vmac.state_hash(), other.state_hash())
+    def test_find_loop(self):
+        # ADDI R0, 0x0100 ; JMP 0x0000 with [0x0100] == 0 loops immediately
+        self.vmac.mem[0x0] = 0x0040
+        self.vmac.mem[0x2] = 0x0100
+        self.vmac.mem[0x4] = 0x0010
+        self.assertEqual(self.vmac.find_loop(100), 3)
+    def test_find_loop_progress(self):
+        # ADDI R0, 0x0100 ; JMP 0x0000 with [0x0100] == 1 counts to 0xFFFF
+        self.vmac.mem[0x0] = 0x0040
+        self.vmac.mem[0x2] = 0x0100
+        self.vmac.mem[0x4] = 0x0010
+        self.vmac.mem[0x100] = 0x1
+        self.assertIsNone(self.vmac.find_loop(100))
+
+class TestPickle(TestVM):
+    def test_round_trip(self):
+        self.vmac.mem[0x1234] = 0xBEEF
+        self.vmac.register[0xF] = 0x7
+        self.vmac.program_counter = 0x10
+        self.vmac.flags = CARRY
+        buffers = []
+        data = pickle.dumps(self.vmac, 5, buffer_callback=buffers.append)
+        # Memory, framebuffer and palette travel out-of-band
+        self.assertEqual(len(buffers), 3)
+        copy = pickle.loads(data, buffers=buffers)
+        self.assertEqual(copy.mem[0x1234], 0xBEEF)
+        self.assertEqual(copy.register[0xF], 0x7)
+        self.assertEqual(copy.program_counter, 0x10)
+        self.assertEqual(copy.flags, CARRY)
+        self.assertEqual(copy.state_hash(), self.vmac.state_hash())
+        self.assertIsNot(copy.mem, self.vmac.mem)
+
+class TestRun(TestVM):
+    def test_run_stops_at_VBLNK(self):
+        # NOP ; VBLNK ; NOP
+        self.vmac.mem[0x4] = 0x0002
+        self.assertEqual(self.vmac.run(10), 2)
+        self.assertEqual(self.vmac.program_counter, 0x8)
+    def test_run_cycle_budget(self):
+        self.assertEqual(self.vmac.run(10), 10)
+        self.assertEqual(self.vmac.program_counter, 40)
+    def test_run_frame_latches_controllers(self):
+        self.vmac.mem[0x0] = 0x0002
+        self.vmac.run_frame((0x1, 0x80))
+        self.assertEqual(self.vmac.mem[0xFFF0], 0x1)
+        self.assertEqual(self.vmac.mem[0xFFF2], 0x80)
+        self.assertEqual(self.vmac.frame_count, 1)
+        self.assertIs(type(self.vmac.mem), Memory)
+    def test_reset(self):
+        self.vmac.mem[0x10] = 0xBEEF
+        self.vmac.register[0xF] = 0x1
+        self.vmac.program_counter = 0x20
+        self.vmac.flags = CARRY
+        self.vmac.reset()
+        self.assertEqual(self.vmac.register[0xF], 0)
+        self.assertEqual(self.vmac.program_counter, 0)
+        self.assertEqual(self.vmac.stack_pointer, 0xFDF0)
+        self.assertEqual(self.vmac.flags, 0)
+        self.assertEqual(self.vmac.mem[0x10], 0xBEEF)
+    def test_reset_devices(self):
+        gpu = self.vmac.gpu
+        colors = gpu.palette.colors.copy()
+        self.vmac.mem[0x300] = 0xFFFF
+        self.vmac.execute(0x04000102)
+        self.vmac.execute(0x08000003)
+        self.vmac.execute(0x03000500)
+        self.vmac.execute(0xD0000003)
+        self.vmac.execute(0x0B000001)
+        gpu.framebuffer[10, 10] = 5
+        self.vmac.reset()
+        self.assertFalse(gpu.framebuffer.any())
+        self.assertEqual((gpu.background, gpu.sprite_width,
+            gpu.sprite_height, gpu.flip_h, gpu.flip_v), (0, 0, 0, False,
+            False))
+        self.assertEqual(gpu.palette.colors.tolist(), colors.tolist())
+        self.assertFalse(self.vmac.audio.playing)
+        self.assertFalse(self.vmac.audio.render().any())
+    def test_frame_listeners(self):
+        seen = []
+        listener = lambda vmac: seen.append(vmac.frame_count)
+        # VBLNK ; JMP 0x0000
+        self.vmac.mem[0x0] = 0x0002
+        self.vmac.mem[0x4] = 0x0010
+        self.vmac.add_frame_listener(listener)
+        self.vmac.run_frame()
+        self.vmac.remove_frame_listener(listener)
+        self.vmac.run_frame()
+        self.assertEqual(seen, [1])
+
+class TestGraphicsCodes(TestVM):
+    def setUp(self):
+        super(TestGraphicsCodes, self).setUp()
+        self.vmac.mem[0x400] = 0x3412
+        self.vmac.execute(0x04000201)
+    def test_SPR_instruction(self):
+        self.assertEqual(self.vmac.gpu.sprite_width, 2)
+        self.assertEqual(self.vmac.gpu.sprite_height, 1)
+    def test_DRW_HHLL_instruction(self):
+        self.vmac.register[0] = 10
+        self.vmac.register[1] = 20
+        self.vmac.execute(0x05100004)
+        self.assertEqual(self.vmac.gpu.framebuffer[20, 10:14].tolist(),
+            [1, 2, 3, 4])
+        self.assertFalse(self.vmac.flags & CARRY)
+        self.vmac.execute(0x05100004)
+        self.assertTrue(self.vmac.flags & CARRY)
+    def test_DRW_RZ_instruction(self):
+        self.vmac.register[2] = 0x400
+        self.vmac.execute(0x06100200)
+        self.assertEqual(self.vmac.gpu.framebuffer[0, :4].tolist(),
+            [1, 2, 3, 4])
+        self.assertRaises(ValueError, self.vmac.execute, 0x06100201)
+    def test_FLIP_instruction(self):
+        self.vmac.execute(0x08000002)
+        self.assertTrue(self.vmac.gpu.flip_h)
+        self.assertFalse(self.vmac.gpu.flip_v)
+        self.vmac.execute(0x05000004)
+        self.assertEqual(self.vmac.gpu.framebuffer[0, :4].tolist(),
+            [4, 3, 2, 1])
+    def test_BGC_CLS_instructions(self):
+        self.vmac.execute(0x03000700)
+        self.assertEqual(self.vmac.gpu.background, 7)
+        self.vmac.execute(0x05000004)
+        self.vmac.execute(0x01000000)
+        self.assertEqual(self.vmac.gpu.background, 0)
+        self.assertFalse(self.vmac.gpu.framebuffer.any())
+        self.assertRaises(ValueError, self.vmac.execute, 0x03010700)
+    def test_DRW_sees_sprite_writes(self):
+        self.vmac.execute(0x05000004)
+        self.vmac.execute(0x01000000)
+        self.vmac.mem[0x400] = 0x7756
+        self.vmac.execute(0x05000004)
+        self.assertEqual(self.vmac.gpu.framebuffer[0, :4].tolist(),
+            [5, 6, 7, 7])
+        self.assertEqual(self.vmac.sprite_cache.invalidations, 1)
+
+class TestPaletteCodes(TestVM):
+    def test_PAL_HHLL_instruction(self):
+        self.vmac.mem[0x400] = 0x2010
+        self.vmac.mem[0x402] = 0x0030
+        self.vmac.execute(0xD0000004)
+        self.assertEqual(self.vmac.gpu.palette.colors[0].tolist(),
+            [0x10, 0x20, 0x30])
+    def test_PAL_RX_instruction(self):
+        self.vmac.mem[0x403] = 0x0040
+        self.vmac.register[2] = 0x400
+        self.vmac.execute(0xD1020000)
+        self.assertEqual(self.vmac.gpu.palette.colors[1].tolist(),
+            [0x40, 0x00, 0x00])
+        self.assertRaises(ValueError, self.vmac.execute, 0xD1020001)
+    def test_invalid_instruction(self):
+        self.assertRaises(ValueError, self.vmac.execute, 0xD2000000)
@@ -23,7 +23,13 @@ setup(name='pchip16',
       author_email='brooks@skoorb.net',
       packages=['pchip16'],
       zip_safe=False,
-      install_requires=['crcmod'],
+      install_requires=['crcmod', 'numpy'],
+      entry_points={
+        'console_scripts': [
+            'pchip16 = pchip16.__main__:main',
+            'pchip16-farm = pchip16.farm:main',
+        ],
+      },
       test_suite='nose.collector',
       tests_require=['nose'],
 )